@@ -5,16 +5,23 @@ This file has utilities for working with Ansible
 from __future__ import annotations
 
 import json
+import os
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 from collections.abc import Callable, Mapping
 from functools import partial
 from pathlib import Path
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, cast
 
 import ansible_runner
 from loguru import logger
 
 import boardwalk
+from boardwalk import ansible_worker
 from boardwalk.app_exceptions import BoardwalkException
 
 if TYPE_CHECKING:
@@ -41,6 +48,7 @@ if TYPE_CHECKING:
         cmdline: str | None
         envvars: RunnerKwargsEnvvars
         fact_cache_type: str
+        forks: int
         limit: str | None
         passwords: dict[str, str | None]
         project_dir: str
@@ -56,6 +64,7 @@ if TYPE_CHECKING:
         ANSIBLE_CACHE_PLUGIN_CONNECTION: str
         ANSIBLE_CACHE_PLUGIN: str
         ANSIBLE_NOCOLOR: str
+        ANSIBLE_SSH_CONTROL_PATH_DIR: str
         ANSIBLE_TASK_TIMEOUT: str
 
     class RunnerPlaybook(TypedDict, total=False):
@@ -70,9 +79,150 @@ def ansible_runner_cancel_callback(ws: Workspace):
     """
     ansible_runner needs a callback to tell it to stop execution. It returns
     True to stop execution. We check for the workspace.mutex because that file
-    is always supposed to be torn down on exit
+    is always supposed to be torn down on exit. While the workspace is watched
+    this is answered from memory
     """
-    return not ws.path.joinpath("workspace.mutex").exists()
+    return not ws.has_mutex()
+
+
+# When True, invocations are sent to long-lived ansible_worker processes instead
+# of spawning ansible_runner each time
+_persistent_backend = False
+
+# Per-run directory for SSH ControlPath sockets, so consecutive ansible_runner
+# invocations against a host reuse one authenticated connection
+_ssh_control_path_dir: Path | None = None
+# Seconds from the start of each invocation to the first task result, per host
+_connection_timings: dict[str, list[float]] = {}
+_connection_timings_lock = threading.Lock()
+
+# Unix socket paths are limited to 104 bytes on macOS and 108 on Linux. Ansible
+# names control sockets with a 10 character hash, and ssh appends a 17 character
+# suffix while creating them
+_SSH_SOCKET_PATH_MAX = 104
+_SSH_SOCKET_NAME_OVERHEAD = 1 + 10 + 17
+
+RESULT_RUNNER_EVENTS = {
+    "runner_on_ok",
+    "runner_on_failed",
+    "runner_on_skipped",
+    "runner_on_unreachable",
+}
+
+
+def ssh_control_path_dir_setup(workspace: Workspace) -> Path:
+    """
+    Creates a per-run directory for SSH control sockets under the workspace and
+    uses it for all following ansible_runner invocations. Falls back to a short
+    temporary directory if socket paths under the workspace would be too long.
+    An ANSIBLE_SSH_CONTROL_PATH_DIR set in the environment takes precedence
+    """
+    global _ssh_control_path_dir
+    control_path_dir = Path(tempfile.mkdtemp(prefix="ssh_cp_", dir=workspace.path))
+    if len(str(control_path_dir)) + _SSH_SOCKET_NAME_OVERHEAD > _SSH_SOCKET_PATH_MAX:
+        control_path_dir.rmdir()
+        control_path_dir = Path(tempfile.mkdtemp(prefix="bw_cp_"))
+        if len(str(control_path_dir)) + _SSH_SOCKET_NAME_OVERHEAD > _SSH_SOCKET_PATH_MAX:
+            control_path_dir.rmdir()
+            control_path_dir = Path(tempfile.mkdtemp(prefix="bw_cp_", dir="/tmp"))
+    logger.debug(f"Using SSH control path directory {control_path_dir}")
+    _ssh_control_path_dir = control_path_dir
+    return control_path_dir
+
+
+def ssh_control_path_dir_teardown() -> None:
+    """Closes any SSH master connections left in the per-run control path
+    directory, removes it, and logs how much connection time reuse saved"""
+    global _ssh_control_path_dir
+    control_path_dir = _ssh_control_path_dir
+    if control_path_dir is None:
+        return
+    _ssh_control_path_dir = None
+    log_connection_reuse_summary()
+    for socket_path in control_path_dir.iterdir():
+        try:
+            subprocess.run(
+                ["ssh", "-O", "exit", "-o", f"ControlPath={socket_path}", "boardwalk"],
+                capture_output=True,
+                check=False,
+                timeout=10,
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.debug(f"Could not close SSH master connection {socket_path}: {e}")
+    shutil.rmtree(control_path_dir, ignore_errors=True)
+
+
+def persistent_backend_setup() -> bool:
+    """
+    Sends following invocations to persistent Ansible worker processes. Workers
+    run this Python interpreter, so if Ansible can't be imported by it the
+    subprocess backend is kept, and False is returned
+    """
+    global _persistent_backend
+    if not ansible_worker.ansible_importable():
+        logger.warning(
+            f"Ansible can't be imported by {sys.executable}, so the persistent ansible_backend can't be used."
+            " Falling back to the subprocess backend"
+        )
+        return False
+    _persistent_backend = True
+    return True
+
+
+def persistent_backend_teardown() -> None:
+    """Stops any persistent Ansible worker processes"""
+    global _persistent_backend
+    _persistent_backend = False
+    ansible_worker.shutdown_workers()
+
+
+def record_connection_timing(host: str, seconds: float) -> None:
+    """Records the time an invocation took to return its first result for a host"""
+    with _connection_timings_lock:
+        _connection_timings.setdefault(host, []).append(seconds)
+
+
+def log_connection_reuse_summary() -> None:
+    """
+    Logs, per host, how long the first invocation took to return a result on a
+    new SSH connection against the average for invocations that reused it. The
+    difference, multiplied by the number of reused invocations, is an estimate of
+    the connection setup time saved
+    """
+    with _connection_timings_lock:
+        timings = {host: list(seconds) for host, seconds in _connection_timings.items()}
+        _connection_timings.clear()
+    for host, seconds in sorted(timings.items()):
+        if len(seconds) < 2:
+            continue
+        first = seconds[0]
+        reused = seconds[1:]
+        reused_avg = sum(reused) / len(reused)
+        saved = max(first - reused_avg, 0) * len(reused)
+        logger.info(
+            f"{host}: SSH connection reuse: first result after {first:.2f}s on a new connection,"
+            f" {reused_avg:.2f}s average over {len(reused)} reused invocations;"
+            f" ~{saved:.2f}s of connection setup saved"
+        )
+
+
+def timed_event_handler(
+    started: float,
+    event_handler: Callable[[dict[str, Any]], bool] | None = None,
+) -> Callable[[dict[str, Any]], bool]:
+    """Wraps an ansible_runner event handler to record the time to the first task
+    result for each host in an invocation"""
+    hosts_seen: set[str] = set()
+
+    def handler(event_data: dict[str, Any]) -> bool:
+        if event_data.get("event") in RESULT_RUNNER_EVENTS:
+            host = event_data.get("event_data", {}).get("host")
+            if host and host not in hosts_seen:
+                hosts_seen.add(host)
+                record_connection_timing(host, time.monotonic() - started)
+        return event_handler(event_data) if event_handler else True
+
+    return handler
 
 
 FAILED_RUNNER_EVENTS = {
@@ -163,6 +313,7 @@ def ansible_runner_run_tasks(
     become: bool = False,
     become_password: str | None = None,
     check: bool = False,
+    forks: int | None = None,
     gather_facts: bool = True,
     limit: str | None = None,
     quiet: bool = True,
@@ -195,12 +346,17 @@ def ansible_runner_run_tasks(
     }
     if check:
         runner_kwargs["cmdline"] = "--check"
+    if forks:
+        runner_kwargs["forks"] = forks
     if limit:
         runner_kwargs["limit"] = limit
     if timeout:
         runner_kwargs["envvars"]["ANSIBLE_TASK_TIMEOUT"] = str(timeout)
     if event_handler:
         runner_kwargs["event_handler"] = event_handler
+    if _ssh_control_path_dir and "ANSIBLE_SSH_CONTROL_PATH_DIR" not in os.environ:
+        runner_kwargs["envvars"]["ANSIBLE_SSH_CONTROL_PATH_DIR"] = str(_ssh_control_path_dir)
+        runner_kwargs["event_handler"] = timed_event_handler(time.monotonic(), event_handler)
 
     logger.trace(f"Constructing runner_kwargs for job type {job_type.name}")
     if job_type == boardwalk.manifest.JobTypes.TASK:
@@ -223,7 +379,15 @@ def ansible_runner_run_tasks(
         output_msg_prefix = f"{hosts}(limit: {limit}): ansible_runner invocation"
     output_msg = f"{output_msg_prefix}: {invocation_msg}"
     logger.info(output_msg)
-    runner: Runner = ansible_runner.run(**runner_kwargs)  # type: ignore
+    if _persistent_backend:
+        runner: Runner = ansible_worker_run(  # type: ignore
+            runner_kwargs=runner_kwargs,
+            become_password=become_password,
+            check=check,
+            timeout=timeout,
+        )
+    else:
+        runner = ansible_runner.run(**runner_kwargs)  # type: ignore
     runner_errors = ansible_runner_errors_to_output(runner)
     fail_msg = f"Error:\n{output_msg}\n{runner_errors}"
     if runner.rc != 0:
@@ -240,6 +404,45 @@ def ansible_runner_run_tasks(
         return runner
 
 
+def ansible_worker_run(
+    runner_kwargs: RunnerKwargs,
+    become_password: str | None,
+    check: bool,
+    timeout: int | None,
+) -> ansible_worker.PersistentRunnerResult:
+    """Runs the plays described by runner_kwargs on this thread's persistent Ansible worker"""
+    playbook = runner_kwargs.get("playbook", [])
+    plays: list[RunnerPlaybook] | AnsibleTasksType
+    if isinstance(playbook, dict):
+        # A single play, built for a task job
+        play = playbook.copy()
+        if timeout:
+            # The worker's environment is fixed when it starts, so ANSIBLE_TASK_TIMEOUT
+            # is applied as a task keyword instead
+            play["tasks"] = [{"timeout": timeout} | task for task in play.get("tasks", [])]
+        plays = [play]
+    else:
+        plays = playbook
+    # Ask-pass settings don't apply, since the become password is sent with the request
+    envvars = cast("dict[str, str]", dict(runner_kwargs.get("envvars", {})))
+    envvars.pop("ANSIBLE_BECOME_ASK_PASS", None)
+    worker = ansible_worker.get_worker(envvars)
+    return worker.run(
+        request={
+            "become_password": become_password,
+            "check": check,
+            "extravars": runner_kwargs.get("extravars") or {},
+            "forks": runner_kwargs.get("forks"),
+            "limit": runner_kwargs.get("limit"),
+            "plays": plays,
+            "verbosity": runner_kwargs.get("verbosity", 0),
+        },
+        quiet=runner_kwargs.get("quiet", True),
+        event_handler=runner_kwargs.get("event_handler"),
+        cancel_callback=runner_kwargs.get("cancel_callback"),
+    )
+
+
 def ansible_inventory() -> InventoryData:
     """Uses ansible-inventory to fetch the inventory and returns it as a dict"""
     logger.info("Processing ansible-inventory")
@@ -0,0 +1,363 @@
+"""
+A long-lived Ansible executor process, used by the "persistent" ansible_backend
+
+Spawning ansible_runner for each invocation pays Python interpreter start-up,
+Ansible plugin loading and inventory parsing every time. The worker process
+started here does that work once, then executes plays sent to it over stdin as
+JSON lines, streaming back events in the same shape as ansible_runner's events.
+One worker is kept per calling thread, so hosts running in parallel each get
+their own
+"""
+
+from __future__ import annotations
+
+import copy
+import importlib.util
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from typing import TypedDict
+
+    class WorkerRequest(TypedDict):
+        become_password: str | None
+        check: bool
+        extravars: dict[str, Any]
+        forks: int | None
+        limit: str | None
+        plays: list[Any]
+        verbosity: int
+
+
+# The status and rc reported when an invocation is canceled, matching ansible_runner
+CANCELED_RC = 254
+
+
+class PersistentRunnerResult:
+    """The subset of ansible_runner.Runner that Boardwalk uses, for results from the worker"""
+
+    def __init__(self, rc: int, status: str, events: list[dict[str, Any]]):
+        self.rc = rc
+        self.status = status
+        self.events = events
+
+
+class AnsibleWorker:
+    """Client for a single worker process"""
+
+    # Seconds between checks of the cancel callback while a request runs
+    cancel_check_interval = 1.0
+
+    def __init__(self, envvars: dict[str, str], command: list[str] | None = None):
+        self.command = command if command is not None else [sys.executable, "-m", "boardwalk.ansible_worker"]
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=Path.cwd(),
+            env=os.environ | envvars,
+            start_new_session=True,
+            text=True,
+        )
+        self._lines: queue.Queue[str | None] = queue.Queue()
+        self._reader = threading.Thread(target=self._read_lines, daemon=True)
+        self._reader.start()
+
+    def _read_lines(self):
+        """Moves lines from the worker's stdout to a queue, so reads can time out"""
+        if not self.process.stdout:
+            raise RuntimeError("AnsibleWorker process has no stdout")
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(
+        self,
+        request: WorkerRequest,
+        quiet: bool = True,
+        event_handler: Callable[[dict[str, Any]], bool] | None = None,
+        cancel_callback: Callable[[], bool] | None = None,
+    ) -> PersistentRunnerResult:
+        """Sends a request to the worker and collects events until it finishes"""
+        if not self.process.stdin:
+            raise RuntimeError("AnsibleWorker process has no stdin")
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+
+        events: list[dict[str, Any]] = []
+        last_cancel_check = time.monotonic()
+        while True:
+            # Checked whether or not events are arriving, like ansible_runner does
+            if cancel_callback and time.monotonic() - last_cancel_check >= self.cancel_check_interval:
+                last_cancel_check = time.monotonic()
+                if cancel_callback():
+                    self.close(kill=True)
+                    return PersistentRunnerResult(rc=CANCELED_RC, status="canceled", events=events)
+            try:
+                line = self._lines.get(timeout=self.cancel_check_interval)
+            except queue.Empty:
+                continue
+            if line is None:
+                return PersistentRunnerResult(rc=self.process.wait(), status="failed", events=events)
+
+            message = json.loads(line)
+            if "rc" in message:
+                status = "successful" if message["rc"] == 0 else "failed"
+                return PersistentRunnerResult(rc=message["rc"], status=status, events=events)
+            event = message["event"]
+            if event["event"] == "error":
+                logger.error(f"Persistent Ansible worker error: {event['stdout']}")
+            if not quiet and event.get("stdout"):
+                print(event["stdout"], flush=True)
+            if event_handler is None or event_handler(event) is not False:
+                events.append(event)
+
+    def close(self, kill: bool = False):
+        """Stops the worker. Closing stdin lets it exit cleanly; kill stops it immediately"""
+        if not self.alive():
+            return
+        if kill:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        elif self.process.stdin:
+            self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+def ansible_importable() -> bool:
+    """Returns True if Ansible can be imported by worker processes, which run this interpreter"""
+    return importlib.util.find_spec("ansible") is not None
+
+
+_workers = threading.local()
+_all_workers: list[AnsibleWorker] = []
+_all_workers_lock = threading.Lock()
+
+
+def get_worker(envvars: dict[str, str]) -> AnsibleWorker:
+    """Returns this thread's worker, starting one if it doesn't exist or has died"""
+    worker: AnsibleWorker | None = getattr(_workers, "worker", None)
+    if worker is None or not worker.alive():
+        logger.debug("Starting persistent Ansible worker")
+        worker = AnsibleWorker(envvars)
+        _workers.worker = worker
+        with _all_workers_lock:
+            _all_workers.append(worker)
+    return worker
+
+
+def shutdown_workers():
+    """Stops all workers started by this process"""
+    with _all_workers_lock:
+        workers = list(_all_workers)
+        _all_workers.clear()
+    for worker in workers:
+        worker.close()
+
+
+def _serve():  # pragma: no cover - requires Ansible and real hosts
+    """Worker process main loop. Loads Ansible once, then executes requests"""
+    from ansible import constants as C  # pyright: ignore[reportMissingImports]
+    from ansible import context  # pyright: ignore[reportMissingImports]
+    from ansible.errors import AnsibleError  # pyright: ignore[reportMissingImports]
+    from ansible.executor.playbook_executor import PlaybookExecutor  # pyright: ignore[reportMissingImports]
+    from ansible.inventory.manager import InventoryManager  # pyright: ignore[reportMissingImports]
+    from ansible.module_utils.common.collections import ImmutableDict  # pyright: ignore[reportMissingImports]
+    from ansible.module_utils.common.json import AnsibleJSONEncoder  # pyright: ignore[reportMissingImports]
+    from ansible.parsing.dataloader import DataLoader  # pyright: ignore[reportMissingImports]
+    from ansible.plugins.callback import CallbackBase  # pyright: ignore[reportMissingImports]
+    from ansible.plugins.loader import init_plugin_loader  # pyright: ignore[reportMissingImports]
+    from ansible.utils.display import Display  # pyright: ignore[reportMissingImports]
+    from ansible.vars.manager import VariableManager  # pyright: ignore[reportMissingImports]
+
+    # Anything Ansible prints goes to stderr, so stdout only carries the protocol
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def emit(message: dict[str, Any]):
+        try:
+            line = json.dumps(message, cls=AnsibleJSONEncoder)
+        except TypeError:
+            line = json.dumps(message, default=str)
+        protocol.write(line + "\n")
+        protocol.flush()
+
+    class EventCallback(CallbackBase):
+        """Emits ansible_runner style events for each callback"""
+
+        CALLBACK_VERSION = 2.0
+        CALLBACK_TYPE = "stdout"
+        CALLBACK_NAME = "boardwalk_worker"
+
+        def _emit_result(self, event: str, result, stdout: str, **extra):
+            task = result._task
+            emit(
+                {
+                    "event": {
+                        "event": event,
+                        "stdout": stdout,
+                        "event_data": {
+                            "host": result._host.get_name(),
+                            "task": task.get_name(),
+                            "task_action": task.action,
+                            "role": task._role.get_name() if task._role else "",
+                            "res": result._result,
+                            **extra,
+                        },
+                    }
+                }
+            )
+
+        def v2_playbook_on_task_start(self, task, is_conditional):
+            name = task.get_name()
+            emit(
+                {
+                    "event": {
+                        "event": "playbook_on_task_start",
+                        "stdout": f"TASK [{name}]",
+                        "event_data": {"task": name, "role": task._role.get_name() if task._role else ""},
+                    }
+                }
+            )
+
+        def v2_runner_on_ok(self, result):
+            status = "changed" if result._result.get("changed") else "ok"
+            self._emit_result("runner_on_ok", result, f"{status}: [{result._host.get_name()}]")
+
+        def v2_runner_on_failed(self, result, ignore_errors=False):
+            msg = result._result.get("msg", "")
+            self._emit_result(
+                "runner_on_failed",
+                result,
+                f"fatal: [{result._host.get_name()}]: FAILED! => {msg}",
+                ignore_errors=ignore_errors,
+            )
+
+        def v2_runner_on_skipped(self, result):
+            self._emit_result("runner_on_skipped", result, f"skipping: [{result._host.get_name()}]")
+
+        def v2_runner_on_unreachable(self, result):
+            msg = result._result.get("msg", "")
+            self._emit_result(
+                "runner_on_unreachable", result, f"fatal: [{result._host.get_name()}]: UNREACHABLE! => {msg}"
+            )
+
+        def v2_runner_item_on_ok(self, result):
+            self._emit_result("runner_item_on_ok", result, f"ok: [{result._host.get_name()}] (item)")
+
+        def v2_runner_item_on_failed(self, result):
+            self._emit_result("runner_item_on_failed", result, f"failed: [{result._host.get_name()}] (item)")
+
+        def v2_runner_item_on_skipped(self, result):
+            self._emit_result("runner_item_on_skipped", result, f"skipping: [{result._host.get_name()}] (item)")
+
+        def v2_playbook_on_stats(self, stats):
+            summary = {
+                key: getattr(stats, key)
+                for key in ("changed", "dark", "failures", "ignored", "ok", "processed", "rescued", "skipped")
+            }
+            lines = ["PLAY RECAP"]
+            for host in sorted(stats.processed):
+                s = stats.summarize(host)
+                lines.append(
+                    f"{host}: ok={s['ok']} changed={s['changed']} unreachable={s['unreachable']}"
+                    f" failed={s['failures']} skipped={s['skipped']} rescued={s['rescued']} ignored={s['ignored']}"
+                )
+            emit({"event": {"event": "playbook_on_stats", "stdout": "\n".join(lines), "event_data": summary}})
+
+    # Sets up collection loading, as the ansible CLIs do before running anything
+    init_plugin_loader()
+    display = Display()
+    loader = DataLoader()
+    inventory = InventoryManager(loader=loader, sources=C.DEFAULT_HOST_LIST)
+    # The parsed inventory is kept, but add_host and group_by change it while
+    # plays run, so each request starts from a copy of it as it was parsed
+    parsed_inventory = copy.deepcopy(inventory._inventory)
+
+    for line in sys.stdin:
+        request: WorkerRequest = json.loads(line)
+        display.verbosity = request["verbosity"]
+        context.CLIARGS = ImmutableDict(
+            become=False,
+            become_method=C.DEFAULT_BECOME_METHOD,
+            become_user=None,
+            check=request["check"],
+            connection="smart",
+            diff=False,
+            flush_cache=False,
+            forks=request.get("forks") or C.DEFAULT_FORKS,
+            listhosts=False,
+            listtags=False,
+            listtasks=False,
+            module_path=None,
+            skip_tags=(),
+            start_at_task=None,
+            step=False,
+            subset=request["limit"],
+            syntax=False,
+            tags=("all",),
+            verbosity=request["verbosity"],
+        )
+        inventory._inventory = copy.deepcopy(parsed_inventory)
+        inventory.clear_caches()
+        inventory.subset(request["limit"])
+        # Facts, set_fact and registered vars are held by the variable manager,
+        # so a new one keeps them from carrying over between requests, the same
+        # as with separate ansible_runner processes
+        variable_manager = VariableManager(loader=loader, inventory=inventory)
+        variable_manager._extra_vars = request["extravars"]
+
+        # Plays are written next to the Boardwalkfile, as ansible_runner does,
+        # so relative import_playbook paths resolve the same way
+        with tempfile.NamedTemporaryFile(
+            "w", dir=Path.cwd(), prefix=".boardwalk_play_", suffix=".json", delete=False
+        ) as fd:
+            json.dump(request["plays"], fd)
+        try:
+            passwords = {"become_pass": request["become_password"]} if request["become_password"] else {}
+            executor = PlaybookExecutor(
+                playbooks=[fd.name],
+                inventory=inventory,
+                variable_manager=variable_manager,
+                loader=loader,
+                passwords=passwords,
+            )
+            if executor._tqm:
+                callback = EventCallback()
+                if hasattr(executor._tqm, "_stdout_callback_name"):
+                    # ansible-core 2.19 and later load the stdout callback by
+                    # name, unless the callbacks are already populated
+                    callback._init_callback_methods()
+                    executor._tqm._callback_plugins.append(callback)
+                else:
+                    executor._tqm._stdout_callback = callback
+            rc = executor.run()
+        except AnsibleError as e:
+            emit({"event": {"event": "error", "stdout": f"{e}\n{traceback.format_exc()}", "event_data": {}}})
+            rc = 1
+        finally:
+            os.unlink(fd.name)
+        emit({"rc": rc})
+
+
+if __name__ == "__main__":
+    _serve()
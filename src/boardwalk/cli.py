@@ -17,6 +17,7 @@ from boardwalk.cli_catch import catch, release
 from boardwalk.cli_init import init
 from boardwalk.cli_login import login
 from boardwalk.cli_run import check, run
+from boardwalk.cli_survey import survey
 from boardwalk.cli_workspace import workspace
 from boardwalk.manifest import (
     ManifestNotFound,
@@ -114,4 +115,5 @@ cli.add_command(init)
 cli.add_command(login)
 cli.add_command(release)
 cli.add_command(run)
+cli.add_command(survey)
 cli.add_command(workspace)
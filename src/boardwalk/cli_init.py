@@ -4,8 +4,13 @@ init CLI subcommand
 
 from __future__ import annotations
 
-from pathlib import Path
-from typing import TYPE_CHECKING, TypedDict
+import concurrent.futures
+import json
+import os
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Any, TextIO, TypedDict, cast
 
 import click
 from loguru import logger
@@ -19,9 +24,13 @@ from boardwalk.ansible import (
 )
 from boardwalk.app_exceptions import BoardwalkException
 from boardwalk.host import Host
+from boardwalk.inventory import get_inventory
 from boardwalk.manifest import JobTypes, NoActiveWorkspace, Workspace, get_ws
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+
     from ansible_runner import RunnerEvent
 
     from boardwalk.ansible import AnsibleTasksType
@@ -42,6 +51,12 @@ if TYPE_CHECKING:
     help="An Ansible pattern to limit hosts by. Defaults to no limit",
     default="all",
 )
+@click.option(
+    "--resume/--no-resume",
+    default=False,
+    help="Resume an interrupted init, skipping hosts whose facts were already saved",
+    show_default=True,
+)
 @click.option(
     "--retry/--no-retry",
     "-r/-nr",
@@ -49,8 +64,34 @@ if TYPE_CHECKING:
     help="Retry getting state for hosts that were unreachable/failed on the last attempt",
     show_default=True,
 )
+@click.option(
+    "--shard-size",
+    help="Split hosts into shards of at most this many hosts, each gathered by its own Ansible process. 0 disables sharding",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "--shard-groups",
+    help="An Ansible pattern of inventory groups. Hosts are sharded by the first of these groups they are in",
+    default="",
+)
+@click.option(
+    "--shard-concurrency",
+    help="The maximum number of shards gathered at once. Defaults to the number of CPUs",
+    type=click.IntRange(min=1),
+    default=None,
+)
 @click.pass_context
-def init(ctx: click.Context, limit: str, retry: bool):
+def init(
+    ctx: click.Context,
+    limit: str,
+    resume: bool,
+    retry: bool,
+    shard_size: int,
+    shard_groups: str,
+    shard_concurrency: int | None,
+):
     """
     Inits the workspace state with host data. Gathers Ansible facts for hosts
     matching the workspaces host pattern. OK to run multiple times; hosts are
@@ -60,6 +101,8 @@ def init(ctx: click.Context, limit: str, retry: bool):
     if retry and limit not in ["all", ""]:
         # We don't allow limit and retry to be specified together at the moment
         raise BoardwalkException("--limit and --retry cannot be supplied together")
+    if resume and (retry or limit not in ["all", ""]):
+        raise BoardwalkException("--resume continues the interrupted init's --limit or --retry; they can't be supplied")
 
     try:
         ws = get_ws()
@@ -73,6 +116,7 @@ def init(ctx: click.Context, limit: str, retry: bool):
     ctx.call_on_close(ws.unmutex)
 
     retry_file_path = ws.path.joinpath("init.retry")
+    checkpoint = InitCheckpoint(ws.path.joinpath("init.checkpoint"))
 
     # Set-up Ansible args
     runner_kwargs: runnerKwargs = {
@@ -80,7 +124,7 @@ def init(ctx: click.Context, limit: str, retry: bool):
         "hosts": ws.cfg.host_pattern,
         "invocation_msg": "Gathering facts",
         "limit": limit,
-        "tasks": [{"name": "setup", "ansible.builtin.setup": {"gather_timeout": 30}}],
+        "tasks": [{"name": "setup", "ansible.builtin.setup": ws.cfg.setup_args}],
         "timeout": 300,
     }
     if retry:
@@ -88,47 +132,60 @@ def init(ctx: click.Context, limit: str, retry: bool):
             raise BoardwalkException("No retry file exists")
         runner_kwargs["limit"] = f"@{retry_file_path!s}"
 
+    # Hosts are listed up front when they need to be split up or filtered
+    target_hosts: list[str] | None = None
+    if resume:
+        try:
+            resume_limit, done_hosts = checkpoint.load()
+        except FileNotFoundError:
+            raise BoardwalkException("There is no interrupted init to resume")
+        target_hosts = [
+            host
+            for host in get_inventory(ttl=ws.cfg.inventory_cache_ttl).resolve_limit(ws.cfg.host_pattern, resume_limit)
+            if host not in done_hosts
+        ]
+        logger.info(f"Resuming init: {len(done_hosts)} host(s) already saved, {len(target_hosts)} remaining")
+        if not target_hosts:
+            checkpoint.remove()
+            return
+    else:
+        checkpoint.start(runner_kwargs["limit"])
+        if shard_size or shard_groups:
+            target_hosts = get_inventory(ttl=ws.cfg.inventory_cache_ttl).resolve_limit(
+                ws.cfg.host_pattern, runner_kwargs["limit"]
+            )
+
+    # Each shard is a limit passed to its own Ansible process
+    shards_dir = ws.path.joinpath("init.shards")
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    shard_limits = [runner_kwargs["limit"]]
+    if target_hosts is not None:
+        groups = get_inventory(ttl=ws.cfg.inventory_cache_ttl).group_index(shard_groups)
+        shard_limits = write_init_shards(shards_dir, split_init_shards(target_hosts, shard_size, groups))
+
     # Save the host pattern we are initializing with. If the pattern changes after
     # this point, other operations will need the state reset and init to be re-done
     ws.state.host_pattern = ws.cfg.host_pattern
 
+    # Facts are saved as each host's events arrive, rather than after Ansible finishes
+    event_handler = InitEventHandler(ws, checkpoint, retry_file_path.with_name("init.retry.new"))
+
     # Run Ansible
-    hosts_were_unreachable = False
     try:
-        runner = ansible_runner_run_tasks(**runner_kwargs, job_type=JobTypes.TASK)
-    except (
-        AnsibleRunnerFailedHost,
-        AnsibleRunnerGeneralError,
-        AnsibleRunnerUnreachableHost,
-    ) as e:
-        # Unreachable and failed hosts are not a hard failure
-        # We note to the user later on if hosts were unreachable
-        hosts_were_unreachable = True
-        runner = e.runner
-    except AnsibleRunError as e:
-        # If we encounter this error type, there is likely some local error, so
-        # we try to print out some debug info and bail
-        for event in e.runner.events:
-            try:
-                logger.error(event["stdout"])
-            except KeyError:
-                pass
-        raise BoardwalkException("Failed to start fact gathering")
-
-    # Clear the retry file after we use it to start fresh before we build a new one
-    retry_file_path.unlink(missing_ok=True)
+        hosts_were_unreachable = run_init_shards(
+            runner_kwargs, shard_limits, shard_concurrency or os.cpu_count() or 1, event_handler
+        )
+    finally:
+        # Checkpoint whatever was saved, even if init is interrupted
+        event_handler.close()
 
-    # Process Ansible output
-    # Collects facts into state
-    for event in runner.events:
-        add_gathered_facts_to_state(event, ws)
-        handle_failed_init_hosts(event, retry_file_path)
+    # Replace the retry file we may have used with the hosts that failed this time
+    retry_file_path.unlink(missing_ok=True)
+    if event_handler.retry_file_path.exists():
+        event_handler.retry_file_path.rename(retry_file_path)
     ws.flush()
-
-    # Write out stats
-    for event in runner.events:
-        if event["event"] == "playbook_on_stats":
-            click.echo(event["stdout"])
+    checkpoint.remove()
+    shutil.rmtree(shards_dir, ignore_errors=True)
 
     # Note if any hosts were unreachable
     if hosts_were_unreachable:
@@ -139,30 +196,205 @@ def init(ctx: click.Context, limit: str, retry: bool):
         raise BoardwalkException("No hosts gathered")
 
 
-def add_gathered_facts_to_state(event: RunnerEvent, ws: Workspace):
+def split_init_shards(hosts: list[str], shard_size: int, groups: dict[str, str] | None = None) -> list[list[str]]:
+    """
+    Splits hosts into shards. Hosts are first split by the group they are
+    mapped to in groups, if any, then into shards of at most shard_size hosts
+    """
+    by_group: dict[str | None, list[str]] = {}
+    for host in hosts:
+        by_group.setdefault((groups or {}).get(host), []).append(host)
+    shards: list[list[str]] = []
+    for group_hosts in by_group.values():
+        size = shard_size or len(group_hosts)
+        shards.extend(group_hosts[i : i + size] for i in range(0, len(group_hosts), size))
+    return shards
+
+
+def write_init_shards(shards_dir: Path, shards: list[list[str]]) -> list[str]:
+    """Writes each shard's hosts to a file, and returns Ansible limits for them"""
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    limits: list[str] = []
+    for i, shard in enumerate(shards):
+        path = shards_dir.joinpath(f"shard-{i:04d}")
+        path.write_text("".join(f"{host}\n" for host in shard))
+        limits.append(f"@{path!s}")
+    return limits
+
+
+def run_init_shards(
+    runner_kwargs: runnerKwargs, shard_limits: list[str], concurrency: int, event_handler: InitEventHandler
+) -> bool:
     """
-    Adds or updates gathered host facts in the workspace state
+    Gathers facts for each shard in its own Ansible process, running up to
+    concurrency shards at once. Returns True if any hosts were unreachable or
+    failed
+    """
+
+    def run_shard(index: int, shard_limit: str) -> bool:
+        start_time = time.monotonic()
+        shard_kwargs: runnerKwargs = {**runner_kwargs, "limit": shard_limit}
+        if len(shard_limits) > 1:
+            shard_kwargs["invocation_msg"] = (
+                f"{runner_kwargs.get('invocation_msg', 'Gathering facts')} (shard {index + 1}/{len(shard_limits)})"
+            )
+        hosts_were_unreachable = False
+        try:
+            ansible_runner_run_tasks(**shard_kwargs, job_type=JobTypes.TASK, event_handler=event_handler)
+        except (
+            AnsibleRunnerFailedHost,
+            AnsibleRunnerGeneralError,
+            AnsibleRunnerUnreachableHost,
+        ):
+            # Unreachable and failed hosts are not a hard failure
+            # We note to the user later on if hosts were unreachable
+            hosts_were_unreachable = True
+        except AnsibleRunError as e:
+            # If we encounter this error type, there is likely some local error, so
+            # we try to print out some debug info and bail
+            for event in e.runner.events:
+                try:
+                    logger.error(event["stdout"])
+                except KeyError:
+                    pass
+            raise BoardwalkException("Failed to start fact gathering")
+        if len(shard_limits) > 1:
+            logger.info(f"Shard {index + 1}/{len(shard_limits)} finished in {time.monotonic() - start_time:.1f}s")
+        return hosts_were_unreachable
+
+    if len(shard_limits) == 1:
+        return run_shard(0, shard_limits[0])
+
+    start_time = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(concurrency, len(shard_limits)), thread_name_prefix="boardwalk_init_shard"
+    ) as executor:
+        results = list(executor.map(run_shard, range(len(shard_limits)), shard_limits))
+    logger.info(
+        f"Gathered facts for {event_handler.hosts_gathered} host(s) in {len(shard_limits)} shards"
+        f" in {time.monotonic() - start_time:.1f}s"
+    )
+    return any(results)
+
+
+class InitCheckpoint:
+    """
+    Records the hosts an init has saved facts for, as JSON lines after a first
+    line holding the init's limit, so that an interrupted init can be resumed
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def start(self, limit: str):
+        self.path.write_text(json.dumps({"limit": limit}) + "\n")
+
+    def record(self, hosts: list[str]):
+        with open(self.path, "a") as fd:
+            fd.write("".join(json.dumps({"host": host}) + "\n" for host in hosts))
+
+    def load(self) -> tuple[str, set[str]]:
+        """Returns the limit and the hosts already saved. Raises FileNotFoundError
+        if there is no checkpoint"""
+        with open(self.path) as fd:
+            limit: str = json.loads(fd.readline())["limit"]
+            hosts: set[str] = set()
+            for line in fd:
+                try:
+                    hosts.add(json.loads(line)["host"])
+                except ValueError:
+                    # The last line may have been cut short by the interruption
+                    break
+        return limit, hosts
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+
+class InitEventHandler:
+    """
+    ansible_runner event handler for init. Each host's facts are written to the
+    state as they arrive and then dropped from memory, and failed hosts are
+    written to a retry file. Progress is checkpointed every checkpoint_interval
+    hosts, after the state's index includes them
+    """
+
+    checkpoint_interval = 100
+
+    def __init__(self, ws: Workspace, checkpoint: InitCheckpoint, retry_file_path: Path):
+        self.ws = ws
+        self.checkpoint = checkpoint
+        self.retry_file_path = retry_file_path
+        self.retry_file_path.unlink(missing_ok=True)
+        self._retry_file: TextIO | None = None
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        self.hosts_gathered = 0
+
+    def __call__(self, event_data: dict[str, Any]) -> bool:
+        """Returns False for events that were consumed, so ansible_runner doesn't keep them"""
+        event = cast("RunnerEvent", event_data)
+        if add_gathered_facts_to_state(event, self.ws):
+            with self._lock:
+                self.hosts_gathered += 1
+                self._pending.append(event["event_data"]["host"])
+                if len(self._pending) >= self.checkpoint_interval:
+                    self._checkpoint()
+            return False
+        with self._lock:
+            handle_failed_init_hosts(event, self._retry_fd)
+        if event["event"] == "playbook_on_stats":
+            click.echo(event["stdout"])
+        return True
+
+    def _retry_fd(self) -> TextIO:
+        if self._retry_file is None:
+            # Held open for the whole init, and closed by close()
+            self._retry_file = open(self.retry_file_path, "a", buffering=1)  # noqa: SIM115
+        return self._retry_file
+
+    def _checkpoint(self):
+        if self._pending:
+            self.ws.flush_index()
+            self.checkpoint.record(self._pending)
+            self._pending = []
+
+    def close(self):
+        with self._lock:
+            self._checkpoint()
+            if self._retry_file is not None:
+                self._retry_file.close()
+                self._retry_file = None
+
+
+def add_gathered_facts_to_state(event: RunnerEvent, ws: Workspace) -> bool:
+    """
+    Adds or updates gathered host facts in the workspace state, and writes the
+    host to disk. Returns True if the event held facts
     """
     if event["event"] == "runner_on_ok" and event["event_data"]["task"] == "setup":
+        hostname = event["event_data"]["host"]
+        facts = ws.cfg.filter_facts(event["event_data"]["res"]["ansible_facts"])
         # If the host is already in the statefile, just update record
-        if event["event_data"]["host"] in ws.state.hosts:
-            ws.state.hosts[event["event_data"]["host"]].ansible_facts = event["event_data"]["res"]["ansible_facts"]
+        if hostname in ws.state.hosts:
+            host = ws.state.hosts[hostname]
         # Otherwise, add the host to the state as a new host
         else:
-            ws.state.hosts[event["event_data"]["host"]] = Host(
-                ansible_facts=event["event_data"]["res"]["ansible_facts"],
-                name=event["event_data"]["host"],
-            )
+            host = ws.state.hosts[hostname] = Host(ansible_facts={}, name=hostname)
+        host.set_facts(facts)
+        ws.flush_host(host, index=False)
+        ws.state.hosts.unload(hostname)
+        return True
+    return False
 
 
-def handle_failed_init_hosts(event: RunnerEvent, retry_file_path: Path):
+def handle_failed_init_hosts(event: RunnerEvent, retry_fd: Callable[[], TextIO]):
     """Processes runner events to find failed hosts during init. Saves any failed
     or unreachable hosts to a retry file and writes warnings and errors to stdout"""
     # Save any unreachable/failed hosts to the retry file
     if event["event"] == "runner_on_unreachable" or event["event"] == "runner_on_failed":
         logger.warning(event["stdout"])
-        with open(retry_file_path, "a") as file:
-            file.write(f"{event['event_data']['host']}\n")
+        retry_fd().write(f"{event['event_data']['host']}\n")
     # If no hosts matched or there are warnings, write them out
     if event["event"] == "warning" or event["event"] == "playbook_on_no_hosts_matched":
         logger.warning(event["stdout"])
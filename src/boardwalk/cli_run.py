@@ -9,14 +9,12 @@ import getpass
 import os
 import random
 import socket
-import sys
 import time
-from collections.abc import Mapping
-from itertools import chain
-from pathlib import Path
+from collections import deque
+from collections.abc import Iterable, Mapping
+from itertools import chain, islice
 from typing import TYPE_CHECKING, Any
 
-import ansible_runner
 import click
 from loguru import logger
 from tornado.httpclient import HTTPClientError
@@ -28,11 +26,16 @@ from boardwalk.ansible import (
     AnsibleRunnerFailedHost,
     AnsibleRunnerGeneralError,
     AnsibleRunnerUnreachableHost,
-    ansible_inventory,
     ansible_runner_errors_to_output,
+    persistent_backend_setup,
+    persistent_backend_teardown,
+    ssh_control_path_dir_setup,
+    ssh_control_path_dir_teardown,
 )
 from boardwalk.app_exceptions import BoardwalkException
+from boardwalk.cli_survey import format_survey_table, survey_hosts
 from boardwalk.host import Host, RemoteHostLocked
+from boardwalk.inventory import Inventory, get_inventory
 from boardwalk.manifest import NoActiveWorkspace, Workspace, get_boardwalkd_url, get_ws
 from boardwalk.state import RemoteStateModel, RemoteStateWorkflow, RemoteStateWorkspace
 from boardwalk.utils import strtobool
@@ -42,11 +45,10 @@ from boardwalkd.protocol import (
     WorkspaceDetails,
     WorkspaceEvent,
     WorkspaceHasMutex,
+    WorkspaceSemaphores,
 )
 
 if TYPE_CHECKING:
-    from collections.abc import ItemsView
-
     from boardwalk.ansible import HostVarsType, InventoryHostVars
 
 
@@ -84,6 +86,25 @@ _stomp_locks: bool = False
     default=True,
     show_default=True,
 )
+@click.option(
+    "--parallel",
+    "-p",
+    help="Overrides the workspace's parallel_hosts. The maximum number of hosts the workflow runs against at once",
+    type=click.IntRange(min=1),
+    default=None,
+)
+@click.option(
+    "--prefetch",
+    help="Overrides the workspace's prefetch_hosts. The number of upcoming hosts whose facts are gathered in the background",
+    type=click.IntRange(min=0),
+    default=None,
+)
+@click.option(
+    "--refresh-inventory/--no-refresh-inventory",
+    help="Whether or not to ignore cached ansible-inventory output and read the inventory again",
+    default=False,
+    show_default=True,
+)
 @click.option(
     "--server-connect/--no-server-connect",
     "-sc/-nsc",
@@ -101,6 +122,21 @@ _stomp_locks: bool = False
     type=click.Choice(["shuffle", "s", "ascending", "a", "descending", "d", ""], case_sensitive=False),
     default="",
 )
+@click.option(
+    "--survey/--no-survey",
+    help=(
+        "Whether or not to survey all hosts for remote locks and workflow state in a single"
+        " Ansible invocation before starting, and print what was found"
+    ),
+    default=False,
+    show_default=True,
+)
+@click.option(
+    "--skip-locked-hosts/--no-skip-locked-hosts",
+    help="Whether or not to survey hosts before starting and leave out any that are locked. Implies --survey",
+    default=False,
+    show_default=True,
+)
 @click.option(
     "--stomp-locks/--no-stomp-locks",
     help="Whether or not to ignore and override existing host locks. Probably dangerous",
@@ -117,10 +153,17 @@ def run(
     sort_hosts: str,
     stomp_locks: bool,
     open_browser_for_api_login: bool,
+    parallel: int | None = None,
+    prefetch: int | None = None,
+    refresh_inventory: bool = False,
+    survey: bool = False,
+    skip_locked_hosts: bool = False,
 ):
     """
     Runs workflow jobs defined in the Boardwalkfile.py
     """
+    if skip_locked_hosts and stomp_locks:
+        raise BoardwalkException("--skip-locked-hosts and --stomp-locks cannot be supplied together")
     # Set globals from CLI options
     global _check_mode
     _check_mode = check
@@ -168,24 +211,29 @@ def run(
     # Lock the local Workspace
     ws.mutex()
     ctx.call_on_close(ws.unmutex)
+    # Catches and releases take effect as soon as the catch file changes
+    ws.watch()
+    ctx.call_on_close(ws.unwatch)
+
+    # Reuse SSH connections to each host across ansible_runner invocations
+    ssh_control_path_dir_setup(ws)
+    ctx.call_on_close(ssh_control_path_dir_teardown)
+
+    # Keep Ansible warm for the whole run if the workspace asks for it
+    if ws.cfg.ansible_backend == "persistent" and persistent_backend_setup():
+        ctx.call_on_close(persistent_backend_teardown)
 
-    # Multiplex slow inventory operations
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Process --limit
-        filter_hosts_by_limit_future = executor.submit(
-            filter_hosts_by_limit, ws, ws.state.hosts.items(), effective_limit
+    # Read the inventory once, and resolve --limit against it in-process
+    inventory = get_inventory(ttl=ws.cfg.inventory_cache_ttl, refresh=refresh_inventory)
+    try:
+        hosts_working_list = filter_hosts_by_limit(ws, ws.state.hosts, effective_limit, inventory)
+    except NoHostsMatched:
+        raise BoardwalkException(
+            "No host matched the given limit pattern. Ensure the expected"
+            " hosts exist in the Ansible inventory and confirm they were"
+            " reachable during `boardwalk init`"
         )
-        # Get data for inventory_vars used in Jobs
-        inventory_data_future = executor.submit(ansible_inventory)
-        try:
-            hosts_working_list = filter_hosts_by_limit_future.result()
-        except NoHostsMatched:
-            raise BoardwalkException(
-                "No host matched the given limit pattern. Ensure the expected"
-                " hosts exist in the Ansible inventory and confirm they were"
-                " reachable during `boardwalk init`"
-            )
-        inventory_vars = inventory_data_future.result()["_meta"]["hostvars"]
+    inventory_vars = inventory.hostvars
 
     # Sort hosts
     # If no --sort-hosts override was passed, then use the workspace default
@@ -199,6 +247,13 @@ def run(
         logger.error("No hosts meet preconditions")
         return
 
+    # Find locked hosts up front, rather than when the workflow reaches them
+    if survey or skip_locked_hosts:
+        hosts_working_list = survey_before_run(ws, hosts_working_list, skip_locked_hosts)
+        if len(hosts_working_list) < 1:
+            logger.error("No hosts are left after skipping locked hosts")
+            return
+
     # Get the become password if necessary
     try:
         if ask_become_pass or strtobool(os.environ["ANSIBLE_BECOME_ASK_PASS"]):
@@ -209,12 +264,20 @@ def run(
     except KeyError:
         pass
 
+    # If no --parallel override was passed, then use the workspace default
+    if not parallel:
+        parallel = ws.cfg.parallel_hosts
+    if prefetch is None:
+        prefetch = ws.cfg.prefetch_hosts
+
     run_workflow(
         hosts=hosts_working_list,
         inventory_vars=inventory_vars,
         workspace=ws,
         verbosity=ctx.obj["VERBOSITY"],
         ctx=ctx,
+        parallel=parallel,
+        prefetch=prefetch,
     )
 
 
@@ -230,6 +293,25 @@ def run(
     help="An Ansible pattern to limit hosts by. Defaults to no limit",
     default="",
 )
+@click.option(
+    "--parallel",
+    "-p",
+    help="Overrides the workspace's parallel_hosts. The maximum number of hosts the workflow runs against at once",
+    type=click.IntRange(min=1),
+    default=None,
+)
+@click.option(
+    "--prefetch",
+    help="Overrides the workspace's prefetch_hosts. The number of upcoming hosts whose facts are gathered in the background",
+    type=click.IntRange(min=0),
+    default=None,
+)
+@click.option(
+    "--refresh-inventory/--no-refresh-inventory",
+    help="Whether or not to ignore cached ansible-inventory output and read the inventory again",
+    default=False,
+    show_default=True,
+)
 @click.option(
     "--server-connect/--no-server-connect",
     "-sc/-nsc",
@@ -247,22 +329,42 @@ def run(
     type=click.Choice(["shuffle", "s", "ascending", "a", "descending", "d", ""], case_sensitive=False),
     default="",
 )
+@click.option(
+    "--survey/--no-survey",
+    help="Whether or not to survey all hosts for remote locks and workflow state before starting",
+    default=False,
+)
+@click.option(
+    "--skip-locked-hosts/--no-skip-locked-hosts",
+    help="Whether or not to survey hosts before starting and leave out any that are locked. Implies --survey",
+    default=False,
+)
 @click.command("check", short_help="Runs workflow in check mode. Equivalent to run --check")
 @click.pass_context
 def check(
     ctx: click.Context,
     ask_become_pass: bool,
     limit: str,
+    parallel: int | None,
+    prefetch: int | None,
+    refresh_inventory: bool,
     server_connect: bool,
     sort_hosts: str,
+    survey: bool,
+    skip_locked_hosts: bool,
 ):
     """Runs workflow in check mode. Equivalent to run --check"""
     ctx.invoke(
         run,
         ask_become_pass=ask_become_pass,
         limit=limit,
+        parallel=parallel,
+        prefetch=prefetch,
+        refresh_inventory=refresh_inventory,
         server_connect=server_connect,
         sort_hosts=sort_hosts,
+        survey=survey,
+        skip_locked_hosts=skip_locked_hosts,
         check=True,
     )
 
@@ -273,8 +375,46 @@ def run_workflow(
     workspace: Workspace,
     verbosity: int,
     ctx: click.Context,
+    parallel: int = 1,
+    prefetch: int = 0,
 ):
-    """Runs the workspace's workflow against a list of hosts"""
+    """Runs the workspace's workflow against a list of hosts, gathering facts
+    for up to `prefetch` upcoming hosts in the background"""
+    prefetcher = HostPrefetcher(workspace, prefetch) if prefetch > 0 else None
+    try:
+        if parallel > 1:
+            run_workflow_parallel(
+                hosts=hosts,
+                inventory_vars=inventory_vars,
+                workspace=workspace,
+                verbosity=verbosity,
+                ctx=ctx,
+                parallel=parallel,
+                prefetcher=prefetcher,
+            )
+        else:
+            run_workflow_sequential(
+                hosts=hosts,
+                inventory_vars=inventory_vars,
+                workspace=workspace,
+                verbosity=verbosity,
+                ctx=ctx,
+                prefetcher=prefetcher,
+            )
+    finally:
+        if prefetcher:
+            prefetcher.close()
+
+
+def run_workflow_sequential(
+    hosts: list[Host],
+    inventory_vars: HostVarsType,
+    workspace: Workspace,
+    verbosity: int,
+    ctx: click.Context,
+    prefetcher: HostPrefetcher | None = None,
+):
+    """Runs the workspace's workflow against one host at a time"""
     i = 0
     while i < len(hosts):
         host = hosts[i]
@@ -303,32 +443,15 @@ def run_workflow(
 
         handle_workflow_catch(workspace=workspace, host=host)
 
+        prefetched_facts = None
+        if prefetcher:
+            prefetched_facts = prefetcher.take(host)
+            prefetcher.prefetch(hosts[i + 1 :])
+
         # Connect to the remote host
         # Wrap everything in try/except so we can handle failures
         try:
-            lock_remote_host(host)
-            # Wrap everything in a try/finally so we always try to unlock the
-            # remote host
-            unreachable_exception = None
-            try:
-                directly_confirm_host_preconditions(host, inventory_vars[host.name], workspace)
-                execute_host_workflow(host, workspace, verbosity)
-            except AnsibleRunnerUnreachableHost as e:
-                unreachable_exception = e
-            finally:
-                # If the host was unreachable there's no point in trying to recover here
-                if unreachable_exception:
-                    raise unreachable_exception
-                # Finish by releasing the remote lock
-                logger.info(f"{host.name}: Release remote host lock")
-                if boardwalkd_client:
-                    boardwalkd_client.queue_event(
-                        WorkspaceEvent(
-                            severity="info",
-                            message=f"{host.name}: Release remote host lock",
-                        ),
-                    )
-                host.release(become_password=become_password, check=_check_mode)
+            run_host_workflow(host, inventory_vars, workspace, verbosity, prefetched_facts)
         except (AnsibleRunnerGeneralError, AnsibleRunError) as e:
             # These errors probably indicate a local issue with Ansible that should
             # caught early, such as syntax errors, so we always bail when encountered
@@ -370,6 +493,215 @@ def run_workflow(
             )
 
 
+def run_workflow_parallel(
+    hosts: list[Host],
+    inventory_vars: HostVarsType,
+    workspace: Workspace,
+    verbosity: int,
+    ctx: click.Context,
+    parallel: int,
+    prefetcher: HostPrefetcher | None = None,
+):
+    """
+    Runs the workspace's workflow against up to `parallel` hosts at a time.
+    Hosts are started in list order. A host that fails is put back at the front
+    of the queue, so that it is retried first once the workspace catch is
+    released, the same as in the sequential loop. No new hosts are started while
+    the workspace is caught; hosts already in flight are allowed to finish
+    """
+    pending: deque[Host] = deque(hosts)
+    in_flight: dict[concurrent.futures.Future, Host] = {}
+    completed = 0
+    fatal_exception: BoardwalkException | None = None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="boardwalk_host") as executor:
+        while pending or in_flight:
+            # Fill any free slots in the window
+            while fatal_exception is None and pending and len(in_flight) < parallel:
+                host = pending[0]
+                if in_flight:
+                    if workflow_caught(workspace):
+                        break
+                else:
+                    # Nothing is running, so it's safe to block here until released
+                    handle_workflow_catch(workspace=workspace, host=host)
+                pending.popleft()
+
+                iteration = completed + len(in_flight) + 1
+                if boardwalkd_client:
+                    # Update the server's workspace state so the UI reflects the latest host
+                    boardwalkd_client.post_details(
+                        build_workspace_details(
+                            workspace=workspace,
+                            ctx=ctx,
+                            current_host=host.name,
+                            inventory_vars=inventory_vars,
+                            progress_hosts_total=str(len(hosts)),
+                            progress_hosts_completed=str(completed),
+                        )
+                    )
+                logger.info(f"{host.name}: Workflow iteration on host {iteration} of {len(hosts)}")
+                if boardwalkd_client:
+                    boardwalkd_client.queue_event(
+                        WorkspaceEvent(
+                            severity="info",
+                            message=f"{host.name}: Workflow iteration on host {iteration} of {len(hosts)}",
+                        ),
+                    )
+                prefetched_facts = prefetcher.take(host) if prefetcher else None
+                future = executor.submit(
+                    run_host_workflow, host, inventory_vars, workspace, verbosity, prefetched_facts
+                )
+                in_flight[future] = host
+
+            if not in_flight:
+                break
+
+            if prefetcher and fatal_exception is None:
+                prefetcher.prefetch(pending)
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                host = in_flight.pop(future)
+                try:
+                    future.result()
+                except (AnsibleRunnerGeneralError, AnsibleRunError) as e:
+                    # These errors probably indicate a local issue with Ansible, so
+                    # stop starting hosts, let the in-flight ones finish, then bail
+                    if boardwalkd_client:
+                        boardwalkd_client.queue_event(
+                            WorkspaceEvent(
+                                severity="error",
+                                message=f"{host.name}: {e.__class__.__qualname__}",
+                            )
+                        )
+                    if fatal_exception is None:
+                        fatal_exception = BoardwalkException(e.runner_msg)
+                    continue
+                except (
+                    AnsibleRunnerFailedHost,
+                    AnsibleRunnerUnreachableHost,
+                    RemoteHostLocked,
+                ) as e:
+                    run_failure_mode_handler(
+                        exception=e,
+                        hostname=host.name,
+                        workspace=workspace,
+                    )
+                    pending.appendleft(host)
+                    continue
+                except HostPreConditionsUnmet:
+                    pass
+
+                completed += 1
+
+                if boardwalkd_client:
+                    # Update the Workspace progress
+                    boardwalkd_client.post_details(
+                        build_workspace_details(
+                            workspace=workspace,
+                            ctx=ctx,
+                            current_host=host.name,
+                            inventory_vars=inventory_vars,
+                            progress_hosts_total=str(len(hosts)),
+                            progress_hosts_completed=str(completed),
+                        )
+                    )
+
+    if fatal_exception:
+        raise fatal_exception
+
+
+def run_host_workflow(
+    host: Host,
+    inventory_vars: HostVarsType,
+    workspace: Workspace,
+    verbosity: int,
+    prefetched_facts: dict[str, Any] | None = None,
+):
+    """Locks a remote host, confirms its preconditions, runs the workflow against
+    it, and then releases the lock. If the host's facts were prefetched, its
+    preconditions are checked before it's locked"""
+    if prefetched_facts is None:
+        lock_remote_host(host)
+    else:
+        host.set_facts(workspace.cfg.filter_facts(prefetched_facts))
+        workspace.flush_host(host)
+        directly_confirm_host_preconditions(host, inventory_vars[host.name], workspace)
+        lock_remote_host(host, refresh_only=True)
+    # Wrap everything in a try/finally so we always try to unlock the
+    # remote host
+    unreachable_exception = None
+    released = False
+    try:
+        directly_confirm_host_preconditions(host, inventory_vars[host.name], workspace)
+        released = execute_host_workflow(host, workspace, verbosity)
+    except AnsibleRunnerUnreachableHost as e:
+        unreachable_exception = e
+    finally:
+        # If the host was unreachable there's no point in trying to recover here
+        if unreachable_exception:
+            raise unreachable_exception
+        # Finish by releasing the remote lock, unless the post-flight already did
+        if not released:
+            logger.info(f"{host.name}: Release remote host lock")
+            if boardwalkd_client:
+                boardwalkd_client.queue_event(
+                    WorkspaceEvent(
+                        severity="info",
+                        message=f"{host.name}: Release remote host lock",
+                    ),
+                )
+            host.release(become_password=become_password, check=_check_mode)
+
+
+class HostPrefetcher:
+    """
+    Gathers facts for upcoming hosts in background threads, so they are ready
+    by the time the workflow reaches each host. Hosts aren't locked, and
+    nothing is changed on them
+    """
+
+    def __init__(self, workspace: Workspace, lookahead: int):
+        self.workspace = workspace
+        self.lookahead = lookahead
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=lookahead, thread_name_prefix="boardwalk_prefetch"
+        )
+        self._futures: dict[str, concurrent.futures.Future[dict[str, Any]]] = {}
+        # Hosts already taken are not prefetched again, e.g. when retried
+        self._taken: set[str] = set()
+
+    def prefetch(self, upcoming: Iterable[Host]):
+        """Starts gathering facts for the first `lookahead` upcoming hosts that
+        aren't already being gathered"""
+        for host in islice((host for host in upcoming if host.name not in self._taken), self.lookahead):
+            if host.name not in self._futures:
+                logger.debug(f"{host.name}: Prefetching facts")
+                self._futures[host.name] = self._executor.submit(
+                    host.gather_facts, setup_args=self.workspace.cfg.setup_args
+                )
+
+    def take(self, host: Host) -> dict[str, Any] | None:
+        """Returns the facts prefetched for a host, waiting for them if they are
+        still being gathered. Returns None if they weren't prefetched or couldn't
+        be gathered, in which case the pre-flight gathers them as usual"""
+        self._taken.add(host.name)
+        future = self._futures.pop(host.name, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except (AnsibleRunnerBaseException, AnsibleRunError, BoardwalkException) as e:
+            logger.warning(f"{host.name}: Could not prefetch facts: {e.__class__.__qualname__}")
+            return None
+
+    def close(self):
+        """Stops prefetching. Facts already being gathered are discarded"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._futures.clear()
+
+
 def run_failure_mode_handler(
     exception: Exception,
     hostname: str,
@@ -409,36 +741,30 @@ def run_failure_mode_handler(
         workspace.catch()
 
 
-def filter_hosts_by_limit(workspace: Workspace, hosts: ItemsView[str, Host], pattern: str) -> list[Host]:
-    """Accepts a list of host objects and returns a list of object matching a host
-    pattern string"""
+def survey_before_run(workspace: Workspace, hosts: list[Host], skip_locked_hosts: bool) -> list[Host]:
+    """Surveys hosts for remote locks and workflow state and prints what was
+    found. Returns the hosts, without locked ones if skip_locked_hosts is True"""
+    surveys = survey_hosts(workspace, [host.name for host in hosts])
+    click.echo(format_survey_table(surveys))
+    if not skip_locked_hosts:
+        return hosts
+    locked = {survey.name for survey in surveys if survey.locked_by is not None}
+    if locked:
+        logger.warning(f"Skipping {len(locked)} locked host(s): {', '.join(sorted(locked))}")
+    return [host for host in hosts if host.name not in locked]
+
+
+def filter_hosts_by_limit(
+    workspace: Workspace, hosts: Mapping[str, Host], pattern: str, inventory: Inventory
+) -> list[Host]:
+    """Accepts a mapping of host names to host objects and returns a list of the
+    objects matching a host pattern string. Only matching hosts are loaded"""
     logger.info("Reading inventory to process any --limit")
-    out, err, rc = ansible_runner.run_command(
-        cmdline_args=[
-            "--list-hosts",
-            workspace.cfg.host_pattern,
-            "--limit",
-            pattern,
-        ],
-        envvars={"ANSIBLE_BECOME_ASK_PASS": False},
-        executable_cmd="ansible",
-        input_fd=sys.stdin,
-        project_dir=str(Path.cwd()),
-        quiet=True,
-        suppress_env_files=True,
-    )
-    if rc != 0:
-        BoardwalkException(f"Failed to process --limit pattern. {err}")
-
-    # Format the output into a clean list
-    inventory_host_list = [line.strip() for line in out.splitlines()[1:]]
-
-    # Get the intersection of the list of hosts from the inventory with the
-    # hosts present in the state
-    hosts_filtered: list[Host] = []
-    for hostname, host in hosts:
-        if hostname in inventory_host_list:
-            hosts_filtered.append(host)
+    inventory_hosts = set(inventory.resolve_limit(workspace.cfg.host_pattern, pattern))
+
+    # Get the intersection of the hosts from the inventory with the hosts
+    # present in the state
+    hosts_filtered = [hosts[hostname] for hostname in hosts if hostname in inventory_hosts]
     if len(hosts_filtered) == 0:
         raise NoHostsMatched
     return hosts_filtered
@@ -504,6 +830,34 @@ def check_host_preconditions_locally(
     return hosts_meeting_preconditions
 
 
+def check_boardwalkd_catch(client: WorkspaceClient) -> bool:
+    """
+    Wraps catch checking method so that the client can consider the
+    remote workspace locked if it can't be reached
+    """
+    try:
+        return client.caught()
+    except (ConnectionRefusedError, HTTPTimeoutError):
+        logger.error(
+            f"Could not connect to {client.url.geturl()} while checking for remote catch."
+            " Boardwalk considers the remote workspace caught if it can't be reached"
+        )
+        return True
+    except HTTPClientError as e:
+        logger.error(
+            f"Received error {e} from {client.url.geturl()} while checking for remote catch."
+            " Boardwalk considers the remote workspace caught if it can't be reached"
+        )
+        return True
+
+
+def workflow_caught(workspace: Workspace) -> bool:
+    """Non-blocking check for whether the workspace is caught locally or remotely"""
+    if workspace.caught():
+        return True
+    return bool(boardwalkd_client and check_boardwalkd_catch(boardwalkd_client))
+
+
 def handle_workflow_catch(workspace: Workspace, host: Host):
     """Handles local and remote workspace catches. Blocks under caught conditions"""
     hostname = host.name
@@ -518,31 +872,9 @@ def handle_workflow_catch(workspace: Workspace, host: Host):
                     message=f"{hostname}: Waiting for local worker catch to release",
                 ),
             )
-        while workspace.caught():
-            time.sleep(5)  # nosemgrep: python.lang.best-practice.sleep.arbitrary-sleep
+        workspace.wait_for_release()
 
     # Now check if there is a remote catch
-    def check_boardwalkd_catch(client: WorkspaceClient) -> bool:
-        """
-        Wraps catch checking method so that the client can consider the
-        remote workspace locked if it can't be reached
-        """
-        # First check if there is a local catch. This takes precedence over remote catches
-        try:
-            return client.caught()
-        except (ConnectionRefusedError, HTTPTimeoutError):
-            logger.error(
-                f"Could not connect to {client.url.geturl()} while checking for remote catch."
-                " Boardwalk considers the remote workspace caught if it can't be reached"
-            )
-            return True
-        except HTTPClientError as e:
-            logger.error(
-                f"Received error {e} from {client.url.geturl()} while checking for remote catch."
-                " Boardwalk considers the remote workspace caught if it can't be reached"
-            )
-            return True
-
     if boardwalkd_client and check_boardwalkd_catch(boardwalkd_client):
         logger.info(
             f"{hostname}: The {workspace.name} workspace is remotely caught on {boardwalkd_client.url.geturl()}"
@@ -554,20 +886,54 @@ def handle_workflow_catch(workspace: Workspace, host: Host):
                 message=f"{hostname}: Waiting for remote catch to release",
             )
         )
-        while check_boardwalkd_catch(boardwalkd_client):
-            maybe_clear_remote_state_fact(
-                host=host,
-                client=boardwalkd_client,
-                become_password=become_password,
-                check=_check_mode,
-            )
-            maybe_clear_remote_mutex(
-                host=host,
-                client=boardwalkd_client,
-                become_password=become_password,
-                check=_check_mode,
-            )
-            time.sleep(5)  # nosemgrep: python.lang.best-practice.sleep.arbitrary-sleep
+        # The server holds each request until the semaphores change, so a release
+        # or cleanup request is seen as soon as it happens
+        version: str | None = None
+        while True:
+            semaphores, version = wait_boardwalkd_semaphores(boardwalkd_client, version)
+            if semaphores is not None and not semaphores.caught:
+                break
+            if semaphores is not None:
+                maybe_clear_remote_state_fact(
+                    host=host,
+                    client=boardwalkd_client,
+                    become_password=become_password,
+                    check=_check_mode,
+                    semaphores=semaphores,
+                )
+                maybe_clear_remote_mutex(
+                    host=host,
+                    client=boardwalkd_client,
+                    become_password=become_password,
+                    check=_check_mode,
+                    semaphores=semaphores,
+                )
+            if version is None:
+                # The server couldn't be reached or doesn't support waiting
+                time.sleep(5)  # nosemgrep: python.lang.best-practice.sleep.arbitrary-sleep
+
+
+def wait_boardwalkd_semaphores(
+    client: WorkspaceClient, version: str | None, wait: float = 10
+) -> tuple[WorkspaceSemaphores | None, str | None]:
+    """
+    Waits for the remote workspace semaphores to change from `version`. Returns
+    no semaphores if the server can't be reached, in which case the workspace
+    is considered caught
+    """
+    try:
+        return client.wait_semaphores(version=version, wait=wait)
+    except (ConnectionRefusedError, HTTPTimeoutError):
+        logger.error(
+            f"Could not connect to {client.url.geturl()} while checking for remote catch."
+            " Boardwalk considers the remote workspace caught if it can't be reached"
+        )
+    except HTTPClientError as e:
+        logger.error(
+            f"Received error {e} from {client.url.geturl()} while checking for remote catch."
+            " Boardwalk considers the remote workspace caught if it can't be reached"
+        )
+    return None, None
 
 
 def maybe_clear_remote_state_fact(
@@ -575,9 +941,13 @@ def maybe_clear_remote_state_fact(
     client: WorkspaceClient,
     become_password: str | None,
     check: bool,
+    semaphores: WorkspaceSemaphores | None = None,
 ) -> bool:
-    """Clears a host's remote state fact when boardwalkd has a pending request."""
-    if not client.get_semaphores().clear_remote_state_requested:
+    """Clears a host's remote state fact when boardwalkd has a pending request.
+    Already fetched semaphores may be passed in to avoid fetching them again."""
+    if semaphores is None:
+        semaphores = client.get_semaphores()
+    if not semaphores.clear_remote_state_requested:
         return False
 
     logger.trace(f"Processing boardwalkd requested removal of remote state for {host.name}")
@@ -610,9 +980,13 @@ def maybe_clear_remote_mutex(
     client: WorkspaceClient,
     become_password: str | None,
     check: bool,
+    semaphores: WorkspaceSemaphores | None = None,
 ) -> bool:
-    """Clears a host's remote mutex when boardwalkd has a pending request."""
-    if not client.get_semaphores().clear_remote_mutex_requested:
+    """Clears a host's remote mutex when boardwalkd has a pending request.
+    Already fetched semaphores may be passed in to avoid fetching them again."""
+    if semaphores is None:
+        semaphores = client.get_semaphores()
+    if not semaphores.clear_remote_mutex_requested:
         return False
 
     logger.trace(f"Processing boardwalkd requested removal of remote mutex for {host.name}")
@@ -640,7 +1014,11 @@ def maybe_clear_remote_mutex(
         client.delete_clear_remote_mutex_request()
 
 
-def lock_remote_host(host: Host):
+def lock_remote_host(host: Host, refresh_only: bool = False):
+    """Runs the host pre-flight, which locks the remote host and gathers its
+    facts into the local state in a single Ansible invocation. If refresh_only
+    is True or the host's facts are fresh, only the facts Boardwalk needs are
+    gathered"""
     if boardwalkd_client:
         boardwalkd_client.queue_event(
             WorkspaceEvent(
@@ -648,11 +1026,20 @@ def lock_remote_host(host: Host):
                 message=f"{host.name}: Locking remote host",
             ),
         )
-    host.lock(
+    workspace = get_ws()
+    # Facts gathered recently, e.g. by the post-flight of the last run, are
+    # reused, and only the facts Boardwalk needs are refreshed
+    fresh = refresh_only or host.facts_are_fresh(workspace.cfg.facts_ttl)
+    if fresh:
+        logger.info(f"{host.name}: Facts are fresh; only refreshing Boardwalk's facts")
+    facts = host.preflight(
         become_password=become_password,
         check=_check_mode,
         stomp_existing_locks=_stomp_locks,
+        setup_args=workspace.cfg.refresh_setup_args if fresh else workspace.cfg.setup_args,
     )
+    host.set_facts(workspace.cfg.filter_facts(facts), refreshed_only=fresh)
+    workspace.flush_host(host)
 
 
 def resolve_workspace_ui_group(
@@ -774,31 +1161,24 @@ def bootstrap_with_server(workspace: Workspace, ctx: click.Context):
         except HTTPClientError as e:
             logger.error(f"Received error {e} from {boardwalkd_url}. Cannot unmutex Workspace")
 
+    # Close connections to the server last, after the workspace is unmutexed
+    ctx.call_on_close(boardwalkd_client.close)
     ctx.call_on_close(unmutex_boardwalkd_workspace)
 
     # Send heartbeats in background
     heartbeat_quit = boardwalkd_client.heartbeat_keepalive_connect()
     ctx.call_on_close(heartbeat_quit.set)
 
-
-def update_host_facts_in_local_state(host: Host, workspace: Workspace):
-    """Updates fetches latest host facts for a host and saves to the workspace state"""
-    logger.info(f"{host.name}: Updating Ansible facts in local state")
-    if boardwalkd_client:
-        boardwalkd_client.queue_event(
-            WorkspaceEvent(
-                severity="info",
-                message=f"{host.name}: Updating Ansible facts in local state",
-            ),
-        )
-    workspace.state.hosts[host.name].ansible_facts = host.gather_facts()
-    workspace.flush()
+    # Events are sent in background; give pending ones a bounded chance to be
+    # delivered on exit. Callbacks run in reverse, so this runs before unmutex
+    ctx.call_on_close(boardwalkd_client.event_sender_close)
 
 
 def directly_confirm_host_preconditions(host: Host, inventory_vars: InventoryHostVars, workspace: Workspace) -> bool:
-    """Connects directly to the host and confirms that the workflow job preconditions
-    are actually met. Raises an exception if any are unmet. If a workflow was run but
-    never completed, preconditions are ignored. Also posts events to the central server
+    """Confirms that the workflow job preconditions are actually met, using the
+    facts gathered directly from the host during its pre-flight. Raises an exception
+    if any are unmet. If a workflow was run but never completed, preconditions are
+    ignored. Also posts events to the central server
     """
     if boardwalkd_client:
         boardwalkd_client.queue_event(
@@ -807,7 +1187,6 @@ def directly_confirm_host_preconditions(host: Host, inventory_vars: InventoryHos
                 message=f"{host.name}: Checking Job preconditions on host",
             ),
         )
-    update_host_facts_in_local_state(host, workspace)
 
     if workspace.cfg.workflow.cfg.always_retry_failed_hosts:
         # If the workflow was started but never finished, ignore preconditions
@@ -923,8 +1302,12 @@ def execute_workflow_jobs(host: Host, workspace: Workspace, job_kind: str, verbo
             )
 
 
-def execute_host_workflow(host: Host, workspace: Workspace, verbosity: int):
-    """Handles executing all jobs defined in a workflow against a host"""
+def execute_host_workflow(host: Host, workspace: Workspace, verbosity: int) -> bool:
+    """
+    Handles executing all jobs defined in a workflow against a host. The
+    workflow finishes with the host post-flight, which also releases the remote
+    lock; returns True once that has happened
+    """
     unreachable_exception = None
 
     logger.info(f"{host.name}: Updating remote state")
@@ -935,7 +1318,8 @@ def execute_host_workflow(host: Host, workspace: Workspace, verbosity: int):
                 message=f"{host.name}: Updating remote state",
             ),
         )
-    remote_state = host.get_remote_state()
+    # The remote state was read as part of the facts gathered during the pre-flight
+    remote_state = host.remote_state_from_facts()
     try:
         remote_state.workspaces[workspace.name].workflow.started = True
         remote_state.workspaces[workspace.name].workflow.succeeded = False
@@ -963,22 +1347,14 @@ def execute_host_workflow(host: Host, workspace: Workspace, verbosity: int):
             raise unreachable_exception
         execute_workflow_jobs(host, workspace, job_kind="exit", verbosity=verbosity)
 
-    logger.info(f"{host.name}: Updating remote state")
-    if boardwalkd_client:
-        boardwalkd_client.queue_event(
-            WorkspaceEvent(
-                severity="info",
-                message=f"{host.name}: Updating remote state",
-            ),
-        )
-    remote_state = host.get_remote_state()
+    # The host is still locked by this worker, so the remote state written above
+    # is current and doesn't need to be read again
     try:
         remote_state.workspaces[workspace.name].workflow.succeeded = True
     except KeyError:
         remote_state.workspaces[workspace.name] = RemoteStateWorkspace(
             workflow=RemoteStateWorkflow(started=True, succeeded=True)
         )
-    host.set_remote_state(remote_state, become_password, _check_mode)
 
     logger.success(f"{host.name}: Host completed successfully; wrapping up")
     if boardwalkd_client:
@@ -989,7 +1365,18 @@ def execute_host_workflow(host: Host, workspace: Workspace, verbosity: int):
             ),
             broadcast=boardwalkd_send_broadcasts,
         )
-    update_host_facts_in_local_state(host, workspace)
+    logger.info(f"{host.name}: Updating remote state, releasing remote host lock, and updating Ansible facts")
+    if boardwalkd_client:
+        boardwalkd_client.queue_event(
+            WorkspaceEvent(
+                severity="info",
+                message=f"{host.name}: Updating remote state and releasing remote host lock",
+            ),
+        )
+    facts = host.postflight(remote_state, become_password, _check_mode, setup_args=workspace.cfg.setup_args)
+    host.set_facts(workspace.cfg.filter_facts(facts))
+    workspace.flush_host(host)
+    return True
 
 
 class NoHostsMatched(Exception):
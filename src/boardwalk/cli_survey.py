@@ -0,0 +1,188 @@
+"""
+survey CLI subcommand
+"""
+
+from __future__ import annotations
+
+from base64 import b64decode
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING
+
+import click
+from loguru import logger
+from pydantic import BaseModel
+
+from boardwalk.ansible import (
+    AnsibleRunError,
+    AnsibleRunnerFailedHost,
+    AnsibleRunnerGeneralError,
+    AnsibleRunnerUnreachableHost,
+    ansible_runner_run_tasks,
+)
+from boardwalk.app_exceptions import BoardwalkException
+from boardwalk.host import Host, remote_mutex_read_tasks
+from boardwalk.inventory import get_inventory
+from boardwalk.manifest import JobTypes, NoActiveWorkspace, get_ws
+from boardwalk.state import RemoteStateModel
+
+if TYPE_CHECKING:
+    from ansible_runner import Runner, RunnerEvent
+
+    from boardwalk.ansible import AnsibleTasksType
+    from boardwalk.manifest import Workspace
+
+# Surveying only reads a few small files from each host, so many hosts are
+# surveyed at once
+default_survey_forks = 50
+
+
+@click.command(short_help="Surveys hosts for remote locks and workflow state")
+@click.option(
+    "--forks",
+    "-f",
+    help="The number of hosts Ansible surveys at once",
+    type=click.IntRange(min=1),
+    default=default_survey_forks,
+    show_default=True,
+)
+@click.option(
+    "--limit",
+    "-l",
+    help="An Ansible pattern to limit hosts by. Defaults to no limit",
+    default="all",
+)
+@click.option(
+    "--refresh-inventory/--no-refresh-inventory",
+    help="Whether or not to ignore cached ansible-inventory output and read the inventory again",
+    default=False,
+    show_default=True,
+)
+def survey(forks: int, limit: str, refresh_inventory: bool):
+    """
+    Checks every host matching the workspace's host pattern for a remote
+    Boardwalk lock and for this workspace's workflow state, in a single Ansible
+    invocation. Hosts don't need to have been initialized, and nothing is
+    changed on them, so the workspace mutex isn't taken and a survey may run
+    alongside a run
+    """
+    try:
+        ws = get_ws()
+    except NoActiveWorkspace as e:
+        raise BoardwalkException(e.message)
+    logger.info(f"Using workspace: {ws.name}")
+
+    inventory = get_inventory(ttl=ws.cfg.inventory_cache_ttl, refresh=refresh_inventory)
+    hostnames = inventory.resolve_limit(ws.cfg.host_pattern, limit)
+    if not hostnames:
+        raise BoardwalkException("No hosts matched the workspace's host pattern and --limit")
+
+    click.echo(format_survey_table(survey_hosts(ws, hostnames, forks=forks)))
+
+
+class HostSurvey(BaseModel, extra="forbid"):
+    """What a survey found on a single host"""
+
+    name: str
+    reachable: bool = True
+    locked_by: str | None = None
+    workflow_started: bool = False
+    workflow_succeeded: bool = False
+
+    @property
+    def status(self) -> str:
+        if not self.reachable:
+            return "unreachable"
+        if self.locked_by is not None:
+            return "locked"
+        if self.workflow_succeeded:
+            return "succeeded"
+        if self.workflow_started:
+            return "started"
+        return "not started"
+
+
+def survey_hosts(workspace: Workspace, hostnames: list[str], forks: int = default_survey_forks) -> list[HostSurvey]:
+    """
+    Reads the remote mutex file and Boardwalk's remote state fact of every host
+    in a single multi-host Ansible invocation. Returns a survey of each host, in
+    the order given
+    """
+    # The defaults of Host are the same for every host
+    mutex_path = Host.model_fields["remote_mutex_path"].default
+    tasks: AnsibleTasksType = [
+        *remote_mutex_read_tasks(mutex_path),
+        {
+            "name": "get_remote_state",
+            "ansible.builtin.setup": {"gather_subset": ["!all", "!min", "local"], "filter": ["ansible_local"]},
+        },
+    ]
+    # Surveys may run concurrently, so each writes its own limit file
+    with NamedTemporaryFile(mode="w", delete=False, dir=workspace.path, prefix="survey.", suffix=".hosts") as fd:
+        fd.write("".join(f"{hostname}\n" for hostname in hostnames))
+    limit_file = Path(fd.name)
+    logger.info(f"Surveying {len(hostnames)} host(s)")
+    try:
+        runner: Runner = ansible_runner_run_tasks(
+            hosts=workspace.cfg.host_pattern,
+            limit=f"@{limit_file!s}",
+            forks=forks,
+            gather_facts=False,
+            invocation_msg="survey_remote_hosts",
+            job_type=JobTypes.TASK,
+            tasks=tasks,
+        )
+    except (AnsibleRunnerFailedHost, AnsibleRunnerGeneralError, AnsibleRunnerUnreachableHost) as e:
+        # Hosts that couldn't be surveyed are reported as unreachable
+        runner = e.runner
+    except AnsibleRunError as e:
+        for event in e.runner.events:
+            try:
+                logger.error(event["stdout"])
+            except KeyError:
+                pass
+        raise BoardwalkException("Failed to survey hosts")
+    finally:
+        limit_file.unlink(missing_ok=True)
+
+    surveys = {hostname: HostSurvey(name=hostname) for hostname in hostnames}
+    for event in runner.events:
+        apply_survey_event(surveys, event, workspace.name)
+    return list(surveys.values())
+
+
+def apply_survey_event(surveys: dict[str, HostSurvey], event: RunnerEvent, workspace_name: str):
+    """Updates the survey of the host an ansible_runner event is for"""
+    try:
+        survey = surveys[event["event_data"]["host"]]
+    except KeyError:
+        return
+    if event["event"] in ("runner_on_unreachable", "runner_on_failed"):
+        survey.reachable = False
+    elif event["event"] == "runner_on_ok":
+        task = event["event_data"]["task"]
+        res = event["event_data"]["res"]
+        if task == "slurp_mutex_content":
+            survey.locked_by = b64decode(res["content"]).decode("utf-8").rstrip()
+        elif task == "get_remote_state":
+            try:
+                remote_state = RemoteStateModel.model_validate(res["ansible_facts"]["ansible_local"]["boardwalk_state"])
+            except KeyError:
+                return
+            if (remote_workspace := remote_state.workspaces.get(workspace_name)) is not None:
+                survey.workflow_started = remote_workspace.workflow.started
+                survey.workflow_succeeded = remote_workspace.workflow.succeeded
+
+
+def format_survey_table(surveys: list[HostSurvey]) -> str:
+    """Formats surveys as a table, followed by the number of hosts with each status"""
+    rows = [("HOST", "STATUS", "LOCKED BY")]
+    rows += [(survey.name, survey.status, survey.locked_by or "") for survey in surveys]
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    lines = [f"{row[0]:<{widths[0]}}  {row[1]:<{widths[1]}}  {row[2]}".rstrip() for row in rows]
+    counts: dict[str, int] = {}
+    for survey in surveys:
+        counts[survey.status] = counts.get(survey.status, 0) + 1
+    lines.append("")
+    lines.append(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return "\n".join(lines)
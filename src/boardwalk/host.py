@@ -6,6 +6,7 @@ done to hosts
 from __future__ import annotations
 
 import getpass
+import shlex
 import socket
 from base64 import b64decode
 from collections.abc import Callable
@@ -22,12 +23,42 @@ from boardwalk.app_exceptions import BoardwalkException
 if TYPE_CHECKING:
     from boardwalk.ansible import AnsibleTasksType
 
+# The setup module arguments used when a workspace doesn't configure any
+default_setup_args: dict[str, Any] = {"gather_timeout": 30}
+
+# The exit code of the lock task when someone else already holds the lock
+_lock_held_rc = 3
+
+# The admin group owning files Boardwalk writes, by ansible_system
+admin_groups = {"Linux": "root", "Darwin": "wheel"}
+
+
+def remote_mutex_read_tasks(remote_mutex_path: str) -> AnsibleTasksType:
+    """
+    Tasks that read the remote mutex file without changing it. The file's
+    content, naming who holds the lock, is the result of the
+    slurp_mutex_content task when the file exists
+    """
+    return [
+        {
+            "name": "remote_mutex_check",
+            "ansible.builtin.stat": {"path": remote_mutex_path},
+            "register": "lockfile",
+        },
+        {
+            "name": "slurp_mutex_content",
+            "ansible.builtin.slurp": {"src": remote_mutex_path},
+            "when": "lockfile.stat.exists",
+        },
+    ]
+
 
 class Host(BaseModel, extra="forbid"):
     """Data and methods for managing an individual host"""
 
     ansible_facts: dict[str, Any]
     name: str
+    facts_gathered_at: datetime | None = None
     meta: dict[str, str | int | bool] = {}
     remote_mutex_path: str = "/opt/boardwalk.mutex"
     remote_state_path: str = "/etc/ansible/facts.d/boardwalk_state.fact"
@@ -71,59 +102,135 @@ class Host(BaseModel, extra="forbid"):
             event_handler=event_handler,
         )
 
-    def is_locked(self) -> str | bool:
+    def facts_are_fresh(self, ttl: float) -> bool:
+        """Returns True if all of the host's facts were gathered within the last
+        ttl seconds"""
+        if ttl <= 0 or self.facts_gathered_at is None:
+            return False
+        return (datetime.now(UTC) - self.facts_gathered_at).total_seconds() <= ttl
+
+    def set_facts(self, facts: dict[str, Any], refreshed_only: bool = False):
         """
-        Checks if a remote host is locked
-        Returns string with lockfile content if so, False otherwise
+        Stores newly gathered facts. If refreshed_only is True, the facts only
+        refresh some of the existing facts, which are otherwise kept, and the
+        time all facts were gathered is left alone
         """
-        tasks: AnsibleTasksType = [
+        if refreshed_only:
+            self.ansible_facts = {**self.ansible_facts, **facts}
+        else:
+            self.ansible_facts = facts
+            self.facts_gathered_at = datetime.now(UTC)
+
+    def _admin_group_tasks(self) -> AnsibleTasksType:
+        """Tasks setting the admin_group fact. The host's stored ansible_system
+        fact is used if it's known, so only otherwise is it gathered"""
+        if (group := admin_groups.get(self.ansible_facts.get("ansible_system", ""))) is not None:
+            return [{"name": "set_admin_group", "ansible.builtin.set_fact": {"admin_group": group}}]
+        return [
+            {"name": "get_ansible_system", "setup": {"filter": ["ansible_system"]}},
             {
-                "name": "remote_mutex_check",
-                "ansible.builtin.stat": {"path": self.remote_mutex_path},
-                "register": "lockfile",
+                "name": "set_linux_facts",
+                "ansible.builtin.set_fact": {"admin_group": "root"},
+                "when": "ansible_system == 'Linux'",
             },
             {
-                "name": "slurp_mutex_content",
-                "ansible.builtin.slurp": {"src": self.remote_mutex_path},
-                "when": "lockfile.stat.exists",
+                "name": "set_darwin_facts",
+                "ansible.builtin.set_fact": {"admin_group": "wheel"},
+                "when": "ansible_system == 'Darwin'",
             },
         ]
 
+    def preflight(
+        self,
+        become_password: str | None = None,
+        check: bool = False,
+        stomp_existing_locks: bool = False,
+        setup_args: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Gathers facts, sets a remote lock, and writes an alert for any local
+        users, all in a single Ansible invocation. Returns the gathered facts,
+        which include boardwalk's remote state fact under ansible_local. If a
+        lock is already set, an error is raised.
+        setup_args are passed to the setup module, see WorkspaceConfig.setup_args
+        """
+        tasks: AnsibleTasksType = [
+            # Facts are gathered first, so a host that can't be reached or
+            # times out isn't left locked
+            {"name": "setup", "ansible.builtin.setup": setup_args or default_setup_args, "become": False},
+            *self._acquire_lock_tasks(check=check, stomp_existing_locks=stomp_existing_locks),
+            *self._lock_alert_tasks(check=check),
+        ]
         runner = self.ansible_run(
-            invocation_msg="check_remote_host_lock",
+            become=True,
+            become_password=become_password,
+            check=check,
             gather_facts=False,
+            invocation_msg="preflight_remote_host",
             tasks=tasks,
             job_type=boardwalk.manifest.JobTypes.TASK,
         )
 
-        lockfile_stat_exists = False
-        slurp_mutex_content = ""
+        if (holder := self._lock_holder(runner)) is not None:
+            raise RemoteHostLocked(f"{self.name}: Host is locked by {holder}")
+        facts: dict[str, Any] = {}
         for event in runner.events:
-            if event["event"] == "runner_on_ok":
-                if event["event_data"]["task"] == "remote_mutex_check":
-                    lockfile_stat_exists = event["event_data"]["res"]["stat"]["exists"]
-                if event["event_data"]["task"] == "slurp_mutex_content":
-                    slurp_mutex_content = event["event_data"]["res"]["content"]
-        if lockfile_stat_exists:
-            return b64decode(slurp_mutex_content).decode("utf-8").rstrip()
-        return False
+            if event["event"] == "runner_on_ok" and event["event_data"]["task"] == "setup":
+                facts = event["event_data"]["res"]["ansible_facts"]
+        if len(facts) == 0:
+            raise BoardwalkException("preflight gather_facts returned nothing")
+        facts.setdefault("ansible_local", {})
+        return facts
 
-    def lock(
-        self,
-        become_password: str | None = None,
-        check: bool = False,
-        stomp_existing_locks: bool = False,
-    ):
+    def _acquire_lock_tasks(self, check: bool, stomp_existing_locks: bool) -> AnsibleTasksType:
         """
-        Sets a remote lock and writes an alert for any local users
-        If a lock is already set, an error is raised
+        Tasks that take the remote lock, ending the play for this host if it's
+        already locked. The lock file is created with the shell's noclobber
+        option, which creates it exclusively, so when two workers race for a
+        host only one gets the lock; the other reads who holds it. In check mode
+        nothing is created, and an existing lock file is only read
         """
+        if check:
+            if stomp_existing_locks:
+                return []
+            return [
+                *remote_mutex_read_tasks(self.remote_mutex_path),
+                {
+                    "name": "end_if_locked",
+                    "ansible.builtin.meta": "end_host",
+                    "when": "lockfile.stat.exists",
+                },
+            ]
+        path = shlex.quote(self.remote_mutex_path)
+        create = "" if stomp_existing_locks else "set -C; "
+        cmd = (
+            f"umask 022\n"
+            f"if ( {create}printf '%s' \"$BOARDWALK_LOCK_HOLDER\" > {path} ) 2>/dev/null; then exit 0; fi\n"
+            f"cat {path}\n"
+            f"exit {_lock_held_rc}\n"
+        )
+        return [
+            {
+                "name": "acquire_remote_lock",
+                "ansible.builtin.shell": {"cmd": cmd},
+                "environment": {
+                    "BOARDWALK_LOCK_HOLDER": f"{getpass.getuser()}@{socket.gethostname()} at {datetime.now(UTC)}"
+                },
+                "register": "remote_lock",
+                "changed_when": "remote_lock.rc == 0",
+                "failed_when": f"remote_lock.rc not in [0, {_lock_held_rc}]",
+            },
+            {
+                "name": "end_if_locked",
+                "ansible.builtin.meta": "end_host",
+                "when": f"remote_lock.rc == {_lock_held_rc}",
+            },
+        ]
 
-        if not stomp_existing_locks and (res := self.is_locked()):
-            # Check if there is already a lock on the host
-            raise RemoteHostLocked(f"{self.name}: Host is locked by {res}")
+    def _lock_alert_tasks(self, check: bool) -> AnsibleTasksType:
+        """Tasks that set the lock file's ownership and alert local users. They
+        need the ansible_system fact"""
         tasks: AnsibleTasksType = [
-            {"name": "get_ansible_system", "setup": {"filter": ["ansible_system"]}},
             {
                 "name": "set_linux_facts",
                 "ansible.builtin.set_fact": {"admin_group": "root"},
@@ -134,16 +241,34 @@ class Host(BaseModel, extra="forbid"):
                 "ansible.builtin.set_fact": {"admin_group": "wheel"},
                 "when": "ansible_system == 'Darwin'",
             },
-            {
-                "name": "create_remote_lock",
-                "ansible.builtin.copy": {
-                    "content": f"{getpass.getuser()}@{socket.gethostname()} at {datetime.now(UTC)}",
-                    "dest": str(self.remote_mutex_path),
-                    "mode": "0644",
-                    "owner": "root",
-                    "group": "{{ admin_group }}",
-                },
-            },
+        ]
+        if check:
+            # The lock file wasn't created, so show what creating it would do
+            tasks.append(
+                {
+                    "name": "create_remote_lock",
+                    "ansible.builtin.copy": {
+                        "content": f"{getpass.getuser()}@{socket.gethostname()} at {datetime.now(UTC)}",
+                        "dest": str(self.remote_mutex_path),
+                        "mode": "0644",
+                        "owner": "root",
+                        "group": "{{ admin_group }}",
+                    },
+                }
+            )
+        else:
+            tasks.append(
+                {
+                    "name": "set_remote_lock_ownership",
+                    "ansible.builtin.file": {
+                        "path": str(self.remote_mutex_path),
+                        "mode": "0644",
+                        "owner": "root",
+                        "group": "{{ admin_group }}",
+                    },
+                }
+            )
+        tasks += [
             {
                 "name": "create_motd_banner",
                 "ansible.builtin.copy": {
@@ -161,15 +286,89 @@ class Host(BaseModel, extra="forbid"):
                 "when": "ansible_system == 'Linux'",
             },
         ]
-        self.ansible_run(
+        return tasks
+
+    @staticmethod
+    def _lock_holder(runner: Runner) -> str | None:
+        """Returns who holds the remote lock if the lock tasks found it already
+        held, or None if it was acquired"""
+        for event in runner.events:
+            if event["event"] != "runner_on_ok":
+                continue
+            res = event["event_data"]["res"]
+            if event["event_data"]["task"] == "acquire_remote_lock" and res.get("rc") == _lock_held_rc:
+                return res.get("stdout", "").rstrip()
+            if event["event_data"]["task"] == "slurp_mutex_content":
+                return b64decode(res["content"]).decode("utf-8").rstrip()
+        return None
+
+    def postflight(
+        self,
+        remote_state_obj: boardwalk.state.RemoteStateModel,
+        become_password: str | None = None,
+        check: bool = False,
+        setup_args: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Sets the remote state fact, releases the remote lock, and refreshes
+        facts, all in a single Ansible invocation. The admin group is taken from
+        the ansible_system fact already in the host's facts. Returns the
+        refreshed facts
+        """
+        ansible_system = self.ansible_facts.get("ansible_system")
+        if ansible_system not in admin_groups:
+            raise BoardwalkException(f"{self.name}: Unsupported ansible_system {ansible_system}")
+        tasks: AnsibleTasksType = [
+            {
+                "name": "ensure_ansible_local_facts_dir",
+                "ansible.builtin.file": {
+                    "state": "directory",
+                    "path": "/etc/ansible/facts.d",
+                },
+            },
+            {
+                "name": "update_remote_state",
+                "ansible.builtin.copy": {
+                    "content": remote_state_obj.model_dump_json(),
+                    "dest": self.remote_state_path,
+                    "mode": "0644",
+                    "owner": "root",
+                    "group": admin_groups[ansible_system],
+                },
+            },
+            {
+                "name": "release_remote_lock",
+                "ansible.builtin.file": {
+                    "path": self.remote_mutex_path,
+                    "state": "absent",
+                },
+            },
+            {
+                "name": "delete_motd_banner",
+                "ansible.builtin.file": {
+                    "path": self.remote_alert_motd_path,
+                    "state": "absent",
+                },
+            },
+            {"name": "setup", "ansible.builtin.setup": setup_args or default_setup_args, "become": False},
+        ]
+        runner = self.ansible_run(
             become=True,
             become_password=become_password,
             check=check,
             gather_facts=False,
-            invocation_msg="lock_remote_host",
+            invocation_msg="postflight_remote_host",
             tasks=tasks,
             job_type=boardwalk.manifest.JobTypes.TASK,
         )
+        facts: dict[str, Any] = {}
+        for event in runner.events:
+            if event["event"] == "runner_on_ok" and event["event_data"]["task"] == "setup":
+                facts = event["event_data"]["res"]["ansible_facts"]
+        if len(facts) == 0:
+            raise BoardwalkException("postflight gather_facts returned nothing")
+        facts.setdefault("ansible_local", {})
+        return facts
 
     def release(self, become_password: str | None = None, check: bool = False) -> None:
         """Undoes the lock method"""
@@ -199,9 +398,9 @@ class Host(BaseModel, extra="forbid"):
             job_type=boardwalk.manifest.JobTypes.TASK,
         )
 
-    def gather_facts(self) -> dict[str, Any]:
+    def gather_facts(self, setup_args: dict[str, Any] | None = None) -> dict[str, Any]:
         """Returns the output of Ansible's setup module"""
-        tasks: AnsibleTasksType = [{"name": "setup", "ansible.builtin.setup": {"gather_timeout": 30}}]
+        tasks: AnsibleTasksType = [{"name": "setup", "ansible.builtin.setup": setup_args or default_setup_args}]
         runner = self.ansible_run(
             invocation_msg="gather_facts",
             gather_facts=False,
@@ -217,29 +416,12 @@ class Host(BaseModel, extra="forbid"):
         else:
             raise BoardwalkException("gather_facts returned nothing")
 
-    def get_remote_state(self) -> boardwalk.state.RemoteStateModel:
-        """Gets boardwalk's remote state fact as an object"""
-
-        # Get existing ansible_local facts, if any
-        tasks: AnsibleTasksType = [{"name": "setup", "ansible.builtin.setup": {"filter": ["ansible_local"]}}]
-        runner = self.ansible_run(
-            invocation_msg="get_remote_state",
-            gather_facts=False,
-            tasks=tasks,
-            job_type=boardwalk.manifest.JobTypes.TASK,
-        )
-
-        # Get existing boardwalk_state fact, if any
-        for event in runner.events:
-            if event["event"] == "runner_on_ok" and event["event_data"]["task"] == "setup":
-                try:
-                    return boardwalk.RemoteStateModel.model_validate(
-                        event["event_data"]["res"]["ansible_facts"]["ansible_local"]["boardwalk_state"]
-                    )
-                except KeyError:
-                    pass
-
-        return boardwalk.RemoteStateModel()
+    def remote_state_from_facts(self) -> boardwalk.state.RemoteStateModel:
+        """Gets boardwalk's remote state fact as an object from the host's stored facts"""
+        try:
+            return boardwalk.RemoteStateModel.model_validate(self.ansible_facts["ansible_local"]["boardwalk_state"])
+        except KeyError:
+            return boardwalk.RemoteStateModel()
 
     def set_remote_state(
         self,
@@ -250,17 +432,7 @@ class Host(BaseModel, extra="forbid"):
         """Sets the remote state fact from an object in the remote and local state"""
         workspace = boardwalk.manifest.get_ws()
         tasks: AnsibleTasksType = [
-            {"name": "get_ansible_system", "setup": {"filter": ["ansible_system"]}},
-            {
-                "name": "set_linux_facts",
-                "ansible.builtin.set_fact": {"admin_group": "root"},
-                "when": "ansible_system == 'Linux'",
-            },
-            {
-                "name": "set_darwin_facts",
-                "ansible.builtin.set_fact": {"admin_group": "wheel"},
-                "when": "ansible_system == 'Darwin'",
-            },
+            *self._admin_group_tasks(),
             {
                 "name": "ensure_ansible_local_facts_dir",
                 "ansible.builtin.file": {
@@ -290,7 +462,7 @@ class Host(BaseModel, extra="forbid"):
         )
         if not check:
             self.ansible_facts["ansible_local"]["boardwalk_state"] = remote_state_obj.model_dump()
-            workspace.flush()
+            workspace.flush_host(self)
 
     def clear_remote_state_fact(
         self,
@@ -299,17 +471,7 @@ class Host(BaseModel, extra="forbid"):
     ) -> Runner:
         """Removes Boardwalk's remote state fact from the remote and local state."""
         tasks: AnsibleTasksType = [
-            {"name": "get_ansible_system", "setup": {"filter": ["ansible_system"]}},
-            {
-                "name": "set_linux_facts",
-                "ansible.builtin.set_fact": {"admin_group": "root"},
-                "when": "ansible_system == 'Linux'",
-            },
-            {
-                "name": "set_darwin_facts",
-                "ansible.builtin.set_fact": {"admin_group": "wheel"},
-                "when": "ansible_system == 'Darwin'",
-            },
+            *self._admin_group_tasks(),
             {
                 "name": "clear_remote_state_fact",
                 "ansible.builtin.file": {
@@ -329,7 +491,7 @@ class Host(BaseModel, extra="forbid"):
         )
         if not check:
             self.ansible_facts.get("ansible_local", {}).pop("boardwalk_state", None)
-            boardwalk.manifest.get_ws().flush()
+            boardwalk.manifest.get_ws().flush_host(self)
         return runner
 
     def clear_remote_mutex(
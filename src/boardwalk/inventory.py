@@ -0,0 +1,317 @@
+"""
+Resolves Ansible host patterns in-process against the output of
+ansible-inventory, so matching hosts doesn't need another Ansible subprocess.
+The output of ansible-inventory is cached on disk, keyed on everything that
+may change it
+"""
+
+from __future__ import annotations
+
+import configparser
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import time
+from functools import cache
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING, cast
+
+from loguru import logger
+
+from boardwalk.ansible import ansible_inventory
+from boardwalk.app_exceptions import BoardwalkException
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from boardwalk.ansible import HostVarsType, InventoryData
+
+# Splits a pattern on ":" like Ansible does, without splitting bracketed
+# subscripts or ranges
+_PATTERN_SPLIT = re.compile(r"(?:[^\s:\[\]]|\[[^\]]*\])+")
+# A pattern subscript, e.g. webservers[0], webservers[-1] or webservers[1:3]
+_PATTERN_SUBSCRIPT = re.compile(r"^(.+)\[(?:(-?[0-9]+)|(-?[0-9]+)?:(-?[0-9]+)?)\]$")
+
+
+def split_host_pattern(pattern: str) -> list[str]:
+    """Splits a host pattern string into its terms"""
+    pattern = pattern.strip()
+    if "," in pattern:
+        return [term.strip() for term in pattern.split(",") if term.strip()]
+    return _PATTERN_SPLIT.findall(pattern)
+
+
+class Inventory:
+    """
+    An Ansible inventory as produced by `ansible-inventory --list`. Group
+    membership is indexed once, and host patterns are resolved the same way
+    Ansible resolves them
+    """
+
+    def __init__(self, data: InventoryData):
+        self.hostvars: HostVarsType = data.get("_meta", {}).get("hostvars", {})
+        # ansible-inventory maps every other key to a group with lists of hosts
+        # and children
+        self._groups = cast(
+            "dict[str, dict[str, list[str]]]", {name: group for name, group in data.items() if name != "_meta"}
+        )
+        # Hosts are kept in inventory order, and dicts are used as ordered sets
+        hosts: dict[str, None] = dict.fromkeys(self.hostvars)
+        for group in self._groups.values():
+            hosts.update(dict.fromkeys(group.get("hosts", [])))
+        self.hosts = list(hosts)
+        self._host_set = set(hosts)
+        self._group_hosts_cache: dict[str, list[str]] = {}
+
+    @property
+    def groups(self) -> list[str]:
+        return list(self._groups)
+
+    def group_index(self, pattern: str) -> dict[str, str]:
+        """Maps each host to the first group matching pattern that it's in"""
+        index: dict[str, str] = {}
+        if not pattern:
+            return index
+        for term in split_host_pattern(pattern):
+            if term in self._groups:
+                groups = [term]
+            else:
+                matcher = _term_matcher(term)
+                groups = [group for group in self._groups if matcher(group)]
+            for group in groups:
+                for host in self.group_hosts(group):
+                    index.setdefault(host, group)
+        return index
+
+    def group_hosts(self, name: str) -> list[str]:
+        """Returns the hosts in a group, including those in its child groups"""
+        if name == "all":
+            return self.hosts
+        try:
+            return self._group_hosts_cache[name]
+        except KeyError:
+            pass
+        hosts: dict[str, None] = {}
+        seen: set[str] = set()
+        stack = [name]
+        while stack:
+            group_name = stack.pop()
+            if group_name in seen:
+                continue
+            seen.add(group_name)
+            group = self._groups.get(group_name, {})
+            hosts.update(dict.fromkeys(group.get("hosts", [])))
+            stack.extend(reversed(group.get("children", [])))
+        self._group_hosts_cache[name] = list(hosts)
+        return self._group_hosts_cache[name]
+
+    def resolve(self, pattern: str | Iterable[str]) -> list[str]:
+        """
+        Returns the hosts matching a pattern, in inventory order. Terms prefixed
+        with & are intersected and terms prefixed with ! are excluded, after
+        all other terms are combined
+        """
+        terms = split_host_pattern(pattern) if isinstance(pattern, str) else list(pattern)
+        union = [t for t in terms if t[0] not in "&!"]
+        intersections = [t[1:] for t in terms if t[0] == "&"]
+        exclusions = [t[1:] for t in terms if t[0] == "!"]
+        if not union:
+            union = ["all"]
+
+        hosts: dict[str, None] = {}
+        for term in union:
+            hosts.update(dict.fromkeys(self._match_term(term)))
+        for term in intersections:
+            matched = set(self._match_term(term))
+            hosts = {host: None for host in hosts if host in matched}
+        for term in exclusions:
+            matched = set(self._match_term(term))
+            hosts = {host: None for host in hosts if host not in matched}
+        return list(hosts)
+
+    def resolve_limit(self, host_pattern: str, limit: str) -> list[str]:
+        """
+        Returns the hosts matching both host_pattern and a --limit expression.
+        As with Ansible, terms in the limit may be read from a file with @path
+        """
+        limit_terms: list[str] = []
+        for term in split_host_pattern(limit):
+            if term.startswith("@"):
+                try:
+                    lines = Path(term[1:]).read_text().splitlines()
+                except FileNotFoundError:
+                    raise BoardwalkException(f"Limit file {term[1:]} does not exist")
+                limit_terms.extend(line.strip() for line in lines if line.strip())
+            else:
+                limit_terms.append(term)
+        if not limit_terms:
+            return []
+        limited = set(self.resolve(limit_terms))
+        return [host for host in self.resolve(host_pattern) if host in limited]
+
+    def _match_term(self, term: str) -> list[str]:
+        """Returns hosts matching a single pattern term, applying any subscript"""
+        if term.startswith("~") or not (subscript := _PATTERN_SUBSCRIPT.match(term)):
+            return self._enumerate_matches(term)
+        name, index, start, end = subscript.groups()
+        hosts = self._enumerate_matches(name)
+        if index is not None:
+            try:
+                return [hosts[int(index)]]
+            except IndexError:
+                return []
+        # Ansible's ranges include the end
+        stop = int(end) + 1 if end is not None else None
+        return hosts[int(start or 0) : None if stop == 0 else stop]
+
+    def _enumerate_matches(self, term: str) -> list[str]:
+        """Matches a term against group names, and also host names if no group
+        matched or the term is a regex or glob"""
+        if term in ("all", "*"):
+            return self.hosts
+        hosts: dict[str, None] = {}
+        if term[0] == "~" or any(c in term for c in "?*["):
+            matcher = _term_matcher(term)
+            for group in self._groups:
+                if matcher(group):
+                    hosts.update(dict.fromkeys(self.group_hosts(group)))
+            hosts.update(dict.fromkeys(host for host in self.hosts if matcher(host)))
+        elif term in self._groups:
+            hosts.update(dict.fromkeys(self.group_hosts(term)))
+            # Like Ansible, a name with a dot may be both a group and a host
+            if "." in term and term in self._host_set:
+                hosts[term] = None
+        elif term in self._host_set:
+            hosts[term] = None
+        return list(hosts)
+
+
+@cache
+def _term_matcher(term: str):
+    """Compiles a term the way Ansible does: ~ prefixes a regex, anything else
+    is a glob"""
+    try:
+        if term.startswith("~"):
+            return re.compile(term[1:]).match
+        return re.compile(fnmatch.translate(term)).match
+    except re.error as e:
+        raise BoardwalkException(f'Invalid host pattern "{term}": {e}')
+
+
+inventory_cache_dir = Path.cwd().joinpath(".boardwalk/inventory_cache")
+
+# Environment variables that may change what ansible-inventory outputs
+_INVENTORY_ENV_PREFIXES = ("ANSIBLE_INVENTORY", "ANSIBLE_VAULT", "ANSIBLE_COLLECTIONS_PATH")
+_INVENTORY_ENV_VARS = ("ANSIBLE_CONFIG", "ANSIBLE_VARS_ENABLED", "ANSIBLE_VARS_PLUGINS")
+
+_inventory: Inventory | None = None
+
+
+def _ansible_config_path() -> Path | None:
+    """Returns the ansible.cfg Ansible would use, in Ansible's search order"""
+    candidates = [os.environ.get("ANSIBLE_CONFIG", ""), "ansible.cfg", "~/.ansible.cfg", "/etc/ansible/ansible.cfg"]
+    for candidate in candidates:
+        if candidate and (path := Path(candidate).expanduser()).is_file():
+            return path
+    return None
+
+
+def inventory_sources(config_path: Path | None) -> list[Path]:
+    """Returns the inventory sources Ansible would read"""
+    base = Path.cwd()
+    sources = os.environ.get("ANSIBLE_INVENTORY")
+    if sources is None and config_path is not None:
+        config = configparser.ConfigParser(interpolation=None)
+        try:
+            config.read(config_path)
+        except configparser.Error:
+            pass
+        sources = config.get("defaults", "inventory", fallback=None)
+        # Relative paths in ansible.cfg are relative to the file
+        base = config_path.parent
+    if sources is None:
+        sources = "/etc/ansible/hosts"
+    return [base.joinpath(Path(source.strip()).expanduser()) for source in sources.split(",") if source.strip()]
+
+
+def _hash_path(digest, path: Path):
+    """Adds the contents of a file, or every file under a directory, to digest"""
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file in files:
+        digest.update(os.fsencode(file))
+        try:
+            digest.update(file.read_bytes())
+        except OSError:
+            digest.update(b"\0missing")
+
+
+def inventory_cache_key() -> str:
+    """Returns a digest of the inventory sources (with their group_vars and
+    host_vars), ansible.cfg and Ansible's inventory related env vars"""
+    digest = hashlib.sha256()
+    config_path = _ansible_config_path()
+    if config_path is not None:
+        _hash_path(digest, config_path)
+    for source in inventory_sources(config_path):
+        _hash_path(digest, source)
+        base = source if source.is_dir() else source.parent
+        for vars_dir in ("group_vars", "host_vars"):
+            if (path := base.joinpath(vars_dir)).is_dir():
+                _hash_path(digest, path)
+    for name in sorted(os.environ):
+        if name in _INVENTORY_ENV_VARS or name.startswith(_INVENTORY_ENV_PREFIXES):
+            digest.update(f"{name}={os.environ[name]}".encode())
+    return digest.hexdigest()
+
+
+def _read_cached_inventory(key: str, ttl: float) -> InventoryData | None:
+    path = inventory_cache_dir.joinpath(f"{key}.json")
+    try:
+        if time.time() - path.stat().st_mtime <= ttl:
+            return json.loads(path.read_text())
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        logger.warning(f"Ignoring unreadable inventory cache {path}")
+    return None
+
+
+def _write_cached_inventory(key: str, data: InventoryData):
+    inventory_cache_dir.mkdir(parents=True, exist_ok=True)
+    # The cache may hold sensitive hostvars. Like all temp files it's only
+    # readable by its owner
+    with NamedTemporaryFile(mode="w", delete=False, dir=inventory_cache_dir, prefix=f"{key}.json.") as fd:
+        json.dump(data, fd)
+    os.rename(src=fd.name, dst=inventory_cache_dir.joinpath(f"{key}.json"))
+    # Only the latest inventory is kept
+    for path in inventory_cache_dir.glob("*.json"):
+        if path.stem != key:
+            path.unlink(missing_ok=True)
+
+
+def get_inventory(ttl: float = 0, refresh: bool = False) -> Inventory:
+    """
+    Returns the inventory, running ansible-inventory the first time it's needed.
+    Output cached on disk within the last `ttl` seconds is reused unless refresh
+    is True, as long as nothing that could change it has changed
+    """
+    global _inventory
+    if _inventory is not None and not refresh:
+        return _inventory
+
+    if ttl <= 0:
+        _inventory = Inventory(ansible_inventory())
+        return _inventory
+
+    key = inventory_cache_key()
+    data = None if refresh else _read_cached_inventory(key, ttl)
+    if data is None:
+        data = ansible_inventory()
+        _write_cached_inventory(key, data)
+    else:
+        logger.info("Using cached ansible-inventory output")
+    _inventory = Inventory(data)
+    return _inventory
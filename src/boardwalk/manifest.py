@@ -5,24 +5,26 @@ Boardwalkfile.py
 
 from __future__ import annotations
 
-import json
+import fnmatch
 import os
 import sys
+import threading
+import time
 import warnings
 from abc import ABC, abstractmethod
 from enum import Enum
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import TYPE_CHECKING, overload
+from typing import TYPE_CHECKING, Any, overload
 
 from boardwalk.app_exceptions import BoardwalkException
-from boardwalk.state import LocalState
+from boardwalk.state import ShardedLocalStateStore
+from boardwalk.watcher import WorkspaceWatcher
 
 if TYPE_CHECKING:
     from collections.abc import Callable
-    from typing import Any
 
     from boardwalk.ansible import AnsibleFacts, AnsibleTasksType, InventoryHostVars
+    from boardwalk.host import Host
 
 workspaces_dir = Path.cwd().joinpath(".boardwalk/workspaces")
 active_workspace_file = workspaces_dir.joinpath("active_workspace.txt")
@@ -273,11 +275,42 @@ class WorkspaceConfig:
     """
     Configuration block for workspaces
 
+    :param ansible_backend: How `boardwalk run` executes Ansible. "subprocess"
+    spawns ansible_runner for each invocation. "persistent" keeps long-lived
+    Ansible worker processes warm for the whole run. Valid backends are specified
+    in the valid_ansible_backends attribute
     :param default_sort_order: The default order hosts will be walked through
     (by hostname). Valid sort orders are specified in the valid_sort_orders
     attribute
+    :param fact_filter: Optional glob patterns passed to the setup module's
+    filter option, limiting which facts are returned by hosts. ansible_local and
+    ansible_system are always included, because Boardwalk uses them
+    :param facts_ttl: Seconds that facts gathered from a host are considered
+    fresh. When `run` reaches a host whose facts are fresh, its pre-flight only
+    refreshes ansible_local and ansible_system instead of gathering all facts
+    again. 0, the default, always gathers all facts
+    :param gather_subset: Optional subsets passed to the setup module's
+    gather_subset option, e.g. ["!all", "network"]. The local and platform
+    subsets are always gathered. Defaults to Ansible's default subsets
     :param host_pattern: The Ansible host pattern the workspace targets. If this
     changes after initialization, the workspace needs to be re-initialized
+    :param inventory_cache_ttl: Seconds that cached ansible-inventory output may
+    be reused, as long as the inventory sources, ansible.cfg and Ansible
+    inventory env vars are unchanged. Defaults to 0, which disables the cache.
+    May be bypassed with `boardwalk run --refresh-inventory`
+    :param kept_facts: Optional glob patterns of the facts kept in the local
+    state. Other facts are dropped when gathered, so they are neither stored nor
+    visible to job preconditions. ansible_local and ansible_system are always
+    kept. Defaults to keeping all facts
+    :param parallel_hosts: The default number of hosts the workflow may run
+    against concurrently. Defaults to 1, which walks hosts one at a time. May be
+    overridden with `boardwalk run --parallel`
+    :param prefetch_hosts: The number of upcoming hosts whose facts are gathered
+    in the background while the workflow runs against earlier hosts. A
+    prefetched host that doesn't meet preconditions is skipped without being
+    locked, and its pre-flight only refreshes ansible_local and ansible_system.
+    Defaults to 0, which disables prefetching. May be overridden with
+    `boardwalk run --prefetch`
     :param require_limit: `check` and `run` subcommands will require the --limit
     option to be passed. This is useful for workspaces configured with a broad
     host pattern but workflows should be intentionally down-scoped to a specific
@@ -288,24 +321,54 @@ class WorkspaceConfig:
     :param workflow: The workflow the workspace uses
     """
 
+    valid_ansible_backends: frozenset[str] = frozenset(["persistent", "subprocess"])
     valid_sort_orders: frozenset[str] = frozenset(["ascending", "descending", "shuffle"])
+    # Facts and setup subsets Boardwalk itself relies on
+    required_facts: tuple[str, ...] = ("ansible_local", "ansible_system")
+    required_gather_subsets: tuple[str, ...] = ("local", "platform")
 
     def __init__(
         self,
         host_pattern: str,
         workflow: Workflow,
+        ansible_backend: str = "subprocess",
         default_sort_order: str = "shuffle",
+        fact_filter: list[str] | None = None,
+        facts_ttl: int = 0,
+        gather_subset: list[str] | None = None,
+        inventory_cache_ttl: int = 0,
+        kept_facts: list[str] | None = None,
+        parallel_hosts: int = 1,
+        prefetch_hosts: int = 0,
         require_limit: bool = False,
         ui_group: str = "",
         ui_group_inventory_var: str = "",
     ):
+        self.ansible_backend = ansible_backend
         self.default_sort_order = default_sort_order
+        self.fact_filter = fact_filter
+        self.facts_ttl = facts_ttl
+        self.gather_subset = gather_subset
         self.host_pattern = host_pattern
+        self.inventory_cache_ttl = inventory_cache_ttl
+        self.kept_facts = kept_facts
+        self.parallel_hosts = parallel_hosts
+        self.prefetch_hosts = prefetch_hosts
         self.require_limit = require_limit
         self.ui_group = ui_group
         self.ui_group_inventory_var = ui_group_inventory_var
         self.workflow = workflow
 
+    @property
+    def ansible_backend(self) -> str:
+        return self._ansible_backend
+
+    @ansible_backend.setter
+    def ansible_backend(self, value: str):
+        if value not in self.valid_ansible_backends:
+            raise ValueError(f"Valid ansible_backend values are: {', '.join(sorted(self.valid_ansible_backends))}")
+        self._ansible_backend = value
+
     @property
     def default_sort_order(self) -> str:
         return self._default_sort_order
@@ -315,6 +378,76 @@ class WorkspaceConfig:
         self._is_valid_sort_order(value)
         self._default_sort_order = value
 
+    @property
+    def setup_args(self) -> dict[str, Any]:
+        """The arguments Boardwalk passes to Ansible's setup module"""
+        args: dict[str, Any] = {"gather_timeout": 30}
+        if self.gather_subset is not None:
+            args["gather_subset"] = list(dict.fromkeys([*self.gather_subset, *self.required_gather_subsets]))
+        if self.fact_filter is not None:
+            args["filter"] = list(dict.fromkeys([*self.fact_filter, *self.required_facts]))
+        return args
+
+    @property
+    def refresh_setup_args(self) -> dict[str, Any]:
+        """The arguments passed to Ansible's setup module to refresh only the
+        facts Boardwalk needs"""
+        return {
+            "gather_timeout": 30,
+            "gather_subset": ["!all", "!min", *self.required_gather_subsets],
+            "filter": list(self.required_facts),
+        }
+
+    def filter_facts(self, facts: dict[str, Any]) -> dict[str, Any]:
+        """Returns only the facts that are kept in the local state"""
+        if self.kept_facts is None:
+            return facts
+        return {
+            name: value
+            for name, value in facts.items()
+            if name in self.required_facts or any(fnmatch.fnmatchcase(name, pattern) for pattern in self.kept_facts)
+        }
+
+    @property
+    def facts_ttl(self) -> int:
+        return self._facts_ttl
+
+    @facts_ttl.setter
+    def facts_ttl(self, value: int):
+        if value < 0:
+            raise ValueError("facts_ttl must not be negative")
+        self._facts_ttl = value
+
+    @property
+    def inventory_cache_ttl(self) -> int:
+        return self._inventory_cache_ttl
+
+    @inventory_cache_ttl.setter
+    def inventory_cache_ttl(self, value: int):
+        if value < 0:
+            raise ValueError("inventory_cache_ttl must not be negative")
+        self._inventory_cache_ttl = value
+
+    @property
+    def parallel_hosts(self) -> int:
+        return self._parallel_hosts
+
+    @parallel_hosts.setter
+    def parallel_hosts(self, value: int):
+        if value < 1:
+            raise ValueError("parallel_hosts must be at least 1")
+        self._parallel_hosts = value
+
+    @property
+    def prefetch_hosts(self) -> int:
+        return self._prefetch_hosts
+
+    @prefetch_hosts.setter
+    def prefetch_hosts(self, value: int):
+        if value < 0:
+            raise ValueError("prefetch_hosts must not be negative")
+        self._prefetch_hosts = value
+
     def _is_valid_sort_order(self, value: str):
         """Checks if a given sort order is valid. Raises a ValueError if not"""
         if value not in self.valid_sort_orders:
@@ -348,14 +481,21 @@ class Workspace(ABC):
             self.path = workspaces_dir.joinpath(self.name)
             self.path.mkdir(parents=True, exist_ok=True)
 
+            # Hosts may run concurrently, so writes to the statefile are serialized
+            self._flush_lock = threading.Lock()
+
+            # While watched, the catch and mutex files are tracked in memory
+            # instead of being checked on disk each time
+            self._watcher = WorkspaceWatcher(self.path, ("catch.lock", "workspace.mutex"))
+
             self.cfg = self.config()
 
             # Get and set the state if there is one, else create one
+            self.state_store = ShardedLocalStateStore(self.path)
             try:
-                with open(self.path.joinpath("statefile.json")) as fd:
-                    self.state = LocalState.model_validate(json.load(fd))
+                self.state = self.state_store.load()
             except FileNotFoundError:
-                self.state = LocalState(host_pattern=self.cfg.host_pattern)
+                self.state = self.state_store.new_state(self.cfg.host_pattern)
                 self.flush()
 
             self._initialized = True
@@ -376,21 +516,26 @@ class Workspace(ABC):
         raise NotImplementedError
 
     def flush(self):
-        """Flush workspace state to disk"""
-        # The statefile is first written to a temp file so that failures in flushing
-        # will not corrupt an existing statefile
-        with open(
-            NamedTemporaryFile(mode="wb", delete=False, dir=self.path, prefix="statefile.json.").name, mode="w"
-        ) as fd:
-            q = self.state.model_dump_json()
-            fd.write(q)
-        os.rename(src=fd.name, dst=self.path.joinpath("statefile.json"))
+        """Flush the whole workspace state to disk"""
+        with self._flush_lock:
+            self.state_store.save(self.state)
+
+    def flush_host(self, host: Host, index: bool = True):
+        """Flush a single host's state to disk. If index is False, a new host is
+        only added to the state's index by a later flush_index"""
+        with self._flush_lock:
+            self.state_store.save_host(self.state, host, index=index)
+
+    def flush_index(self):
+        """Flush the list of hosts in the state to disk"""
+        with self._flush_lock:
+            self.state_store.save_index(self.state)
 
     def reset(self):
         """Resets active workspace. Configuration is retained but other state is lost"""
         # We try to get a mutex on the workspace so we don't reset a workspace that has something running
         self.mutex()
-        self.state = LocalState(host_pattern=self.cfg.host_pattern)
+        self.state = self.state_store.new_state(self.cfg.host_pattern)
         self.flush()
         self.unmutex()
 
@@ -403,9 +548,12 @@ class Workspace(ABC):
             self.path.joinpath("workspace.mutex").touch(exist_ok=False)
         except FileExistsError:
             raise BoardwalkException("Workspace is locked by another operation")
+        self._refresh_watch("workspace.mutex")
 
     def has_mutex(self):
         """Checks if the workspace has a mutex. Returns True if so"""
+        if self._watcher.running:
+            return self._watcher.exists("workspace.mutex")
         return self.path.joinpath("workspace.mutex").exists()
 
     def unmutex(self):
@@ -414,18 +562,48 @@ class Workspace(ABC):
             self.path.joinpath("workspace.mutex").unlink(missing_ok=True)
         except WorkspaceNotFound:
             pass
+        self._refresh_watch("workspace.mutex")
 
     def catch(self):
         """Catche workspace workflow at next host"""
         self.path.joinpath("catch.lock").touch()
+        self._refresh_watch("catch.lock")
 
     def caught(self):
         """Checks if workspace is caught. Returns true if it is"""
+        if self._watcher.running:
+            return self._watcher.exists("catch.lock")
         return self.path.joinpath("catch.lock").exists()
 
     def release(self):
         """Removes workspace workflow catch if set"""
         self.path.joinpath("catch.lock").unlink(missing_ok=True)
+        self._refresh_watch("catch.lock")
+
+    def wait_for_release(self):
+        """Blocks until the workspace is not caught"""
+        if self._watcher.running:
+            self._watcher.wait("catch.lock", exists=False)
+            return
+        while self.caught():
+            time.sleep(5)  # nosemgrep: python.lang.best-practice.sleep.arbitrary-sleep
+
+    def watch(self):
+        """
+        Starts tracking the catch and mutex files in memory, so that checking
+        them doesn't touch the disk and a release is seen as soon as it happens
+        """
+        self._watcher.start()
+
+    def unwatch(self):
+        """Stops tracking the catch and mutex files in memory"""
+        self._watcher.stop()
+
+    def _refresh_watch(self, name: str):
+        """Updates the watcher right away after this process changes a file,
+        rather than waiting for it to notice"""
+        if self._watcher.running:
+            self._watcher.refresh(name)
 
     @staticmethod
     def use(name: str):
@@ -2,7 +2,18 @@
 This file holds the state model
 """
 
-from pydantic import BaseModel
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Callable, Iterable, Iterator, Mapping, MutableMapping
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any
+from urllib.parse import quote
+
+from loguru import logger
+from pydantic import BaseModel, Field, field_serializer, field_validator
 
 from boardwalk.host import Host
 
@@ -11,11 +22,162 @@ class StateBaseModel(BaseModel, extra="forbid"):
     """Base model for local and remote state"""
 
 
-class LocalState(StateBaseModel):
+class HostMap(MutableMapping[str, Host]):
+    """
+    Mapping of host names to Hosts. Hosts known only by name are read and
+    validated by the loader the first time they are accessed, so commands that
+    touch a few hosts don't pay for loading every host in the workspace
+    """
+
+    def __init__(
+        self,
+        hosts: Mapping[str, Host] | None = None,
+        names: Iterable[str] = (),
+        loader: Callable[[str], Host] | None = None,
+    ):
+        # Unloaded hosts are held as None, so the order of hosts is preserved
+        self._hosts: dict[str, Host | None] = dict.fromkeys(names)
+        self._hosts.update(hosts or {})
+        self._loader = loader
+
+    def __getitem__(self, name: str) -> Host:
+        host = self._hosts[name]
+        if host is None:
+            if self._loader is None:
+                raise KeyError(name)
+            host = self._hosts[name] = self._loader(name)
+        return host
+
+    def __setitem__(self, name: str, host: Host):
+        self._hosts[name] = host
+
+    def __delitem__(self, name: str):
+        del self._hosts[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._hosts
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._hosts)
+
+    def __len__(self) -> int:
+        return len(self._hosts)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self._hosts)})"
+
+    def is_loaded(self, name: str) -> bool:
+        return self._hosts.get(name) is not None
+
+    def unload(self, name: str):
+        """Drops a host from memory, to be read again by the loader if it's
+        accessed. The host must have been saved first"""
+        if self._loader is not None and name in self._hosts:
+            self._hosts[name] = None
+
+
+class LocalState(StateBaseModel, arbitrary_types_allowed=True):
     """Model for local workspace state"""
 
     host_pattern: str
-    hosts: dict[str, Host] = {}
+    hosts: HostMap = Field(default_factory=HostMap)
+
+    @field_validator("hosts", mode="before")
+    @classmethod
+    def validate_hosts(cls, hosts: Any) -> HostMap:
+        if isinstance(hosts, HostMap):
+            return hosts
+        return HostMap({name: Host.model_validate(host) for name, host in hosts.items()})
+
+    @field_serializer("hosts")
+    def serialize_hosts(self, hosts: HostMap) -> dict[str, Host]:
+        return dict(hosts.items())
+
+
+class LocalStateIndex(StateBaseModel):
+    """Model for the index of a sharded local state"""
+
+    host_pattern: str
+    hosts: list[str] = []
+
+
+def _write_atomically(path: Path, data: str):
+    """Writes to a temp file first so that failures will not corrupt an existing file"""
+    with NamedTemporaryFile(mode="w", delete=False, dir=path.parent, prefix=f"{path.name}.") as fd:
+        fd.write(data)
+    os.rename(src=fd.name, dst=path)
+
+
+class ShardedLocalStateStore:
+    """
+    Stores a LocalState as an index plus one file per host, so that updating a
+    single host only rewrites that host's file instead of the whole state. A
+    legacy single-file statefile.json is migrated the first time it's loaded
+    """
+
+    def __init__(self, workspace_path: Path):
+        self.legacy_path = workspace_path.joinpath("statefile.json")
+        self.path = workspace_path.joinpath("state")
+        self.index_path = self.path.joinpath("index.json")
+        self.hosts_path = self.path.joinpath("hosts")
+        self._indexed_hosts: set[str] = set()
+
+    def host_path(self, name: str) -> Path:
+        # Host names come from the inventory, so they're escaped to be safe as file names
+        return self.hosts_path.joinpath(f"{quote(name, safe='')}.json")
+
+    def load(self) -> LocalState:
+        """Loads the stored state. Raises FileNotFoundError if there is none"""
+        try:
+            index = LocalStateIndex.model_validate_json(self.index_path.read_text())
+        except FileNotFoundError:
+            return self._migrate_legacy()
+        self._indexed_hosts = set(index.hosts)
+        return LocalState(host_pattern=index.host_pattern, hosts=HostMap(names=index.hosts, loader=self.load_host))
+
+    def new_state(self, host_pattern: str) -> LocalState:
+        """Returns an empty state whose hosts may be unloaded once saved"""
+        return LocalState(host_pattern=host_pattern, hosts=HostMap(loader=self.load_host))
+
+    def load_host(self, name: str) -> Host:
+        return Host.model_validate_json(self.host_path(name).read_text())
+
+    def _migrate_legacy(self) -> LocalState:
+        with open(self.legacy_path) as fd:
+            state = LocalState.model_validate(json.load(fd))
+        logger.info(f"Migrating {self.legacy_path} to a per-host state in {self.path}")
+        self.save(state)
+        # The old statefile is kept as a backup, under a name that won't be loaded again
+        os.rename(src=self.legacy_path, dst=self.legacy_path.with_name("statefile.json.migrated"))
+        return self.load()
+
+    def save(self, state: LocalState):
+        """Writes every host, the index, and removes hosts no longer in the state"""
+        self.hosts_path.mkdir(parents=True, exist_ok=True)
+        for name in state.hosts:
+            # Hosts that were never loaded can't have changed
+            if isinstance(state.hosts, HostMap) and not state.hosts.is_loaded(name):
+                continue
+            _write_atomically(self.host_path(name), state.hosts[name].model_dump_json())
+        self.save_index(state)
+        keep = {self.host_path(name).name for name in state.hosts}
+        for path in self.hosts_path.glob("*.json"):
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+
+    def save_host(self, state: LocalState, host: Host, index: bool = True):
+        """Writes a single host, updating the index only if the host is new. When
+        many hosts are being added, index may be False to update it later with
+        save_index"""
+        self.hosts_path.mkdir(parents=True, exist_ok=True)
+        _write_atomically(self.host_path(host.name), host.model_dump_json())
+        if index and host.name not in self._indexed_hosts:
+            self.save_index(state)
+
+    def save_index(self, state: LocalState):
+        index = LocalStateIndex(host_pattern=state.host_pattern, hosts=list(state.hosts))
+        _write_atomically(self.index_path, index.model_dump_json())
+        self._indexed_hosts = set(index.hosts)
 
 
 class RemoteStateWorkflow(StateBaseModel):
@@ -0,0 +1,171 @@
+"""
+Watches for flag files in a workspace directory, such as the catch and mutex
+files, keeping whether each one exists in memory. On Linux inotify is used, so
+changes are seen as soon as they happen without stat-ing the files; elsewhere
+the files are polled from a single background thread
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from pathlib import Path
+
+# inotify(7) constants
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_WATCH_MASK = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+_IN_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _inotify_init(path: Path) -> int | None:
+    """Returns an inotify file descriptor watching path, or None if inotify
+    isn't available"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), _IN_WATCH_MASK) < 0:
+        logger.debug(f"Could not watch {path}: {os.strerror(ctypes.get_errno())}")
+        os.close(fd)
+        return None
+    return fd
+
+
+class WorkspaceWatcher:
+    """
+    Keeps track of whether the named files exist in a directory, and lets
+    callers wait for one to be created or removed
+    """
+
+    # Even with inotify, files are re-checked this often in case an event was missed
+    resync_interval = 30.0
+
+    def __init__(self, path: Path, names: Iterable[str], poll_interval: float = 1.0):
+        self.path = path
+        self.names = frozenset(names)
+        self.poll_interval = poll_interval
+        self.backend: str | None = None
+        self._exists: dict[str, bool] = {}
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._quit = threading.Event()
+        self._inotify_fd: int | None = None
+        self._wake_r, self._wake_w = -1, -1
+
+    def start(self):
+        """Starts watching. Does nothing if already started"""
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._quit.clear()
+        self._inotify_fd = _inotify_init(self.path)
+        if self._inotify_fd is not None:
+            self.backend = "inotify"
+            self._wake_r, self._wake_w = os.pipe()
+            target = self._watch_inotify
+        else:
+            self.backend = "polling"
+            target = self._watch_polling
+        logger.debug(f"Watching {self.path} for {sorted(self.names)} using {self.backend}")
+        self._thread = threading.Thread(target=target, name="boardwalk_workspace_watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching. Does nothing if not started"""
+        if self._thread is None:
+            return
+        self._quit.set()
+        if self._wake_w >= 0:
+            os.write(self._wake_w, b"\0")
+        self._thread.join()
+        self._thread = None
+        for fd in (self._inotify_fd, self._wake_r, self._wake_w):
+            if fd is not None and fd >= 0:
+                os.close(fd)
+        self._inotify_fd = None
+        self._wake_r, self._wake_w = -1, -1
+        self.backend = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def exists(self, name: str) -> bool:
+        """Returns whether the named file exists, as last seen by the watcher"""
+        with self._condition:
+            return self._exists[name]
+
+    def refresh(self, name: str | None = None):
+        """Checks whether the named file, or all watched files, exist, and wakes
+        any waiters if that changed"""
+        names = self.names if name is None else {name}
+        with self._condition:
+            for n in names:
+                self._exists[n] = self.path.joinpath(n).exists()
+            self._condition.notify_all()
+
+    def wait(self, name: str, exists: bool, timeout: float | None = None) -> bool:
+        """Waits until the named file does or does not exist. Returns False if the
+        timeout passed first"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._exists[name] is exists, timeout=timeout)
+
+    def _watch_polling(self):
+        while not self._quit.wait(self.poll_interval):
+            self.refresh()
+
+    def _watch_inotify(self):
+        if self._inotify_fd is None:
+            raise RuntimeError("WorkspaceWatcher inotify descriptor is not open")
+        last_resync = time.monotonic()
+        while not self._quit.is_set():
+            readable, _, _ = select.select([self._inotify_fd, self._wake_r], [], [], self.resync_interval)
+            if time.monotonic() - last_resync >= self.resync_interval:
+                self.refresh()
+                last_resync = time.monotonic()
+            if self._inotify_fd not in readable:
+                continue
+            try:
+                data = os.read(self._inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            changed: set[str] = set()
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _IN_EVENT_HEADER.unpack_from(data, offset)
+                offset += _IN_EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                if mask & (_IN_Q_OVERFLOW | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                    changed.update(self.names)
+                elif name in self.names:
+                    changed.add(name)
+            if changed & self.names == self.names:
+                self.refresh()
+            else:
+                for name in changed:
+                    self.refresh(name)
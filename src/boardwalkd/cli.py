@@ -173,6 +173,40 @@ def cli():
     show_default=True,
     show_envvar=True,
 )
+@click.option(
+    "--state-flush-interval",
+    help=(
+        "The most often, in seconds, that the journal store compacts its journal into a new snapshot of the"
+        " state. 0 writes a snapshot as soon as one is due"
+    ),
+    type=click.FloatRange(min=0),
+    default=1.0,
+    show_default=True,
+    show_envvar=True,
+)
+@click.option(
+    "--state-snapshot-records",
+    help=(
+        "The number of changes appended to the state journal before the journal is compacted into a new"
+        " snapshot of the state"
+    ),
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    show_envvar=True,
+)
+@click.option(
+    "--state-store",
+    help=(
+        "Where state is persisted. 'journal' keeps a JSON snapshot and a journal of changes in .boardwalkd/,"
+        " and holds only the most recent events of each workspace. 'sqlite' keeps state and the full event"
+        " history in .boardwalkd/state.sqlite3, importing the journal's statefile when the database is created"
+    ),
+    type=click.Choice(["journal", "sqlite"]),
+    default="journal",
+    show_default=True,
+    show_envvar=True,
+)
 @click.option(
     "--tls-crt",
     help=("Path to TLS certificate chain file for use along with --tls-port"),
@@ -279,6 +313,9 @@ def serve(
     slack_bot_token: str | None,
     slack_error_advice_config: str | None,
     slack_slash_command_prefix: str,
+    state_flush_interval: float,
+    state_snapshot_records: int,
+    state_store: str,
     theme_static_path: str | None,
     theme_css_url: str,
     theme_logo_url: str,
@@ -375,6 +412,9 @@ def serve(
             slack_error_webhook_url=slack_error_webhook_url,
             slack_webhook_url=slack_webhook_url,
             slack_slash_command_prefix=slack_slash_command_prefix,
+            state_flush_interval=state_flush_interval,
+            state_snapshot_records=state_snapshot_records,
+            state_store=state_store,
             theme_static_path=theme_static_path,
             theme_css_url=theme_css_url,
             theme_logo_url=theme_logo_url,
@@ -7,7 +7,7 @@ from urllib.parse import urlencode
 
 from boardwalkd.protocol import WorkspaceEvent
 from boardwalkd.slack_error_advice import SlackErrorAdviceRule, matching_error_advice
-from boardwalkd.state import WorkspaceState
+from boardwalkd.state import WorkspaceState, event_time
 
 ALL_GROUP = "All"
 UNGROUPED = "Ungrouped"
@@ -98,12 +98,6 @@ def group_for_workspace(workspace: WorkspaceState) -> str:
     return workspace.details.ui_group or UNGROUPED
 
 
-def _event_time(event: WorkspaceEvent) -> datetime:
-    if event.create_time is None:
-        return datetime.min.replace(tzinfo=UTC)
-    return event.create_time.replace(tzinfo=UTC)
-
-
 def _time_asc_key(value: datetime) -> tuple[int, int, int]:
     return (value.toordinal(), value.hour * 3600 + value.minute * 60 + value.second, value.microsecond)
 
@@ -114,15 +108,13 @@ def _time_desc_key(value: datetime) -> tuple[int, int, int]:
 
 
 def latest_event(workspace: WorkspaceState) -> str:
-    if not workspace.events:
-        return ""
-    event = max(workspace.events, key=_event_time)
-    return event.message
+    event = workspace.summary.latest
+    return event.message if event is not None else ""
 
 
 def latest_event_time(workspace: WorkspaceState) -> datetime:
-    if workspace.events:
-        return max(_event_time(event) for event in workspace.events)
+    if (event := workspace.summary.latest) is not None:
+        return event_time(event)
     if workspace.last_seen is not None:
         return _normalized_time(workspace.last_seen)
     return datetime.min.replace(tzinfo=UTC)
@@ -147,10 +139,7 @@ def worker_stale(workspace: WorkspaceState, now: datetime | None = None) -> bool
 
 
 def _latest_terminal_event(workspace: WorkspaceState) -> WorkspaceEvent | None:
-    terminal_events = [event for event in workspace.events if event.severity in {"error", "success"}]
-    if not terminal_events:
-        return None
-    return max(terminal_events, key=_event_time)
+    return workspace.summary.latest_terminal
 
 
 # Status drives the badge/filter value. Lane placement is handled separately in
@@ -219,7 +208,7 @@ def row_for_workspace(
         status=status,
         latest_event=latest_event(workspace),
         latest_event_time=latest_event_time(workspace),
-        events=sorted(workspace.events, key=_event_time, reverse=True),
+        events=list(workspace.summary.newest_first),
         advice=advice,
         caught=workspace.semaphores.caught,
         has_mutex=workspace.semaphores.has_mutex,
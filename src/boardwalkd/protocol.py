@@ -5,13 +5,17 @@ and contains functions to support clients using the server
 
 import asyncio
 import concurrent.futures
+import http.client
 import json
 import socket
+import ssl
 import threading
 import time
 import webbrowser
 from collections import deque
 from datetime import UTC, datetime
+from io import BytesIO
+from itertools import islice
 from pathlib import Path
 from urllib.parse import urlencode, urljoin, urlparse
 
@@ -20,13 +24,13 @@ from loguru import logger
 from pydantic import BaseModel, ValidationInfo, field_validator
 from pydantic_core import PydanticCustomError
 from tornado.httpclient import (
-    HTTPClient,
     HTTPClientError,
     HTTPError,
     HTTPRequest,
     HTTPResponse,
 )
-from tornado.simple_httpclient import HTTPTimeoutError
+from tornado.httputil import HTTPHeaders
+from tornado.simple_httpclient import HTTPStreamClosedError, HTTPTimeoutError
 from tornado.websocket import websocket_connect
 
 AUTH_LOGIN_CONTEXT_FIELDS = (
@@ -44,6 +48,10 @@ AUTH_LOGIN_CONTEXT_FIELDS = (
     "deployment_user_email",
 )
 
+# Response header carrying the version of a workspace's semaphores, which may be
+# sent back to wait for them to change
+SEMAPHORES_VERSION_HEADER = "Boardwalk-Semaphores-Version"
+
 
 class ProtocolBaseModel(BaseModel, extra="forbid"):
     """BaseModel for protocol usage"""
@@ -123,6 +131,13 @@ class WorkspaceEvent(ProtocolBaseModel):
         return v
 
 
+class WorkspaceEventBatchItem(ProtocolBaseModel):
+    """Model for one event in a batch sent to the bulk events endpoint"""
+
+    event: WorkspaceEvent
+    broadcast: bool = False
+
+
 class WorkspaceSemaphores(ProtocolBaseModel):
     """Model for server-side workspace semaphores"""
 
@@ -147,7 +162,32 @@ class Client:
         self.api_token_file = Path.cwd().joinpath(".boardwalk/api_token.txt")
         self.auth_login_context: dict[str, str] = {}
         self.event_queue = deque([])
+        # Workers may queue events from several threads when hosts run in parallel
+        self.event_queue_lock = threading.RLock()
+        # Signals the background event sender when events are queued, and
+        # signals anyone waiting on a flush when events are sent
+        self.event_queue_condition = threading.Condition(self.event_queue_lock)
+        self.event_batch_size = 100
+        # Older servers have no bulk events endpoint. None until the server has
+        # answered a bulk request
+        self.bulk_events_supported: bool | None = None
+        self._event_sender: threading.Thread | None = None
+        self._event_sender_quit = threading.Event()
+        # Cuts the sender's retry backoff short. Flushing or closing sets it,
+        # but queuing events doesn't, so a busy client can't hammer a server
+        # that's down
+        self._event_sender_retry = threading.Event()
         self.url = urlparse(url)
+        # The API token is cached in memory once read from disk
+        self._api_token: str | None = None
+        # Each thread keeps its own keep-alive connection to the server, since
+        # http.client connections can't be shared between threads
+        self._connections = threading.local()
+        self._all_connections: list[http.client.HTTPConnection] = []
+        self.request_timeout = 20.0
+        self.max_redirects = 5
+        self.request_stats_lock = threading.Lock()
+        self.request_stats = {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
 
     def set_auth_login_context(self, **context: str | None):
         """Stores context to include when an API auth login prompt is needed."""
@@ -159,8 +199,169 @@ class Client:
                 self.auth_login_context[key] = value
 
     def get_api_token(self) -> str:
-        """Retrieves the API token from disk"""
-        return self.api_token_file.read_text().rstrip()
+        """Retrieves the API token, reading it from disk the first time"""
+        if self._api_token is None:
+            self._api_token = self.api_token_file.read_text().rstrip()
+        return self._api_token
+
+    def invalidate_api_token(self):
+        """Forgets the cached API token so that it is read from disk again"""
+        self._api_token = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        """Returns this thread's connection to the server, creating it if needed"""
+        conn: http.client.HTTPConnection | None = getattr(self._connections, "conn", None)
+        if conn is None:
+            hostname = self.url.hostname
+            if hostname is None:
+                raise ValueError(f"{self.url.geturl()} has no host")
+            match self.url.scheme:
+                case "http":
+                    conn = http.client.HTTPConnection(hostname, self.url.port, timeout=self.request_timeout)
+                case "https":
+                    conn = http.client.HTTPSConnection(
+                        hostname,
+                        self.url.port,
+                        timeout=self.request_timeout,
+                        context=ssl.create_default_context(),
+                    )
+                case _:
+                    raise ValueError(f"{self.url.scheme} is not a valid url scheme")
+            self._connections.conn = conn
+            with self.request_stats_lock:
+                self._all_connections.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        """Closes this thread's connection so the next request opens a new one"""
+        conn: http.client.HTTPConnection | None = getattr(self._connections, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._connections.conn = None
+            with self.request_stats_lock:
+                if conn in self._all_connections:
+                    self._all_connections.remove(conn)
+
+    def fetch(self, request: HTTPRequest) -> HTTPResponse:
+        """
+        Performs a request over this thread's keep-alive connection, following
+        redirects. Failures are raised as the same exceptions tornado's HTTPClient
+        raises, so callers can handle either the same way. Redirects to another
+        scheme, host or port aren't followed, since the connection only goes to
+        the server and the request's credentials must not be sent elsewhere
+        """
+        start_time = time.monotonic()
+        error = True
+        try:
+            for _ in range(self.max_redirects + 1):
+                response = self._fetch_once(request)
+                location = response.headers.get("Location")
+                if response.code in (301, 302, 303, 307, 308) and location:
+                    url = urljoin(request.url, location)
+                    if not self._same_origin(url):
+                        raise HTTPClientError(
+                            response.code, message=f"Not following redirect to {url}", response=response
+                        )
+                    method = "GET" if response.code in (302, 303) else request.method
+                    request = HTTPRequest(
+                        url=url,
+                        method=method,
+                        headers=request.headers,
+                        body=request.body if method != "GET" else None,
+                    )
+                    continue
+                if response.code >= 400:
+                    raise HTTPClientError(response.code, message=response.reason, response=response)
+                error = False
+                return response
+            raise HTTPClientError(599, message="Too many redirects")
+        finally:
+            self._record_request_time(time.monotonic() - start_time, error)
+
+    def _same_origin(self, url: str) -> bool:
+        """Returns True if url has the same scheme, host and port as the server"""
+        parsed = urlparse(url)
+        default_ports = {"http": 80, "https": 443}
+        return (
+            parsed.scheme == self.url.scheme
+            and parsed.hostname == self.url.hostname
+            and (parsed.port or default_ports.get(parsed.scheme))
+            == (self.url.port or default_ports.get(self.url.scheme))
+        )
+
+    def _fetch_once(self, request: HTTPRequest) -> HTTPResponse:
+        """Sends a single request, retrying once on a fresh connection if the
+        server closed an idle keep-alive connection"""
+        url = urlparse(request.url)
+        path = url.path or "/"
+        if url.query:
+            path += f"?{url.query}"
+        body = request.body or None
+        headers = dict(request.headers)
+
+        while True:
+            conn = self._connection()
+            reused = conn.sock is not None
+            start_time = time.monotonic()
+            try:
+                conn.request(request.method, path, body=body, headers=headers)
+                raw_response = conn.getresponse()
+                response_body = raw_response.read()
+            except TimeoutError as e:
+                self._drop_connection()
+                raise HTTPTimeoutError("Timeout") from e
+            except (http.client.HTTPException, ConnectionResetError, BrokenPipeError) as e:
+                self._drop_connection()
+                if reused:
+                    # The server closed the idle connection; try once more on a new one
+                    continue
+                raise HTTPStreamClosedError(f"Stream closed: {e}") from e
+            except OSError:
+                self._drop_connection()
+                raise
+
+            if raw_response.will_close:
+                self._drop_connection()
+            response_headers = HTTPHeaders()
+            for name, value in raw_response.getheaders():
+                response_headers.add(name, value)
+            return HTTPResponse(
+                request=request,
+                code=raw_response.status,
+                headers=response_headers,
+                buffer=BytesIO(response_body),
+                effective_url=request.url,
+                reason=raw_response.reason,
+                request_time=time.monotonic() - start_time,
+            )
+
+    def _record_request_time(self, seconds: float, error: bool):
+        with self.request_stats_lock:
+            self.request_stats["count"] += 1
+            self.request_stats["errors"] += int(error)
+            self.request_stats["total_seconds"] += seconds
+            self.request_stats["max_seconds"] = max(self.request_stats["max_seconds"], seconds)
+
+    def log_request_stats(self):
+        """Logs request latency statistics for this client"""
+        with self.request_stats_lock:
+            stats = dict(self.request_stats)
+        if not stats["count"]:
+            return
+        logger.info(
+            f"{self.url.geturl()}: {stats['count']} requests ({stats['errors']} errors),"
+            f" {1000 * stats['total_seconds'] / stats['count']:.1f}ms average,"
+            f" {1000 * stats['max_seconds']:.1f}ms max latency"
+        )
+
+    def close(self):
+        """Logs request statistics and closes all connections to the server. A
+        closed connection reconnects if it is used again"""
+        self.log_request_stats()
+        with self.request_stats_lock:
+            connections = list(self._all_connections)
+        for conn in connections:
+            conn.close()
 
     async def api_login(self):
         """Performs an interactive login to the API and writes the session token
@@ -194,6 +395,7 @@ class Client:
             elif msg.token:
                 conn.close()
                 self.api_token_file.write_text(msg.token)
+                self._api_token = msg.token
                 print("---\nAuthentication successful")
                 return
 
@@ -227,12 +429,14 @@ class Client:
             },
             url=url,
         )
-        client = HTTPClient()
 
         try:
             logger.debug(f"Fetching request {request.method} {request.url}")
-            return client.fetch(request)
+            return self.fetch(request)
         except HTTPError as e:
+            if e.code == 403:
+                # The token may have been replaced on disk by another login
+                self.invalidate_api_token()
             if e.code == 403 and auto_login_prompt:
                 # If auth is denied, automatically try to login
                 asyncio.run(self.api_login())
@@ -427,6 +631,22 @@ class Client:
             else:  # Reraise
                 raise
 
+    def workspace_post_events(self, workspace_name: str, batch: list[WorkspaceEventBatchItem]):
+        """Sends an ordered batch of events to the server in a single request.
+        Servers without the bulk endpoint answer 404 or 405"""
+        try:
+            self.authenticated_request(
+                path=f"/api/workspace/{workspace_name}/events",
+                method="POST",
+                body=json.dumps([item.model_dump(mode="json") for item in batch]),
+                auto_login_prompt=False,
+            )
+        except HTTPError as e:
+            if e.code == 404:
+                raise WorkspaceNotFound
+            else:  # Reraise
+                raise
+
     def workspace_queue_event(
         self,
         workspace_name: str,
@@ -434,29 +654,139 @@ class Client:
         broadcast: bool = False,
     ):
         """
-        Appends an event to the event queue and attempts to flush messages to
-        the server
+        Appends an event to the event queue. Events are sent to the server, in
+        order, by a background thread so that the caller never waits on the network
         """
-        self.event_queue.append(
-            {
-                "workspace_name": workspace_name,
-                "workspace_event": workspace_event,
-                "broadcast": broadcast,
-            }
-        )
-
-        self.flush_event_queue()
+        with self.event_queue_condition:
+            self.event_queue.append(
+                {
+                    "workspace_name": workspace_name,
+                    "workspace_event": workspace_event,
+                    "broadcast": broadcast,
+                }
+            )
+            self.event_queue_condition.notify_all()
+        self.event_sender_connect()
 
     def flush_event_queue(self):
         """
-        Attempts to flush events to the server
+        Wakes the background event sender to attempt to flush events to the
+        server. Doesn't wait for the events to be sent
         """
-        try:
-            for event in self.event_queue.copy():
-                self.workspace_post_event(**event)
-                self.event_queue.popleft()
-        except (ConnectionRefusedError, HTTPError):
-            pass
+        self._event_sender_retry.set()
+        with self.event_queue_condition:
+            self.event_queue_condition.notify_all()
+
+    def post_event_batch(self, batch: list[dict]):
+        """
+        Sends a batch of queued events to the server, one request per run of
+        events for the same workspace, removing them from the front of the queue
+        once they have been sent. If the server has no bulk events endpoint,
+        events are sent one request each from then on
+        """
+        i = 0
+        while i < len(batch):
+            if self.bulk_events_supported is False:
+                item = batch[i]
+                self.workspace_post_event(item["workspace_name"], item["workspace_event"], item["broadcast"])
+                with self.event_queue_condition:
+                    self.event_queue.popleft()
+                i += 1
+                continue
+            workspace_name = batch[i]["workspace_name"]
+            run = [batch[i]]
+            while i + len(run) < len(batch) and batch[i + len(run)]["workspace_name"] == workspace_name:
+                run.append(batch[i + len(run)])
+            try:
+                self.workspace_post_events(
+                    workspace_name,
+                    [WorkspaceEventBatchItem(event=e["workspace_event"], broadcast=e["broadcast"]) for e in run],
+                )
+            except (WorkspaceNotFound, HTTPError) as e:
+                if self.bulk_events_supported or (isinstance(e, HTTPError) and e.code != 405):
+                    raise
+                # Probably an older server. A workspace that really is missing
+                # still raises WorkspaceNotFound from the single event endpoint
+                logger.debug("The server has no bulk events endpoint; sending events one at a time")
+                self.bulk_events_supported = False
+                continue
+            self.bulk_events_supported = True
+            with self.event_queue_condition:
+                for _ in run:
+                    self.event_queue.popleft()
+            i += len(run)
+
+    def event_sender(self):
+        """
+        Drains the event queue to the server in batches until told to quit.
+        Events stay queued until they are sent, and sending is retried with
+        backoff if the server can't be reached
+        """
+        retry_delay = 0
+        while True:
+            if retry_delay:
+                self._event_sender_retry.wait(timeout=retry_delay)
+            with self.event_queue_condition:
+                while not self.event_queue and not self._event_sender_quit.is_set():
+                    self.event_queue_condition.wait()
+                if self._event_sender_quit.is_set():
+                    logger.debug("Event sender thread closing")
+                    return
+                batch = list(islice(self.event_queue, self.event_batch_size))
+            self._event_sender_retry.clear()
+            try:
+                self.post_event_batch(batch)
+                retry_delay = 0
+            except (
+                ConnectionRefusedError,
+                HTTPClientError,
+                HTTPError,
+                HTTPTimeoutError,
+                OSError,
+                WorkspaceNotFound,
+            ) as e:
+                logger.debug(f"Event sender error {e.__class__.__qualname__}")
+                retry_delay = min(max(retry_delay * 2, 1), 30)
+            finally:
+                with self.event_queue_condition:
+                    self.event_queue_condition.notify_all()
+
+    def event_sender_connect(self):
+        """Starts the background event sender thread if it isn't running"""
+        with self.event_queue_lock:
+            if self._event_sender and self._event_sender.is_alive():
+                return
+            self._event_sender_quit.clear()
+            self._event_sender = threading.Thread(target=self.event_sender, name="boardwalkd_event_sender", daemon=True)
+            self._event_sender.start()
+
+    def drain_event_queue(self, timeout: float = 10) -> bool:
+        """
+        Waits up to `timeout` seconds for queued events to be sent. Returns True
+        if the queue was emptied
+        """
+        deadline = time.monotonic() + timeout
+        self._event_sender_retry.set()
+        with self.event_queue_condition:
+            self.event_queue_condition.notify_all()
+            while self.event_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"{len(self.event_queue)} events could not be sent to {self.url.geturl()}")
+                    return False
+                self.event_queue_condition.wait(timeout=remaining)
+        return True
+
+    def event_sender_close(self, timeout: float = 10):
+        """Flushes queued events, waiting up to `timeout` seconds, then stops the
+        background event sender"""
+        self.drain_event_queue(timeout)
+        with self.event_queue_condition:
+            self._event_sender_quit.set()
+            self._event_sender_retry.set()
+            self.event_queue_condition.notify_all()
+        if self._event_sender and self._event_sender is not threading.current_thread():
+            self._event_sender.join(timeout=1)
 
     def workspace_post_mutex(self, workspace_name: str):
         """Posts a mutex to the server"""
@@ -484,8 +814,26 @@ class Client:
             else:  # Reraise
                 raise
 
-        semaphores = WorkspaceSemaphores()
-        return semaphores.parse_raw(request.body)
+        return WorkspaceSemaphores.model_validate_json(request.body)
+
+    def workspace_wait_semaphores(
+        self, workspace_name: str, version: str | None, wait: float
+    ) -> tuple[WorkspaceSemaphores, str | None]:
+        """
+        Queries the server for workspace semaphores, waiting up to `wait` seconds
+        for them to change if they are still at `version`. Returns the semaphores
+        and their new version, which is None if the server doesn't support waiting
+        """
+        query = {"wait": wait} if version is None else {"version": version, "wait": wait}
+        try:
+            request = self.authenticated_request(path=f"/api/workspace/{workspace_name}/semaphores?{urlencode(query)}")
+        except HTTPError as e:
+            if e.code == 404:
+                raise WorkspaceNotFound
+            else:  # Reraise
+                raise
+
+        return WorkspaceSemaphores.model_validate_json(request.body), request.headers.get(SEMAPHORES_VERSION_HEADER)
 
 
 class WorkspaceClient(Client):
@@ -500,6 +848,9 @@ class WorkspaceClient(Client):
     def get_semaphores(self) -> WorkspaceSemaphores:
         return self.workspace_get_semaphores(self.workspace_name)
 
+    def wait_semaphores(self, version: str | None, wait: float) -> tuple[WorkspaceSemaphores, str | None]:
+        return self.workspace_wait_semaphores(self.workspace_name, version, wait)
+
     def has_mutex(self) -> bool:
         try:
             return self.get_semaphores().has_mutex
@@ -539,6 +890,9 @@ class WorkspaceClient(Client):
     def post_event(self, workspace_event: WorkspaceEvent, broadcast: bool = False):
         self.workspace_post_event(self.workspace_name, workspace_event, broadcast)
 
+    def post_events(self, batch: list[WorkspaceEventBatchItem]):
+        self.workspace_post_events(self.workspace_name, batch)
+
     def queue_event(self, workspace_event: WorkspaceEvent, broadcast: bool = False):
         self.workspace_queue_event(self.workspace_name, workspace_event, broadcast)
 
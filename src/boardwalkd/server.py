@@ -8,13 +8,13 @@ import asyncio
 import atexit
 import hashlib
 import json
+import math
 import os
 import re
 import secrets
 import ssl
 import string
-from collections import deque
-from collections.abc import Callable, Sequence
+from collections.abc import Sequence
 from dataclasses import dataclass
 from datetime import UTC, datetime
 from importlib.metadata import version as lib_version
@@ -28,7 +28,7 @@ import tornado.web
 import tornado.websocket
 from cryptography.fernet import Fernet
 from loguru import logger
-from pydantic import ValidationError
+from pydantic import TypeAdapter, ValidationError
 from tornado.escape import url_escape, url_unescape
 from tornado.log import access_log, app_log
 from tornado.routing import HostMatches
@@ -53,10 +53,28 @@ from boardwalkd.dashboard import (
     sort_url,
 )
 from boardwalkd.demo import seed_development_workspaces
-from boardwalkd.protocol import AUTH_LOGIN_CONTEXT_FIELDS, ApiLoginMessage, WorkspaceDetails, WorkspaceEvent
+from boardwalkd.protocol import (
+    AUTH_LOGIN_CONTEXT_FIELDS,
+    SEMAPHORES_VERSION_HEADER,
+    ApiLoginMessage,
+    WorkspaceDetails,
+    WorkspaceEvent,
+    WorkspaceEventBatchItem,
+    WorkspaceSemaphores,
+)
 from boardwalkd.slack_error_advice import SlackErrorAdviceRule, matching_error_advice
 from boardwalkd.snapshot import seed_snapshot_workspaces
-from boardwalkd.state import User, WorkspaceState, load_state, valid_user_roles
+from boardwalkd.sqlite_store import SQLiteStateStore
+from boardwalkd.state import (
+    JournalStateStore,
+    User,
+    WorkspaceState,
+    get_store,
+    load_state,
+    statefile_dir_path,
+    use_store,
+    valid_user_roles,
+)
 from boardwalkd.utils import is_workspace_active
 
 if TYPE_CHECKING:
@@ -68,6 +86,10 @@ SLACK_TOKENS: dict[str, str | None] = {"app": None, "bot": None}
 SLACK_SLASH_COMMAND_PREFIX: str = "brdwlk"
 SERVER_URL: str | None = None
 atexit.register(state.flush)
+# The longest a semaphores request may wait for a change before returning
+SEMAPHORES_MAX_WAIT = 15.0
+# Requests waiting on a workspace's semaphores to change wait on its event
+_semaphores_changed: dict[str, asyncio.Event] = {}
 
 
 @dataclass(frozen=True)
@@ -220,13 +242,39 @@ def ui_method_event_time(handler: UIBaseHandler, value: object) -> dict[str, str
     }
 
 
-def ui_method_sort_events_by_date(handler: UIBaseHandler, events: deque[WorkspaceEvent]) -> list[WorkspaceEvent]:
-    """Custom UI templating method. Accepts a deque of Workspace events and
-    sorts them by datetime in ascending order"""
-    # While we assume UTC--and the code did/does--this allows for backward compatibility
-    # with older `boardwalk` client versions
-    key: Callable[[WorkspaceEvent], datetime] = lambda x: x.create_time.replace(tzinfo=UTC)  # type: ignore
-    return sorted(events, key=key, reverse=True)
+# The most events returned in a single page of a workspace's event history
+max_events_page_size = 500
+
+
+@dataclass(frozen=True)
+class EventsPage:
+    """Query arguments selecting a page of a workspace's event history"""
+
+    before: int | None
+    after: int | None
+    limit: int
+    severity: str | None
+
+
+def events_page_arguments(handler: tornado.web.RequestHandler, default_limit: int = 50) -> EventsPage:
+    """Reads the before, after, limit and severity query arguments. Raises
+    ValueError if any is invalid"""
+    before = handler.get_query_argument("before", default="")
+    after = handler.get_query_argument("after", default="")
+    limit = int(handler.get_query_argument("limit", default=str(default_limit)))
+    if not 1 <= limit <= max_events_page_size:
+        raise ValueError(f"limit must be between 1 and {max_events_page_size}")
+    severity = handler.get_query_argument("severity", default="") or None
+    if severity is not None and severity not in ("info", "success", "error"):
+        raise ValueError(f"Invalid severity {severity}")
+    return EventsPage(int(before) if before else None, int(after) if after else None, limit, severity)
+
+
+def workspace_events_page(workspace: str, page: EventsPage) -> list[tuple[int, WorkspaceEvent]]:
+    """Returns a page of a workspace's events with their ids, newest first"""
+    return get_store().events(
+        state, workspace, before=page.before, after=page.after, limit=page.limit, severity=page.severity
+    )
 
 
 def dashboard_request_context(handler: UIBaseHandler) -> tuple[DashboardFilters, bool]:
@@ -335,7 +383,7 @@ class UserEnableHandler(AdminUIBaseHandler):
         """Enables a given user"""
         try:
             state.users[user].enabled = True
-            state.flush()
+            state.record_user(user)
             return self.render(
                 "admin_user_enable.html",
                 user=state.users[user],
@@ -354,7 +402,7 @@ class UserEnableHandler(AdminUIBaseHandler):
 
         try:
             state.users[user].enabled = False
-            state.flush()
+            state.record_user(user)
             return self.render(
                 "admin_user_enable.html",
                 user=state.users[user],
@@ -390,7 +438,7 @@ class UserRoleHandler(AdminUIBaseHandler):
 
         try:
             state.users[user].roles.add(role)
-            state.flush()
+            state.record_user(user)
             return self.render(
                 "admin_user_roles.html",
                 user=state.users[user],
@@ -427,7 +475,7 @@ class UserRoleHandler(AdminUIBaseHandler):
 
         try:
             state.users[user].roles.remove(role)
-            state.flush()
+            state.record_user(user)
             return self.render(
                 "admin_user_roles.html",
                 user=state.users[user],
@@ -448,7 +496,7 @@ class AnonymousLoginHandler(UIBaseHandler):
         anon_username = "anonymous@example.com"
         if anon_username not in state.users:
             state.users[anon_username] = User(email=anon_username)  # type: ignore
-            state.flush()
+            state.record_user(anon_username)
 
         self.set_secure_cookie(
             "boardwalk_user",
@@ -494,7 +542,7 @@ class GoogleOAuth2LoginHandler(UIBaseHandler, tornado.auth.GoogleOAuth2Mixin):
                 except ValidationError as e:
                     app_log.error(e)
                     return self.send_error(422)
-                state.flush()
+                state.record_user(username)
 
             self.set_secure_cookie(
                 "boardwalk_user",
@@ -569,6 +617,8 @@ class WorkspaceCatchHandler(UIBaseHandler):
             state.workspaces[workspace].semaphores.caught = True
         except KeyError:
             return self.send_error(404)
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
 
         # Record who clicked the catch button
         cur_user = self.current_user.decode()
@@ -584,6 +634,8 @@ class WorkspaceCatchHandler(UIBaseHandler):
             state.workspaces[workspace].semaphores.caught = False
         except KeyError:
             return self.send_error(404)
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
 
         # Record who clicked the release button
         cur_user = self.current_user.decode()
@@ -609,6 +661,8 @@ class WorkspaceRemoteStateClearHandler(UIBaseHandler):
             return self.send_error(412)
 
         workspace_state.semaphores.clear_remote_state_requested = True
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
         cur_user = self.current_user.decode()
         event = WorkspaceEvent(
             severity="info",
@@ -639,6 +693,8 @@ class WorkspaceRemoteMutexClearHandler(UIBaseHandler):
             return self.send_error(412)
 
         workspace_state.semaphores.clear_remote_mutex_requested = True
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
         cur_user = self.current_user.decode()
         event = WorkspaceEvent(
             severity="info",
@@ -666,15 +722,40 @@ class WorkspaceEventsHandler(UIBaseHandler):
 
 
 class WorkspaceEventsTableHandler(UIBaseHandler):
-    """Handles serving workspace events tables in the UI"""
+    """
+    Handles serving rows of workspace events tables in the UI. Without a
+    cursor the newest events are served, after a row that polls for newer
+    events. The last row of a full page loads the next page once it's scrolled
+    into view. The last page ends with a note if older events were dropped
+    """
 
     @tornado.web.authenticated
     def get(self, workspace: str):
-        try:
-            workspace = state.workspaces[workspace]  # type: ignore
-        except KeyError:
+        if workspace not in state.workspaces:
             return self.send_error(404)
-        return self.render("workspace_events_table.html", workspace=workspace)
+        try:
+            page = events_page_arguments(self)
+        except ValueError:
+            return self.send_error(400)
+        events = workspace_events_page(workspace, page)
+        if page.before is None:
+            # Poll for events newer than the newest one shown
+            poll_after = events[0][0] if events else page.after or 0
+        else:
+            poll_after = None
+        next_before = events[-1][0] if page.after is None and len(events) == page.limit else None
+        history_truncated = (
+            page.after is None and next_before is None and get_store().history_truncated(state, workspace)
+        )
+        return self.render(
+            "workspace_events_table.html",
+            workspace_name=workspace,
+            events=events,
+            poll_after=poll_after,
+            next_before=next_before,
+            history_truncated=history_truncated,
+            severity=page.severity or "",
+        )
 
 
 class WorkspaceMutexHandler(UIBaseHandler):
@@ -690,7 +771,8 @@ class WorkspaceMutexHandler(UIBaseHandler):
             if is_workspace_active(workspace):
                 return self.send_error(412)
             workspace_state.semaphores.has_mutex = False
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
             return render_workspaces_fragment(self, filters, edit)
         except KeyError:
             return self.send_error(404)
@@ -954,6 +1036,14 @@ class WorkspacesStatusApiHandler(APIBaseHandler):
         self.write(payload)
 
 
+class StateMetricsApiHandler(APIBaseHandler):
+    """Returns statistics about how the state is written to disk"""
+
+    @tornado.web.authenticated
+    def get(self):
+        self.write(get_store().metrics())
+
+
 class WorkspaceCatchApiHandler(APIBaseHandler):
     """Handles setting a catch on a workspace"""
 
@@ -961,7 +1051,8 @@ class WorkspaceCatchApiHandler(APIBaseHandler):
     def post(self, workspace: str):
         try:
             state.workspaces[workspace].semaphores.caught = True
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
         except KeyError:
             return self.send_error(404)
 
@@ -982,7 +1073,8 @@ class WorkspaceRemoteStateClearApiHandler(APIBaseHandler):
             return self.send_error(412)
 
         workspace_state.semaphores.clear_remote_state_requested = True
-        state.flush()
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
         self.set_status(204)
         return self.finish()
 
@@ -990,7 +1082,8 @@ class WorkspaceRemoteStateClearApiHandler(APIBaseHandler):
     def delete(self, workspace: str):
         try:
             state.workspaces[workspace].semaphores.clear_remote_state_requested = False
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
             self.set_status(204)
             return self.finish()
         except KeyError:
@@ -1013,7 +1106,8 @@ class WorkspaceRemoteMutexClearApiHandler(APIBaseHandler):
             return self.send_error(412)
 
         workspace_state.semaphores.clear_remote_mutex_requested = True
-        state.flush()
+        state.record_workspace(workspace)
+        notify_semaphores_changed(workspace)
         self.set_status(204)
         return self.finish()
 
@@ -1021,7 +1115,8 @@ class WorkspaceRemoteMutexClearApiHandler(APIBaseHandler):
     def delete(self, workspace: str):
         try:
             state.workspaces[workspace].semaphores.clear_remote_mutex_requested = False
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
             self.set_status(204)
             return self.finish()
         except KeyError:
@@ -1106,7 +1201,7 @@ class WorkspaceDetailsApiHandler(APIBaseHandler):
             state.workspaces[workspace] = WorkspaceState()
             state.workspaces[workspace].details = new_details
         state.workspaces[workspace].last_seen = datetime.now(UTC)
-        state.flush()
+        state.record_workspace(workspace)
 
         if log_client_details_event:
             event = WorkspaceEvent(severity="info", message=workspace_client_details_event_message(new_details))
@@ -1155,31 +1250,104 @@ class WorkspaceEventApiHandler(APIBaseHandler):
         event.received_time = datetime.now(UTC)
 
         try:
-            state.workspaces[workspace].events.append(event)
+            state.append_event(workspace, event)
         except KeyError:
             return self.send_error(404)
 
         app_log.info(f"worker_event: {self.request.remote_ip} {workspace} {event.severity} {event.message}")
 
-        if broadcast and (self.settings["slack_webhook_url"] or self.settings["slack_error_webhook_url"]):
-            workspace_details = state.workspaces[workspace].details
-            slack_user_mention = None
-            if event.severity == "error":
-                if workspace_details.deployment_user_email:
-                    slack_user_mention = state.users[workspace_details.deployment_user_email].slack_cache.user_mention
-                else:
-                    slack_user_mention = None
-            await handle_slack_broadcast(
-                event,
-                workspace,
-                self.settings["slack_webhook_url"],
-                self.settings["slack_error_webhook_url"],
-                self.settings["url"].geturl(),
-                error_advice=matching_error_advice(event, self.settings["slack_error_advice_rules"]),
-                slack_user_mention=slack_user_mention,
+        if broadcast:
+            await broadcast_worker_event(self.settings, workspace, event)
+
+
+class WorkspaceEventsApiHandler(APIBaseHandler):
+    """
+    Handles ordered batches of events sent from clients to the server. The
+    whole batch is validated before any event is appended, and each event is
+    journaled as it's appended. Each event may request a broadcast, the same as
+    with WorkspaceEventApiHandler. Also serves pages of a workspace's event
+    history
+    """
+
+    max_batch_size: ClassVar[int] = 1000
+    batch_adapter: ClassVar[TypeAdapter[list[WorkspaceEventBatchItem]]] = TypeAdapter(list[WorkspaceEventBatchItem])
+    raw_batch_adapter: ClassVar[TypeAdapter[list[Any]]] = TypeAdapter(list[Any])
+
+    @tornado.web.authenticated
+    def get(self, workspace: str):
+        """
+        Returns a page of the workspace's event history, newest first. Events
+        older than the id `before` are returned, or those newer than the id
+        `after`. The page may be limited to events of one severity. The
+        response's `before` is the cursor for the next page, if there may be one.
+        `history_truncated` is true when older events were dropped by the
+        state store, so they can't be paged to
+        """
+        if workspace not in state.workspaces:
+            return self.send_error(404)
+        try:
+            page = events_page_arguments(self)
+        except ValueError:
+            return self.send_error(400)
+        events = workspace_events_page(workspace, page)
+        self.write(
+            {
+                "events": [{"id": event_id} | event.model_dump(mode="json") for event_id, event in events],
+                "before": events[-1][0] if page.after is None and len(events) == page.limit else None,
+                "history_truncated": get_store().history_truncated(state, workspace),
+            }
+        )
+
+    @tornado.web.authenticated
+    async def post(self, workspace: str):
+        try:
+            # The batch's size is checked before its events are validated
+            raw_batch = self.raw_batch_adapter.validate_json(self.request.body)
+            if len(raw_batch) > self.max_batch_size:
+                return self.send_error(413)
+            batch = self.batch_adapter.validate_python(raw_batch)
+        except ValidationError as e:
+            if any(error["type"] == "json_invalid" for error in e.errors()):
+                return self.send_error(415)
+            app_log.error(e)
+            return self.send_error(422)
+
+        if workspace not in state.workspaces:
+            return self.send_error(404)
+
+        received_time = datetime.now(UTC)
+        for item in batch:
+            item.event.received_time = received_time
+            state.append_event(workspace, item.event)
+            app_log.info(
+                f"worker_event: {self.request.remote_ip} {workspace} {item.event.severity} {item.event.message}"
             )
 
-        state.flush()
+        for item in batch:
+            if item.broadcast:
+                await broadcast_worker_event(self.settings, workspace, item.event)
+
+
+async def broadcast_worker_event(settings: dict[str, Any], workspace: str, event: WorkspaceEvent):
+    """Posts a worker event to slack, if a slack webhook is configured"""
+    if not (settings["slack_webhook_url"] or settings["slack_error_webhook_url"]):
+        return
+    workspace_details = state.workspaces[workspace].details
+    slack_user_mention = None
+    if event.severity == "error":
+        if workspace_details.deployment_user_email:
+            slack_user_mention = state.users[workspace_details.deployment_user_email].slack_cache.user_mention
+        else:
+            slack_user_mention = None
+    await handle_slack_broadcast(
+        event,
+        workspace,
+        settings["slack_webhook_url"],
+        settings["slack_error_webhook_url"],
+        settings["url"].geturl(),
+        error_advice=matching_error_advice(event, settings["slack_error_advice_rules"]),
+        slack_user_mention=slack_user_mention,
+    )
 
 
 class WorkspaceMutexApiHandler(APIBaseHandler):
@@ -1191,7 +1359,8 @@ class WorkspaceMutexApiHandler(APIBaseHandler):
             if state.workspaces[workspace].semaphores.has_mutex:
                 return self.send_error(409)
             state.workspaces[workspace].semaphores.has_mutex = True
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
         except KeyError:
             return self.send_error(404)
 
@@ -1199,22 +1368,59 @@ class WorkspaceMutexApiHandler(APIBaseHandler):
     def delete(self, workspace: str):
         try:
             state.workspaces[workspace].semaphores.has_mutex = False
-            state.flush()
+            state.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
             return
         except KeyError:
             return self.send_error(404)
 
 
 class WorkspaceSemaphoresApiHandler(APIBaseHandler):
-    """Handles getting server-side WorkspaceSemaphores"""
+    """
+    Handles getting server-side WorkspaceSemaphores
+
+    When the request includes a `version` matching the current semaphores, the
+    response is held for up to `wait` seconds until they change, so caught
+    workers learn of a release as soon as it happens without polling
+    """
 
     @tornado.web.authenticated
-    def get(self, workspace: str):
+    async def get(self, workspace: str):
         try:
-            return self.write(state.workspaces[workspace].semaphores.model_dump())
+            semaphores = state.workspaces[workspace].semaphores
         except KeyError:
             return self.send_error(404)
 
+        version = self.get_argument("version", None)
+        try:
+            wait = float(self.get_argument("wait", "0"))
+        except ValueError:
+            return self.send_error(400)
+        # nan and inf would never reach the deadline
+        if not math.isfinite(wait):
+            return self.send_error(400)
+        wait = min(max(wait, 0), SEMAPHORES_MAX_WAIT)
+
+        deadline = asyncio.get_running_loop().time() + wait
+        while version is not None and version == semaphores_version(semaphores):
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            changed = _semaphores_changed.setdefault(workspace, asyncio.Event())
+            # Wake at least once a second in case the semaphores were changed
+            # somewhere that didn't notify
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(remaining, 1))
+            except TimeoutError:
+                pass
+            try:
+                semaphores = state.workspaces[workspace].semaphores
+            except KeyError:
+                return self.send_error(404)
+
+        self.set_header(SEMAPHORES_VERSION_HEADER, semaphores_version(semaphores))
+        return self.write(semaphores.model_dump())
+
 
 """
 Server functions
@@ -1248,15 +1454,25 @@ def log_request(handler: tornado.web.RequestHandler):
     )
 
 
+def semaphores_version(semaphores: WorkspaceSemaphores) -> str:
+    """Returns a digest of the semaphores, which changes whenever they do"""
+    return hashlib.sha256(semaphores.model_dump_json().encode()).hexdigest()[:16]
+
+
+def notify_semaphores_changed(workspace: str):
+    """Wakes any requests waiting for a workspace's semaphores to change"""
+    if changed := _semaphores_changed.pop(workspace, None):
+        changed.set()
+
+
 def internal_workspace_event(workspace: str, event: WorkspaceEvent):
     """
     Appends an internally-generated workspace event to the state and logs to the
     application log
     """
     event.received_time = datetime.now(UTC)
-    state.workspaces[workspace].events.append(event)
+    state.append_event(workspace, event)
     app_log.info(f"internal_workspace_event: {workspace} {event.severity} {event.message}")
-    state.flush()
 
 
 def make_app(
@@ -1307,7 +1523,6 @@ def make_app(
             "secondsdelta": ui_method_secondsdelta,
             "server_version": ui_method_server_version,
             "sha256": ui_method_sha256,
-            "sort_events_by_date": ui_method_sort_events_by_date,
         },
         "url": urlparse(url),
         "websocket_ping_interval": 10,
@@ -1393,6 +1608,10 @@ def make_app(
                 r"/api/auth/login/socket",
                 AuthLoginApiWebsocketHandler,
             ),
+            (
+                r"/api/metrics/state",
+                StateMetricsApiHandler,
+            ),
             (
                 r"/api/workspaces/status",
                 WorkspacesStatusApiHandler,
@@ -1409,6 +1628,10 @@ def make_app(
                 r"/api/workspace/(\w+)/event",
                 WorkspaceEventApiHandler,
             ),
+            (
+                r"/api/workspace/(\w+)/events",
+                WorkspaceEventsApiHandler,
+            ),
             (
                 r"/api/workspace/(\w+)/semaphores",
                 WorkspaceSemaphoresApiHandler,
@@ -1470,10 +1693,19 @@ async def run(
     theme_logo_alt: str = "",
     theme_brand_name: str = "Boardwalk",
     jenkins_job_url: str = "",
+    state_flush_interval: float = 1.0,
+    state_snapshot_records: int = 1000,
+    state_store: str = "journal",
 ) -> tuple[tornado.web.Application, list[HTTPServer]]:
     """Starts the tornado server and IO loop"""
     global SLACK_SLASH_COMMAND_PREFIX
 
+    if state_store == "sqlite":
+        use_store(state, SQLiteStateStore(statefile_dir_path.joinpath("state.sqlite3")))
+    elif isinstance(store := get_store(), JournalStateStore):
+        store.interval = state_flush_interval
+        store.snapshot_records = state_snapshot_records
+
     app = make_app(
         auth_expire_days=auth_expire_days,
         auth_login_slack_notify=auth_login_slack_notify,
@@ -39,7 +39,13 @@ from slack_sdk.models.views import View
 from slack_sdk.web.async_client import AsyncWebClient
 
 from boardwalkd.protocol import WorkspaceEvent
-from boardwalkd.server import SERVER_URL, SLACK_SLASH_COMMAND_PREFIX, SLACK_TOKENS, internal_workspace_event
+from boardwalkd.server import (
+    SERVER_URL,
+    SLACK_SLASH_COMMAND_PREFIX,
+    SLACK_TOKENS,
+    internal_workspace_event,
+    notify_semaphores_changed,
+)
 from boardwalkd.server import state as STATE
 from boardwalkd.utils import count_of_workspaces_caught, list_active_workspaces, list_inactive_workspaces
 
@@ -72,15 +78,12 @@ async def update_cached_slack_data(limit: int = 200, cursor: str | None = None)
             logger.info("Processing cached Slack data updates...")
             resp = await app.client.users_list(cursor=cursor, limit=limit)
             next_cursor = resp.get("response_metadata", {}).get("next_cursor")
-            should_flush_state = False
             for member in resp.get("members", {}):
                 if (email := member.get("profile", {}).get("email")) and email in STATE.users:
                     logger.debug(f"Updating cached Slack data for {email}")
                     STATE.users[email].slack_cache.user_id = member.get("id")
                     STATE.users[email].slack_cache.real_name = member.get("profile", {}).get("real_name", "Unknown")
-                    should_flush_state = True
-            if should_flush_state:
-                STATE.flush()
+                    STATE.record_user(email)
             if next_cursor:
                 logger.trace("Waiting to retrieve next data page...")
                 await asyncio.sleep(10)
@@ -259,6 +262,8 @@ async def modal_catch_release_view_submission_event(
     for workspace in workspaces:
         if workspace not in rejected_workspaces:
             STATE.workspaces[workspace].semaphores.caught = bool(action == "catch")
+            STATE.record_workspace(workspace)
+            notify_semaphores_changed(workspace)
             # Record who caught the workspace(s)
             event = WorkspaceEvent(
                 severity="info",
@@ -270,7 +275,6 @@ async def modal_catch_release_view_submission_event(
             logger.warning(
                 f"Not processing {action} for workspace named {workspace} from {context['boardwalk_user_email']} as workspace does not exist"
             )
-    STATE.flush()
 
     if len(_actioned_workspaces) > 0:
         message_blocks = [
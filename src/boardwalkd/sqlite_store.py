@@ -0,0 +1,240 @@
+"""
+A SQLite backed store for the server's state. Workspaces, users and every
+event ever received are kept in a database in WAL mode, so the event history
+isn't limited to the events held in memory
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import ValidationError
+
+from boardwalkd import state as state_module
+from boardwalkd.protocol import WorkspaceDetails, WorkspaceEvent, WorkspaceSemaphores
+from boardwalkd.state import JournalStateStore, State, StateStore, User, WorkspaceState
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workspaces (
+    name TEXT PRIMARY KEY,
+    details TEXT NOT NULL,
+    last_seen TEXT,
+    semaphores TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    workspace TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    received_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_workspace ON events (workspace, id);
+CREATE INDEX IF NOT EXISTS events_workspace_severity ON events (workspace, severity, id);
+"""
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Persists the state to a SQLite database. Each mutation is written as it's
+    recorded, as a single row. When the database is created, the statefile of
+    the journal store is imported into it if there is one
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.writes = 0
+        self.write_errors = 0
+        self.last_write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.total_write_seconds = 0.0
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Transactions are explicit; statements outside of one commit right away
+            self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL, a commit survives the server crashing; only a power loss
+            # may roll back the last commits
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def load(self) -> State:
+        """Reads workspaces, users and the most recent events of each workspace"""
+        if self._is_empty() and state_module.statefile_path.exists():
+            self.import_statefile()
+        state = State()
+        max_events = WorkspaceState().events.maxlen
+        with self._lock:
+            for name, details, last_seen, semaphores in self.connection.execute(
+                "SELECT name, details, last_seen, semaphores FROM workspaces ORDER BY name"
+            ):
+                workspace = WorkspaceState(
+                    details=WorkspaceDetails.model_validate_json(details),
+                    last_seen=last_seen,
+                    semaphores=WorkspaceSemaphores.model_validate_json(semaphores),
+                )
+                rows = self.connection.execute(
+                    "SELECT data FROM events WHERE workspace = ? ORDER BY id DESC LIMIT ?", (name, max_events)
+                ).fetchall()
+                for (data,) in reversed(rows):
+                    workspace.append_event(WorkspaceEvent.model_validate_json(data))
+                state.workspaces[name] = workspace
+            for email, data in self.connection.execute("SELECT email, data FROM users"):
+                state.users[email] = User.model_validate_json(data)
+        return state
+
+    def import_statefile(self):
+        """Imports the journal store's statefile, and its journal, into the database"""
+        try:
+            state = JournalStateStore().read()
+        except ValidationError as e:
+            logger.warning(f"Not importing {state_module.statefile_path}, which can't be read: {e}")
+            return
+        logger.info(f"Importing {state_module.statefile_path} into {self.path}")
+        self._write(lambda: self._write_state(state, events=True))
+
+    def record(self, state: State, entry: dict[str, Any]):
+        match entry["op"]:
+            case "event":
+                self._write(lambda: self._insert_event(entry["workspace"], entry["event"]))
+            case "workspace":
+                self._write(lambda: self._upsert_workspace(entry["workspace"], entry["value"]))
+            case "user":
+                self._write(lambda: self._upsert_user(entry["email"], entry["value"]))
+            case op:
+                raise ValueError(f"Unknown state operation {op}")
+
+    def flush(self, state: State):
+        """Writes every workspace and user, and deletes those no longer in the
+        state along with their events"""
+        self._write(lambda: self._write_state(state, events=False))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "store": "sqlite",
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "last_write_seconds": self.last_write_seconds,
+            "max_write_seconds": self.max_write_seconds,
+            "mean_write_seconds": self.total_write_seconds / self.writes if self.writes else 0.0,
+        }
+
+    def events(
+        self,
+        state: State,
+        workspace: str,
+        before: int | None = None,
+        after: int | None = None,
+        limit: int = 50,
+        severity: str | None = None,
+    ) -> list[tuple[int, WorkspaceEvent]]:
+        """Returns a page of a workspace's full event history. See StateStore.events"""
+        conditions = ["workspace = ?"]
+        parameters: list[str | int] = [workspace]
+        if severity is not None:
+            conditions.append("severity = ?")
+            parameters.append(severity)
+        if before is not None:
+            conditions.append("id < ?")
+            parameters.append(before)
+        if after is not None:
+            conditions.append("id > ?")
+            parameters.append(after)
+        order = "DESC" if after is None else "ASC"
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT id, data FROM events WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+        events = [(event_id, WorkspaceEvent.model_validate_json(data)) for event_id, data in rows]
+        return events if after is None else events[::-1]
+
+    def history_truncated(self, state: State, workspace: str) -> bool:
+        return False
+
+    def _is_empty(self) -> bool:
+        with self._lock:
+            for table in ("workspaces", "users", "events"):
+                if self.connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is not None:
+                    return False
+        return True
+
+    def _write(self, write):
+        """Runs write in a transaction, keeping statistics"""
+        started = time.monotonic()
+        with self._lock:
+            try:
+                self.connection.execute("BEGIN")
+                write()
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.write_errors += 1
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+                raise
+        seconds = time.monotonic() - started
+        self.writes += 1
+        self.last_write_seconds = seconds
+        self.max_write_seconds = max(self.max_write_seconds, seconds)
+        self.total_write_seconds += seconds
+
+    def _write_state(self, state: State, events: bool):
+        for name, workspace in state.workspaces.items():
+            self._upsert_workspace(name, workspace.model_dump(mode="json", exclude={"events"}))
+            if events:
+                for event in workspace.events:
+                    self._insert_event(name, event.model_dump(mode="json"))
+        for email, user in state.users.items():
+            self._upsert_user(email, user.model_dump(mode="json"))
+        deleted_workspaces = self._delete_missing("workspaces", "name", state.workspaces)
+        self.connection.executemany("DELETE FROM events WHERE workspace = ?", deleted_workspaces)
+        self._delete_missing("users", "email", state.users)
+
+    def _delete_missing(self, table: str, column: str, keep: dict[str, Any]) -> list[tuple[str]]:
+        """Deletes rows whose key isn't in keep, returning the deleted keys"""
+        existing = {key for (key,) in self.connection.execute(f"SELECT {column} FROM {table}")}
+        deleted = [(key,) for key in existing - keep.keys()]
+        self.connection.executemany(f"DELETE FROM {table} WHERE {column} = ?", deleted)
+        return deleted
+
+    def _insert_event(self, workspace: str, event: dict[str, Any]):
+        self.connection.execute(
+            "INSERT INTO events (workspace, severity, received_time, data) VALUES (?, ?, ?, ?)",
+            (workspace, event["severity"], event.get("received_time"), json.dumps(event)),
+        )
+
+    def _upsert_workspace(self, name: str, value: dict[str, Any]):
+        self.connection.execute(
+            """
+            INSERT INTO workspaces (name, details, last_seen, semaphores) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                details = excluded.details, last_seen = excluded.last_seen, semaphores = excluded.semaphores
+            """,
+            (name, json.dumps(value["details"]), value["last_seen"], json.dumps(value["semaphores"])),
+        )
+
+    def _upsert_user(self, email: str, value: dict[str, Any]):
+        self.connection.execute(
+            "INSERT INTO users (email, data) VALUES (?, ?) ON CONFLICT (email) DO UPDATE SET data = excluded.data",
+            (email, json.dumps(value)),
+        )
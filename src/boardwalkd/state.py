@@ -3,18 +3,27 @@ This file defines models and helpers to support data that's persisted to a local
 state and survives service restarts
 """
 
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
 from collections import deque
 from datetime import UTC, datetime
 from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, TextIO
 
 import click
 from loguru import logger
-from pydantic import BaseModel, EmailStr, Field, ValidationError, computed_field, field_validator
+from pydantic import BaseModel, EmailStr, Field, PrivateAttr, ValidationError, computed_field, field_validator
 
 from boardwalkd.protocol import WorkspaceDetails, WorkspaceEvent, WorkspaceSemaphores
 
 statefile_dir_path = Path.cwd().joinpath(".boardwalkd")
 statefile_path = statefile_dir_path.joinpath("statefile.json")
+journal_prefix = "statefile.journal."
 
 valid_user_roles = {"default", "admin"}
 
@@ -55,6 +64,77 @@ class User(StateBaseModel):
         return input_roles
 
 
+def event_time(event: WorkspaceEvent) -> datetime:
+    """Returns when an event was created, as an aware datetime"""
+    if event.create_time is None:
+        return datetime.min.replace(tzinfo=UTC)
+    return event.create_time.replace(tzinfo=UTC)
+
+
+class WorkspaceEventSummary:
+    """
+    What the dashboard needs from a workspace's events: the latest event, the
+    latest terminal (error or success) event, and the events sorted newest
+    first. It's kept up to date as events are appended, which is O(1) unless
+    events arrive out of order, instead of being recomputed from every event
+    """
+
+    terminal_severities = frozenset({"error", "success"})
+
+    def __init__(self, events: deque[WorkspaceEvent]):
+        self.latest: WorkspaceEvent | None = None
+        self.latest_terminal: WorkspaceEvent | None = None
+        # Sorted newest first. Events created at the same time stay in the
+        # order they were appended
+        self.newest_first: list[WorkspaceEvent] = []
+        for event in events:
+            self._add(event)
+        self._remember(events)
+
+    def is_current(self, events: deque[WorkspaceEvent]) -> bool:
+        """Whether the summary is of these events, which may have been changed
+        without going through WorkspaceState.append_event"""
+        return events is self._events and len(events) == self._length and (not events or events[-1] is self._last)
+
+    def append(self, events: deque[WorkspaceEvent], event: WorkspaceEvent, dropped: WorkspaceEvent | None):
+        """Updates the summary after event was appended to events, which
+        dropped its oldest event if it was full"""
+        if dropped is not None:
+            for i in range(len(self.newest_first) - 1, -1, -1):
+                if self.newest_first[i] is dropped:
+                    del self.newest_first[i]
+                    break
+            if dropped is self.latest or dropped is self.latest_terminal:
+                self.latest = self.latest_terminal = None
+                for remaining in self.newest_first:
+                    self._update_latest(remaining)
+        self._add(event)
+        self._remember(events)
+
+    def _add(self, event: WorkspaceEvent):
+        created = event_time(event)
+        i = 0
+        while i < len(self.newest_first) and event_time(self.newest_first[i]) >= created:
+            i += 1
+        self.newest_first.insert(i, event)
+        self._update_latest(event)
+
+    def _update_latest(self, event: WorkspaceEvent):
+        # As with max(), the first of several events created at the same time wins
+        created = event_time(event)
+        if self.latest is None or created > event_time(self.latest):
+            self.latest = event
+        if event.severity in self.terminal_severities and (
+            self.latest_terminal is None or created > event_time(self.latest_terminal)
+        ):
+            self.latest_terminal = event
+
+    def _remember(self, events: deque[WorkspaceEvent]):
+        self._events = events
+        self._length = len(events)
+        self._last = events[-1] if events else None
+
+
 class WorkspaceState(StateBaseModel):
     """Model for persistent server workspace data"""
 
@@ -62,7 +142,9 @@ class WorkspaceState(StateBaseModel):
     last_seen: datetime | None = datetime.fromtimestamp(0, tz=UTC)  # When the worker last updated anything
     _max_workspace_events: int = 64
     events: deque[WorkspaceEvent] = deque([], maxlen=_max_workspace_events)
+    events_appended: int = 0  # Every event ever appended, so events keep the same id as older ones are dropped
     semaphores: WorkspaceSemaphores = WorkspaceSemaphores()
+    _summary: WorkspaceEventSummary | None = PrivateAttr(default=None)
 
     @field_validator("events")
     @classmethod
@@ -76,12 +158,33 @@ class WorkspaceState(StateBaseModel):
         _max_events = cls._max_workspace_events.default  # type: ignore
         return deque(input_events, maxlen=_max_events)
 
+    @property
+    def summary(self) -> WorkspaceEventSummary:
+        """A summary of the events, rebuilt only if events were changed other
+        than by append_event"""
+        if self._summary is None or not self._summary.is_current(self.events):
+            self._summary = WorkspaceEventSummary(self.events)
+        return self._summary
+
+    def append_event(self, event: WorkspaceEvent):
+        summary = self.summary
+        dropped = self.events[0] if len(self.events) == self.events.maxlen else None
+        self.events_appended = max(self.events_appended, len(self.events)) + 1
+        self.events.append(event)
+        summary.append(self.events, event, dropped)
+
+    def events_with_ids(self) -> list[tuple[int, WorkspaceEvent]]:
+        """Returns the events held in memory with their ids, oldest first"""
+        first_id = max(self.events_appended, len(self.events)) - len(self.events) + 1
+        return list(enumerate(self.events, start=first_id))
+
 
 class State(StateBaseModel):
     """Model for persistent server state"""
 
     workspaces: dict[str, WorkspaceState] = {}
     users: dict[str, User] = {}
+    journal_seq: int = 0  # The last journal record included in a snapshot of the state
 
     def get_user_by_slack_id(self, slack_user_id) -> User | None:
         """Retrieves a :class:`User` from the :class:`State` via their Slack User ID, provided the user is active in the `boardwalkd` state.
@@ -92,31 +195,350 @@ class State(StateBaseModel):
                 logger.trace(f"Retrieved cached Slack data for {slack_user_id}")
                 return user
         # If no such user exists, just return None
-        return None
+
+    def append_event(self, workspace: str, event: WorkspaceEvent):
+        """Appends an event to a workspace and journals it. Raises KeyError if
+        the workspace doesn't exist"""
+        self.workspaces[workspace].append_event(event)
+        store.record(self, {"op": "event", "workspace": workspace, "event": event.model_dump(mode="json")})
+
+    def record_workspace(self, workspace: str):
+        """Journals a workspace's details, last_seen and semaphores after they're changed"""
+        value = self.workspaces[workspace].model_dump(mode="json", exclude={"events"})
+        store.record(self, {"op": "workspace", "workspace": workspace, "value": value})
+
+    def record_user(self, email: str):
+        """Journals a user after it's added or changed"""
+        store.record(self, {"op": "user", "email": email, "value": self.users[email].model_dump(mode="json")})
+
+    def apply_journal_record(self, record: dict[str, Any]):
+        """Applies a mutation read back from the journal"""
+        match record["op"]:
+            case "event":
+                workspace = self.workspaces.setdefault(record["workspace"], WorkspaceState())
+                workspace.append_event(WorkspaceEvent.model_validate(record["event"]))
+            case "workspace":
+                workspace = self.workspaces.setdefault(record["workspace"], WorkspaceState())
+                fields = WorkspaceState.model_validate(record["value"])
+                for name in record["value"]:
+                    setattr(workspace, name, getattr(fields, name))
+            case "user":
+                self.users[record["email"]] = User.model_validate(record["value"])
+            case op:
+                raise ValueError(f"Unknown journal operation {op}")
 
     def flush(self):
         """
-        Writes state to disk for persistence
-        Some items are excluded because they should only be set during runtime
+        Persists the whole state right away. With the journal store this writes
+        a snapshot, which also compacts the journal. Raises an exception if the
+        write fails
         """
-        # Write state to disk.
-        statefile_path.write_text(self.model_dump_json())
+        store.flush(self)
 
 
-def load_state() -> State:
-    """If the statefile exists, then returns the State object, else creates
-    a statefile and returns an empty State object"""
-    try:
-        with open(statefile_path) as fd:
-            return State().model_validate_json(fd.read())
-    except ValidationError as e:
-        click.echo(click.style(f"[WARN] Error when validating stored state...\n{e}", fg="yellow"), err=True)
-        click.echo(click.style("[INFO] Resetting state and continuing...", fg="yellow"), err=True)
-        state = State()
-        state.flush()
+def write_statefile(data: str):
+    """Atomically replaces the statefile, so it's never left half-written"""
+    with NamedTemporaryFile(mode="w", delete=False, dir=statefile_path.parent, prefix="statefile.json.") as fd:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(fd.name, statefile_path)
+
+
+def journal_segments() -> list[tuple[int, Path]]:
+    """
+    Returns the journal's segment files with the sequence number of their first
+    record, in order. A new segment is started each time a snapshot is taken,
+    so segments are deleted whole once a snapshot includes them
+    """
+    segments = []
+    for path in statefile_path.parent.glob(f"{journal_prefix}*"):
+        try:
+            segments.append((int(path.name.removeprefix(journal_prefix)), path))
+        except ValueError:
+            continue
+    return sorted(segments)
+
+
+def replay_journal(state: State) -> int:
+    """
+    Applies journaled mutations newer than the state's snapshot to the state.
+    Returns the sequence number of the last record in the journal. A record
+    left partially written by a crash ends its segment
+    """
+    last_seq = state.journal_seq
+    for _, path in journal_segments():
+        with open(path) as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                    seq = record["seq"]
+                except (ValueError, KeyError):
+                    logger.warning(f"Ignoring the rest of {path.name}, which has an incomplete record")
+                    break
+                last_seq = max(last_seq, seq)
+                if seq <= state.journal_seq:
+                    continue
+                try:
+                    state.apply_journal_record(record)
+                except (ValidationError, ValueError, KeyError) as e:
+                    logger.warning(f"Skipping journal record {seq}: {e}")
+    return last_seq
+
+
+class StateStore(ABC):
+    """
+    Persists the state. The State object in memory is always the complete
+    state, apart from only holding the most recent events of each workspace,
+    and the store persists the changes made to it
+    """
+
+    @abstractmethod
+    def load(self) -> State:
+        """Returns the persisted state"""
+
+    @abstractmethod
+    def record(self, state: State, entry: dict[str, Any]):
+        """Persists a single mutation: an event appended to a workspace, or a
+        workspace or user that changed"""
+
+    @abstractmethod
+    def flush(self, state: State):
+        """Persists the whole state right away. Raises an exception if it fails"""
+
+    @abstractmethod
+    def close(self):
+        """Releases any open files"""
+
+    @abstractmethod
+    def metrics(self) -> dict[str, Any]:
+        """Returns statistics about writes, for monitoring"""
+
+    def events(
+        self,
+        state: State,
+        workspace: str,
+        before: int | None = None,
+        after: int | None = None,
+        limit: int = 50,
+        severity: str | None = None,
+    ) -> list[tuple[int, WorkspaceEvent]]:
+        """
+        Returns a page of a workspace's events with their ids, newest first.
+        The page holds the newest events older than the id `before`, or, when
+        `after` is given, the oldest events newer than it. Stores that keep
+        the event history override this; by default only the events held in
+        memory are returned
+        """
+        events = [
+            (event_id, event)
+            for event_id, event in state.workspaces[workspace].events_with_ids()
+            if (severity is None or event.severity == severity)
+            and (before is None or event_id < before)
+            and (after is None or event_id > after)
+        ]
+        if after is not None:
+            return events[:limit][::-1]
+        return events[::-1][:limit]
+
+    def history_truncated(self, state: State, workspace: str) -> bool:
+        """
+        Returns True if older events of the workspace were dropped, so events()
+        can't return them. Stores that keep the event history override this
+        """
+        events = state.workspaces[workspace].events_with_ids()
+        return bool(events) and events[0][0] > 1
+
+
+class JournalStateStore(StateStore):
+    """
+    Persists the state as a JSON snapshot plus an append-only journal of the
+    mutations made since. Each mutation recorded with record() is appended to
+    the journal right away, which is a small sequential write, and is flushed
+    to the OS so it survives the server crashing. Once snapshot_records
+    mutations have been journaled, a new snapshot is written behind the event
+    loop, at most once per interval and from a background thread. With an interval of
+    0, or when no event loop is running, snapshots are written right away
+    """
+
+    def __init__(self, interval: float = 1.0, snapshot_records: int = 1000):
+        self.interval = interval
+        self.snapshot_records = snapshot_records
+        self.seq = 0  # The last journaled record
+        self.journal_records = 0
+        self.records_since_snapshot = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.last_write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.total_write_seconds = 0.0
+        # Serializes writes, and makes sure an older snapshot never replaces a newer one
+        self._write_lock = threading.Lock()
+        self._generation = 0
+        self._written_generation = 0
+        self._journal: TextIO | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight: asyncio.Future[None] | None = None
+
+    def read(self) -> State:
+        """
+        Reads the last snapshot of the state and replays the journal on top of
+        it, without writing anything. Raises ValidationError if the statefile
+        can't be read
+        """
+        try:
+            with open(statefile_path) as fd:
+                state = State().model_validate_json(fd.read())
+        except FileNotFoundError:
+            state = State()
+        self.seq = replay_journal(state)
         return state
-    except FileNotFoundError:
+
+    def load(self) -> State:
+        """
+        Reads the state, then writes a new snapshot. If there's no statefile,
+        starts with an empty State object. A statefile that can't be read is
+        kept aside rather than overwritten
+        """
         statefile_dir_path.mkdir(parents=True, exist_ok=True)
-        state = State()
-        state.flush()
+        try:
+            state = self.read()
+        except ValidationError as e:
+            invalid_path = statefile_path.with_name(f"{statefile_path.name}.invalid.{int(time.time())}")
+            os.replace(statefile_path, invalid_path)
+            click.echo(click.style(f"[WARN] Error when validating stored state...\n{e}", fg="yellow"), err=True)
+            click.echo(
+                click.style(
+                    f"[INFO] Moved the statefile to {invalid_path}, resetting state and continuing...", fg="yellow"
+                ),
+                err=True,
+            )
+            state = State()
+            self.seq = replay_journal(state)
+        self.flush(state)
         return state
+
+    def record(self, state: State, entry: dict[str, Any]):
+        """Appends a mutation to the journal"""
+        self.seq += 1
+        if self._journal is None:
+            # Segments are named after their first record
+            path = statefile_path.parent.joinpath(f"{journal_prefix}{self.seq:012d}")
+            self._journal = open(path, "a")  # noqa: SIM115
+        self._journal.write(json.dumps({"seq": self.seq} | entry) + "\n")
+        self._journal.flush()
+        self.journal_records += 1
+        self.records_since_snapshot += 1
+        if self.records_since_snapshot >= self.snapshot_records:
+            self._schedule(state)
+
+    def flush(self, state: State):
+        """Writes a snapshot right away, on the calling thread"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._write(*self._snapshot(state))
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _snapshot_due(self) -> bool:
+        return self.records_since_snapshot >= self.snapshot_records
+
+    def _schedule(self, state: State):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or self.interval <= 0:
+            self.flush(state)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._write_behind, state)
+
+    def _snapshot(self, state: State) -> tuple[int, str, int, int, float]:
+        """Serializes the state and starts a new journal segment. Done on the
+        event loop's thread, so the state doesn't change while it's serialized"""
+        started = time.monotonic()
+        records, self.records_since_snapshot = self.records_since_snapshot, 0
+        self._generation += 1
+        state.journal_seq = self.seq
+        self.close()
+        return self._generation, state.model_dump_json(), self.seq, records, started
+
+    def _write(self, generation: int, data: str, seq: int, records: int, started: float):
+        with self._write_lock:
+            if generation <= self._written_generation:
+                return
+            try:
+                write_statefile(data)
+            except Exception:
+                self.write_errors += 1
+                # The records are still only in the journal
+                self.records_since_snapshot += records
+                raise
+            self._written_generation = generation
+            # Every segment but the one started by this snapshot is included in it
+            for first_seq, path in journal_segments():
+                if first_seq <= seq:
+                    path.unlink(missing_ok=True)
+            seconds = time.monotonic() - started
+            self.writes += 1
+            self.last_write_seconds = seconds
+            self.max_write_seconds = max(self.max_write_seconds, seconds)
+            self.total_write_seconds += seconds
+
+    def _write_behind(self, state: State):
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        if self._in_flight is not None and not self._in_flight.done():
+            # Only one write is in flight at a time; records keep coalescing
+            self._timer = loop.call_later(self.interval, self._write_behind, state)
+            return
+        self._in_flight = loop.run_in_executor(None, self._write, *self._snapshot(state))
+        self._in_flight.add_done_callback(lambda future: self._written(future, state))
+
+    def _written(self, future: asyncio.Future[None], state: State):
+        if (error := future.exception()) is not None:
+            logger.error(f"Could not write the statefile: {error}")
+        if self._snapshot_due() and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._write_behind, state)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "store": "journal",
+            "interval_seconds": self.interval,
+            "journal_records": self.journal_records,
+            "journal_records_since_snapshot": self.records_since_snapshot,
+            "write_in_flight": self._in_flight is not None and not self._in_flight.done(),
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "last_write_seconds": self.last_write_seconds,
+            "max_write_seconds": self.max_write_seconds,
+            "mean_write_seconds": self.total_write_seconds / self.writes if self.writes else 0.0,
+        }
+
+
+store: StateStore = JournalStateStore()
+
+
+def get_store() -> StateStore:
+    """Returns the store in use"""
+    return store
+
+
+def load_state() -> State:
+    """Returns the state persisted by the store"""
+    return store.load()
+
+
+def use_store(state: State, new_store: StateStore):
+    """Switches to another store, replacing the contents of state with what
+    that store has persisted"""
+    global store
+    store.close()
+    store = new_store
+    loaded = store.load()
+    state.workspaces = loaded.workspaces
+    state.users = loaded.users
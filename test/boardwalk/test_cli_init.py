@@ -0,0 +1,131 @@
+import threading
+import time
+from pathlib import Path
+from typing import Any, cast
+
+import pytest
+
+from boardwalk import Workflow, Workspace, WorkspaceConfig, cli_init, manifest
+from boardwalk.ansible import AnsibleRunnerUnreachableHost
+from boardwalk.cli_init import (
+    InitCheckpoint,
+    InitEventHandler,
+    add_gathered_facts_to_state,
+    run_init_shards,
+    split_init_shards,
+    write_init_shards,
+)
+from boardwalk.state import ShardedLocalStateStore
+
+
+class InitTestWorkflow(Workflow):
+    def jobs(self):
+        return ()
+
+
+class InitTestWorkspace(Workspace):
+    def config(self):
+        return WorkspaceConfig(host_pattern="all", workflow=InitTestWorkflow())
+
+
+@pytest.fixture
+def init_workspace(monkeypatch, tmp_path):
+    # Workspaces are singletons, so each test gets a fresh one in its own directory
+    monkeypatch.setattr(manifest, "workspaces_dir", tmp_path)
+    monkeypatch.setattr(InitTestWorkspace, "_instance", None)
+    return InitTestWorkspace()
+
+
+def setup_ok_event(host: str) -> Any:
+    return {
+        "event": "runner_on_ok",
+        "event_data": {"host": host, "task": "setup", "res": {"ansible_facts": {"ansible_hostname": host}}},
+    }
+
+
+def test_init_event_handler_saves_facts_as_they_arrive_and_checkpoints(init_workspace):
+    ws = init_workspace
+    checkpoint = InitCheckpoint(ws.path.joinpath("init.checkpoint"))
+    checkpoint.start("all")
+    handler = InitEventHandler(ws, checkpoint, ws.path.joinpath("init.retry.new"))
+    handler.checkpoint_interval = 2
+
+    assert handler(setup_ok_event("a")) is False
+    assert ws.state_store.host_path("a").exists()
+    assert not ws.state.hosts.is_loaded("a")
+    assert checkpoint.load() == ("all", set())
+
+    assert handler(setup_ok_event("b")) is False
+    assert checkpoint.load() == ("all", {"a", "b"})
+    assert list(ShardedLocalStateStore(ws.path).load().hosts) == ["a", "b"]
+
+    unreachable: Any = {"event": "runner_on_unreachable", "stdout": "unreachable", "event_data": {"host": "c"}}
+    assert handler(unreachable) is True
+    handler(setup_ok_event("d"))
+    handler.close()
+
+    assert checkpoint.load() == ("all", {"a", "b", "d"})
+    assert handler.retry_file_path.read_text() == "c\n"
+    assert handler.hosts_gathered == 3
+    assert ws.state.hosts["d"].ansible_facts == {"ansible_hostname": "d"}
+
+
+def test_init_keeps_only_allowlisted_facts(init_workspace):
+    ws = init_workspace
+    ws.cfg.kept_facts = ["ansible_distribution*"]
+    event = setup_ok_event("a")
+    event["event_data"]["res"]["ansible_facts"].update(ansible_distribution="Debian", ansible_local={})
+
+    assert add_gathered_facts_to_state(event, ws)
+    assert ws.state.hosts["a"].ansible_facts == {
+        "ansible_distribution": "Debian",
+        "ansible_local": {},
+    }
+
+
+def test_init_checkpoint_ignores_line_cut_short_by_interruption(tmp_path):
+    checkpoint = InitCheckpoint(tmp_path.joinpath("init.checkpoint"))
+    checkpoint.start("@retry")
+    checkpoint.record(["a"])
+    with open(checkpoint.path, "a") as fd:
+        fd.write('{"host": "b')
+
+    assert checkpoint.load() == ("@retry", {"a"})
+
+
+def test_split_init_shards_by_group_then_size():
+    hosts = ["a1", "a2", "a3", "b1", "c1"]
+    groups = {"a1": "a", "a2": "a", "a3": "a", "b1": "b"}
+
+    assert split_init_shards(hosts, 2) == [["a1", "a2"], ["a3", "b1"], ["c1"]]
+    assert split_init_shards(hosts, 0, groups) == [["a1", "a2", "a3"], ["b1"], ["c1"]]
+    assert split_init_shards(hosts, 2, groups) == [["a1", "a2"], ["a3"], ["b1"], ["c1"]]
+
+
+def test_run_init_shards_runs_shards_concurrently_and_reports_failures(monkeypatch, init_workspace, tmp_path):
+    limits = write_init_shards(tmp_path, [["a"], ["b"], ["c"]])
+    assert tmp_path.joinpath("shard-0001").read_text() == "b\n"
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def fake_run_tasks(limit, event_handler, **kwargs):
+        with lock:
+            running.append(limit)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(limit)
+        host = Path(limit[1:]).read_text().strip()
+        if host == "b":
+            raise AnsibleRunnerUnreachableHost("unreachable", "unreachable", cast(Any, None))
+        event_handler(setup_ok_event(host))
+
+    monkeypatch.setattr(cli_init, "ansible_runner_run_tasks", fake_run_tasks)
+    handler = InitEventHandler(init_workspace, InitCheckpoint(tmp_path.joinpath("checkpoint")), tmp_path.joinpath("r"))
+    runner_kwargs: Any = {"invocation_msg": "Gathering facts", "limit": "all"}
+
+    assert run_init_shards(runner_kwargs, limits, 2, handler) is True
+    assert max(max_running) == 2
+    assert handler.hosts_gathered == 2
+    assert sorted(init_workspace.state.hosts) == ["a", "c"]
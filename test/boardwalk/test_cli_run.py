@@ -1,15 +1,23 @@
+import sys
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
 from types import SimpleNamespace
 from typing import Any, cast
 
-from boardwalk import Workflow, WorkspaceConfig, cli_run
+import pytest
+
+from boardwalk import Workflow, WorkspaceConfig, ansible, ansible_worker, cli_run
 from boardwalk.ansible import ansible_runner_run_tasks
+from boardwalk.app_exceptions import BoardwalkException
 from boardwalk.cli_run import (
     build_workspace_details,
     resolve_workspace_ui_group,
     workspace_event_for_ansible_task_start,
 )
+from boardwalk.host import Host, RemoteHostLocked
 from boardwalk.manifest import JobTypes
+from boardwalk.state import RemoteStateModel
+from boardwalkd.protocol import WorkspaceSemaphores
 
 
 class EmptyWorkflow(Workflow):
@@ -213,6 +221,290 @@ def test_run_workflow_posts_current_host_details_when_each_host_starts(monkeypat
     assert [details.ui_group for details in client.details] == ["alpha", "alpha", "beta", "beta"]
 
 
+def test_run_workflow_parallel_runs_every_host_and_reports_progress(monkeypatch):
+    client = FakeBoardwalkdClient()
+    executed = []
+    monkeypatch.setattr(cli_run, "boardwalkd_client", client)
+    monkeypatch.setattr(cli_run, "handle_workflow_catch", lambda workspace, host: None)
+    monkeypatch.setattr(cli_run, "workflow_caught", lambda workspace: False)
+    monkeypatch.setattr(cli_run, "lock_remote_host", lambda host: None)
+    monkeypatch.setattr(cli_run, "directly_confirm_host_preconditions", lambda host, inventory_vars, workspace: True)
+    monkeypatch.setattr(cli_run, "execute_host_workflow", lambda host, workspace, verbosity: executed.append(host.name))
+    cfg = WorkspaceConfig(host_pattern="nodes", workflow=EmptyWorkflow())
+    workspace = workspace_with_config(cfg)
+    hostnames = [f"node-{i}" for i in range(5)]
+
+    cli_run.run_workflow(
+        hosts=cast(Any, [FakeHost(name) for name in hostnames]),
+        inventory_vars={name: {} for name in hostnames},
+        workspace=workspace,
+        verbosity=0,
+        ctx=context_with_limit(""),
+        parallel=3,
+    )
+
+    assert sorted(executed) == hostnames
+    completed = [int(details.progress_hosts_completed) for details in client.details]
+    assert max(completed) == len(hostnames)
+    assert all(details.progress_hosts_total == str(len(hostnames)) for details in client.details)
+
+
+def test_run_workflow_parallel_retries_failed_host(monkeypatch):
+    client = FakeBoardwalkdClient()
+    attempts = []
+    failure_hosts = []
+
+    def fake_lock_remote_host(host):
+        attempts.append(host.name)
+        if host.name == "node-1" and attempts.count("node-1") == 1:
+            raise cli_run.RemoteHostLocked(f"{host.name}: Host is locked by someone")
+
+    monkeypatch.setattr(cli_run, "boardwalkd_client", client)
+    monkeypatch.setattr(cli_run, "handle_workflow_catch", lambda workspace, host: None)
+    monkeypatch.setattr(cli_run, "workflow_caught", lambda workspace: False)
+    monkeypatch.setattr(cli_run, "lock_remote_host", fake_lock_remote_host)
+    monkeypatch.setattr(cli_run, "directly_confirm_host_preconditions", lambda host, inventory_vars, workspace: True)
+    monkeypatch.setattr(cli_run, "execute_host_workflow", lambda host, workspace, verbosity: None)
+    monkeypatch.setattr(
+        cli_run,
+        "run_failure_mode_handler",
+        lambda exception, hostname, workspace: failure_hosts.append(hostname),
+    )
+    cfg = WorkspaceConfig(host_pattern="nodes", workflow=EmptyWorkflow())
+    workspace = workspace_with_config(cfg)
+    hostnames = ["node-0", "node-1", "node-2"]
+
+    cli_run.run_workflow(
+        hosts=cast(Any, [FakeHost(name) for name in hostnames]),
+        inventory_vars={name: {} for name in hostnames},
+        workspace=workspace,
+        verbosity=0,
+        ctx=context_with_limit(""),
+        parallel=2,
+    )
+
+    assert failure_hosts == ["node-1"]
+    assert attempts.count("node-1") == 2
+    assert max(int(details.progress_hosts_completed) for details in client.details) == len(hostnames)
+
+
+def test_run_workflow_prefetches_upcoming_hosts_and_skips_unmet_hosts_before_locking(monkeypatch):
+    gathered = []
+    locked = []
+
+    def fake_gather_facts(self, setup_args=None):
+        gathered.append(self.name)
+        return {"ansible_system": "Linux", "meets_preconditions": self.name != "node-1"}
+
+    def fake_directly_confirm_host_preconditions(host, inventory_vars, workspace):
+        if not host.ansible_facts.get("meets_preconditions", True):
+            raise cli_run.HostPreConditionsUnmet
+
+    monkeypatch.setattr(Host, "gather_facts", fake_gather_facts)
+    monkeypatch.setattr(cli_run, "boardwalkd_client", None)
+    monkeypatch.setattr(cli_run, "handle_workflow_catch", lambda workspace, host: None)
+    monkeypatch.setattr(
+        cli_run, "lock_remote_host", lambda host, refresh_only=False: locked.append((host.name, refresh_only))
+    )
+    monkeypatch.setattr(cli_run, "directly_confirm_host_preconditions", fake_directly_confirm_host_preconditions)
+    monkeypatch.setattr(cli_run, "execute_host_workflow", lambda host, workspace, verbosity: True)
+    cfg = WorkspaceConfig(host_pattern="nodes", workflow=EmptyWorkflow())
+    workspace = SimpleNamespace(name="UpgradeNodes", cfg=cfg, flush_host=lambda host: None)
+    hostnames = ["node-0", "node-1", "node-2"]
+
+    cli_run.run_workflow(
+        hosts=[Host(name=name, ansible_facts={}) for name in hostnames],
+        inventory_vars={name: {} for name in hostnames},
+        workspace=cast(Any, workspace),
+        verbosity=0,
+        ctx=context_with_limit(""),
+        prefetch=2,
+    )
+
+    # The first host isn't prefetched, and node-1 is skipped without being locked
+    assert sorted(gathered) == ["node-1", "node-2"]
+    assert locked == [("node-0", False), ("node-2", True)]
+
+
+def test_host_prefetcher_falls_back_when_facts_cannot_be_gathered(monkeypatch):
+    def fake_gather_facts(self, setup_args=None):
+        raise BoardwalkException("gather_facts returned nothing")
+
+    monkeypatch.setattr(Host, "gather_facts", fake_gather_facts)
+    cfg = WorkspaceConfig(host_pattern="nodes", workflow=EmptyWorkflow())
+    prefetcher = cli_run.HostPrefetcher(cast(Any, SimpleNamespace(cfg=cfg)), lookahead=1)
+    host = Host(name="node-0", ansible_facts={})
+    try:
+        prefetcher.prefetch([host])
+        assert prefetcher.take(host) is None
+        # A host that was already taken, e.g. one being retried, isn't prefetched again
+        prefetcher.prefetch([host])
+        assert prefetcher.take(host) is None
+    finally:
+        prefetcher.close()
+
+
+def test_handle_workflow_catch_waits_on_semaphore_changes_without_polling(monkeypatch):
+    client = FakeBoardwalkdClient()
+    client.url = SimpleNamespace(geturl=lambda: "http://boardwalkd")  # type: ignore[attr-defined]
+    client.caught = lambda: True  # type: ignore[attr-defined]
+    responses = [
+        (WorkspaceSemaphores(caught=True), "v1"),
+        (WorkspaceSemaphores(caught=True, clear_remote_state_requested=True), "v2"),
+        (WorkspaceSemaphores(caught=False), "v3"),
+    ]
+    waits = []
+
+    def fake_wait_semaphores(version, wait):
+        waits.append(version)
+        return responses.pop(0)
+
+    cleared = []
+    client.wait_semaphores = fake_wait_semaphores  # type: ignore[attr-defined]
+    monkeypatch.setattr(cli_run, "boardwalkd_client", client)
+    monkeypatch.setattr(
+        cli_run,
+        "maybe_clear_remote_state_fact",
+        lambda semaphores, **kwargs: cleared.append(semaphores.clear_remote_state_requested),
+    )
+    monkeypatch.setattr(cli_run, "maybe_clear_remote_mutex", lambda semaphores, **kwargs: False)
+    monkeypatch.setattr(cli_run.time, "sleep", lambda seconds: pytest.fail("caught workers should not poll"))
+
+    cli_run.handle_workflow_catch(cast(Any, SimpleNamespace(name="ws", caught=lambda: False)), cast(Any, FakeHost("a")))
+
+    assert waits == [None, "v1", "v2"]
+    assert cleared == [False, True]
+
+
+def fake_runner_ok_events(*task_results) -> Any:
+    return SimpleNamespace(
+        events=[{"event": "runner_on_ok", "event_data": {"task": task, "res": res}} for task, res in task_results]
+    )
+
+
+def test_host_preflight_returns_facts_and_locks_in_one_invocation(monkeypatch):
+    invocations = []
+
+    def fake_ansible_run(self, invocation_msg, tasks, **kwargs):
+        invocations.append((invocation_msg, [task["name"] for task in tasks]))
+        return fake_runner_ok_events(
+            ("remote_mutex_check", {"stat": {"exists": False}}),
+            ("setup", {"ansible_facts": {"ansible_system": "Linux"}}),
+        )
+
+    monkeypatch.setattr(Host, "ansible_run", fake_ansible_run)
+    host = Host(name="node-alpha-a", ansible_facts={})
+
+    facts = host.preflight()
+
+    assert facts == {"ansible_system": "Linux", "ansible_local": {}}
+    assert len(invocations) == 1
+    assert invocations[0][0] == "preflight_remote_host"
+    task_names = invocations[0][1]
+    assert task_names.index("setup") < task_names.index("acquire_remote_lock")
+    assert "set_remote_lock_ownership" in task_names
+
+
+def test_host_preflight_raises_when_host_is_locked(monkeypatch):
+    monkeypatch.setattr(
+        Host,
+        "ansible_run",
+        lambda self, **kwargs: fake_runner_ok_events(
+            ("remote_mutex_check", {"stat": {"exists": True}}),
+            ("slurp_mutex_content", {"content": "dXNlckBob3N0Cg=="}),
+        ),
+    )
+    host = Host(name="node-alpha-a", ansible_facts={})
+
+    with pytest.raises(RemoteHostLocked, match="Host is locked by user@host"):
+        host.preflight()
+
+
+def test_host_preflight_acquires_lock_exclusively_and_reports_existing_holder(monkeypatch):
+    tasks_run = []
+
+    def fake_ansible_run(self, invocation_msg, tasks, **kwargs):
+        tasks_run.extend(tasks)
+        return fake_runner_ok_events(("acquire_remote_lock", {"rc": 3, "stdout": "user@host at noon"}))
+
+    monkeypatch.setattr(Host, "ansible_run", fake_ansible_run)
+    host = Host(name="node-alpha-a", ansible_facts={})
+
+    with pytest.raises(RemoteHostLocked, match="Host is locked by user@host at noon"):
+        host.preflight()
+    acquire = next(task for task in tasks_run if task["name"] == "acquire_remote_lock")
+    assert "set -C; " in acquire["ansible.builtin.shell"]["cmd"]
+    assert "/opt/boardwalk.mutex" in acquire["ansible.builtin.shell"]["cmd"]
+    assert {"name": "end_if_locked", "ansible.builtin.meta": "end_host", "when": "remote_lock.rc == 3"} in tasks_run
+
+    tasks_run.clear()
+    with pytest.raises(RemoteHostLocked):
+        host.preflight(stomp_existing_locks=True)
+    acquire = next(task for task in tasks_run if task["name"] == "acquire_remote_lock")
+    assert "set -C" not in acquire["ansible.builtin.shell"]["cmd"]
+
+
+def test_host_preflight_only_reads_lock_in_check_mode(monkeypatch):
+    task_names = []
+
+    def fake_ansible_run(self, invocation_msg, tasks, **kwargs):
+        task_names.extend(task["name"] for task in tasks)
+        return fake_runner_ok_events(("setup", {"ansible_facts": {"ansible_system": "Linux"}}))
+
+    monkeypatch.setattr(Host, "ansible_run", fake_ansible_run)
+    host = Host(name="node-alpha-a", ansible_facts={})
+
+    host.preflight(check=True)
+
+    assert "acquire_remote_lock" not in task_names
+    assert {"remote_mutex_check", "create_remote_lock"} <= set(task_names)
+
+
+def test_host_postflight_releases_lock_and_returns_refreshed_facts(monkeypatch):
+    invocations = []
+
+    def fake_ansible_run(self, invocation_msg, tasks, **kwargs):
+        invocations.append((invocation_msg, tasks))
+        return fake_runner_ok_events(("setup", {"ansible_facts": {"ansible_system": "Linux", "ansible_local": {}}}))
+
+    monkeypatch.setattr(Host, "ansible_run", fake_ansible_run)
+    host = Host(name="node-alpha-a", ansible_facts={"ansible_system": "Linux"})
+
+    facts = host.postflight(RemoteStateModel())
+
+    assert facts == {"ansible_system": "Linux", "ansible_local": {}}
+    assert len(invocations) == 1
+    task_names = [task["name"] for task in invocations[0][1]]
+    assert task_names.index("update_remote_state") < task_names.index("release_remote_lock")
+    assert task_names[-1] == "setup"
+
+
+@pytest.mark.parametrize("fresh", [True, False])
+def test_lock_remote_host_only_refreshes_boardwalk_facts_when_facts_are_fresh(monkeypatch, fresh):
+    setup_args = []
+
+    def fake_preflight(self, **kwargs):
+        setup_args.append(kwargs["setup_args"])
+        return {"ansible_system": "Linux", "ansible_local": {"boardwalk_state": {}}}
+
+    monkeypatch.setattr(Host, "preflight", fake_preflight)
+    cfg = WorkspaceConfig(host_pattern="nodes", workflow=EmptyWorkflow(), facts_ttl=60)
+    monkeypatch.setattr(cli_run, "get_ws", lambda: SimpleNamespace(cfg=cfg, flush_host=lambda host: None))
+    gathered_at = datetime.now(UTC) - timedelta(seconds=30 if fresh else 120)
+    host = Host(
+        name="node-alpha-a",
+        ansible_facts={"ansible_system": "Linux", "ansible_kernel": "6.1"},
+        facts_gathered_at=gathered_at,
+    )
+
+    cli_run.lock_remote_host(host)
+
+    assert setup_args == [cfg.refresh_setup_args if fresh else cfg.setup_args]
+    assert ("ansible_kernel" in host.ansible_facts) is fresh
+    assert host.ansible_facts["ansible_local"] == {"boardwalk_state": {}}
+    assert (host.facts_gathered_at == gathered_at) is fresh
+
+
 def test_ansible_runner_run_tasks_passes_event_handler_to_ansible_runner(monkeypatch, tmp_path):
     captured = {}
 
@@ -239,3 +531,153 @@ def test_ansible_runner_run_tasks_passes_event_handler_to_ansible_runner(monkeyp
     )
 
     assert captured["event_handler"] is event_handler
+
+
+def test_ansible_runner_run_tasks_reuses_per_run_ssh_control_path_dir(monkeypatch, tmp_path):
+    captured = {}
+    workspace = SimpleNamespace(path=tmp_path)
+
+    def fake_run(**kwargs):
+        captured.update(kwargs)
+        kwargs["event_handler"]({"event": "runner_on_ok", "event_data": {"host": "node-alpha-a"}})
+        return SimpleNamespace(rc=0, events=[])
+
+    monkeypatch.setattr("boardwalk.manifest.get_ws", lambda: workspace)
+    monkeypatch.setattr("boardwalk.ansible.ansible_runner.run", fake_run)
+    monkeypatch.delenv("ANSIBLE_SSH_CONTROL_PATH_DIR", raising=False)
+
+    control_path_dir = ansible.ssh_control_path_dir_setup(cast(Any, workspace))
+    try:
+        for _ in range(2):
+            ansible_runner_run_tasks(
+                hosts="node-alpha-a",
+                invocation_msg="preflight_remote_host",
+                job_type=JobTypes.TASK,
+                tasks=[{"name": "ping", "ansible.builtin.ping": {}}],
+            )
+        assert control_path_dir.is_dir()
+        assert captured["envvars"]["ANSIBLE_SSH_CONTROL_PATH_DIR"] == str(control_path_dir)
+        assert len(ansible._connection_timings["node-alpha-a"]) == 2
+    finally:
+        ansible.ssh_control_path_dir_teardown()
+
+    assert not control_path_dir.exists()
+    assert ansible._connection_timings == {}
+
+
+def test_ansible_worker_streams_events_and_returns_rc(tmp_path):
+    fake_worker = tmp_path.joinpath("fake_worker.py")
+    fake_worker.write_text(
+        "import json, sys\n"
+        "for line in sys.stdin:\n"
+        "    request = json.loads(line)\n"
+        "    for play in request['plays']:\n"
+        "        event = {'event': 'runner_on_ok', 'event_data': {'task': play['tasks'][0]['name'], 'res': {}}}\n"
+        "        print(json.dumps({'event': event}), flush=True)\n"
+        "    print(json.dumps({'rc': 2 if request['check'] else 0}), flush=True)\n"
+    )
+    worker = ansible_worker.AnsibleWorker(envvars={}, command=[sys.executable, str(fake_worker)])
+    handled = []
+    request: Any = {
+        "become_password": None,
+        "check": False,
+        "extravars": {},
+        "limit": None,
+        "plays": [{"hosts": "node-alpha-a", "tasks": [{"name": "ping", "ansible.builtin.ping": {}}]}],
+        "verbosity": 0,
+    }
+    try:
+        result = worker.run(request, event_handler=lambda event: handled.append(event) or True)
+        assert result.rc == 0
+        assert result.status == "successful"
+        assert [event["event_data"]["task"] for event in result.events] == ["ping"]
+        assert handled == result.events
+
+        # The same process serves the next request
+        result = worker.run(request | {"check": True})
+        assert result.rc == 2
+        assert worker.alive()
+    finally:
+        worker.close()
+
+    assert not worker.alive()
+
+
+def test_ansible_worker_is_canceled_while_events_stream(tmp_path):
+    fake_worker = tmp_path.joinpath("fake_worker.py")
+    fake_worker.write_text(
+        "import json, sys, time\n"
+        "for line in sys.stdin:\n"
+        "    while True:\n"
+        "        event = {'event': 'runner_on_ok', 'event_data': {'task': 'busy', 'res': {}}}\n"
+        "        print(json.dumps({'event': event}), flush=True)\n"
+        "        time.sleep(0.01)\n"
+    )
+    worker = ansible_worker.AnsibleWorker(envvars={}, command=[sys.executable, str(fake_worker)])
+    worker.cancel_check_interval = 0.05
+    cancel_checks = []
+    request: Any = {
+        "become_password": None,
+        "check": False,
+        "extravars": {},
+        "limit": None,
+        "plays": [],
+        "verbosity": 0,
+    }
+    try:
+        result = worker.run(request, cancel_callback=lambda: cancel_checks.append(True) or len(cancel_checks) >= 3)
+    finally:
+        worker.close(kill=True)
+
+    assert result.status == "canceled"
+    assert result.rc == ansible_worker.CANCELED_RC
+    assert len(cancel_checks) == 3
+    assert len(result.events) > 0
+    assert not worker.alive()
+
+
+def test_persistent_backend_falls_back_when_ansible_cant_be_imported(monkeypatch):
+    monkeypatch.setattr(ansible_worker, "ansible_importable", lambda: False)
+
+    assert not ansible.persistent_backend_setup()
+    assert not ansible._persistent_backend
+
+
+def test_ansible_worker_doesnt_carry_vars_between_requests(monkeypatch, tmp_path):
+    pytest.importorskip("ansible")
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath("hosts").write_text(
+        f"localhost ansible_connection=local ansible_python_interpreter={sys.executable}\n"
+    )
+    worker = ansible_worker.AnsibleWorker(envvars={"ANSIBLE_INVENTORY": str(tmp_path.joinpath("hosts"))})
+    request: Any = {
+        "become_password": None,
+        "check": False,
+        "extravars": {},
+        "forks": None,
+        "limit": None,
+        "verbosity": 0,
+    }
+    set_vars = [
+        {"name": "set", "ansible.builtin.set_fact": {"from_set_fact": "first"}},
+        {"name": "register", "ansible.builtin.command": "true", "register": "from_register"},
+        {"name": "add", "ansible.builtin.add_host": {"name": "added", "groups": "from_add_host"}},
+    ]
+    get_vars = [
+        {
+            "name": "get",
+            "ansible.builtin.debug": {
+                "msg": "{{ from_set_fact | default('unset') }} {{ from_register is defined }}"
+                " {{ groups['from_add_host'] | default([]) | length }}"
+            },
+        }
+    ]
+    try:
+        for tasks in (set_vars, get_vars):
+            result = worker.run(request | {"plays": [{"hosts": "localhost", "gather_facts": False, "tasks": tasks}]})
+            assert result.rc == 0
+
+        results = [event["event_data"]["res"] for event in result.events if event["event"] == "runner_on_ok"]
+        assert results[0]["msg"] == "unset False 0"
+    finally:
+        worker.close()
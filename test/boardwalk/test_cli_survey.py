@@ -0,0 +1,89 @@
+from base64 import b64encode
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, cast
+
+from boardwalk import cli_run, cli_survey
+from boardwalk.ansible import AnsibleRunnerUnreachableHost
+from boardwalk.cli_survey import HostSurvey, format_survey_table, survey_hosts
+from boardwalk.host import Host
+
+
+def ok_event(host: str, task: str, res: dict[str, Any]) -> dict[str, Any]:
+    return {"event": "runner_on_ok", "event_data": {"host": host, "task": task, "res": res}}
+
+
+def remote_state_facts(started: bool, succeeded: bool) -> dict[str, Any]:
+    workflow = {"started": started, "succeeded": succeeded}
+    return {"ansible_facts": {"ansible_local": {"boardwalk_state": {"workspaces": {"Fleet": {"workflow": workflow}}}}}}
+
+
+def test_survey_hosts_surveys_all_hosts_in_one_invocation(monkeypatch, tmp_path):
+    invocations = []
+    events = [
+        ok_event("node-0", "slurp_mutex_content", {"content": b64encode(b"user@host at noon\n").decode()}),
+        ok_event("node-0", "get_remote_state", remote_state_facts(started=True, succeeded=False)),
+        ok_event("node-1", "get_remote_state", remote_state_facts(started=True, succeeded=True)),
+        ok_event("node-2", "get_remote_state", {"ansible_facts": {"ansible_local": {}}}),
+        {"event": "runner_on_unreachable", "event_data": {"host": "node-3"}},
+    ]
+
+    def fake_ansible_runner_run_tasks(**kwargs):
+        invocations.append(kwargs)
+        limit_file = Path(kwargs["limit"].removeprefix("@"))
+        assert limit_file.parent == tmp_path
+        assert limit_file.read_text() == "node-0\nnode-1\nnode-2\nnode-3\n"
+        raise AnsibleRunnerUnreachableHost("unreachable", "survey", cast(Any, SimpleNamespace(events=events)))
+
+    monkeypatch.setattr(cli_survey, "ansible_runner_run_tasks", fake_ansible_runner_run_tasks)
+    workspace = SimpleNamespace(name="Fleet", path=tmp_path, cfg=SimpleNamespace(host_pattern="nodes"))
+
+    surveys = survey_hosts(cast(Any, workspace), ["node-0", "node-1", "node-2", "node-3"], forks=20)
+
+    assert len(invocations) == 1
+    assert invocations[0]["forks"] == 20
+    assert list(tmp_path.iterdir()) == []
+    assert [(survey.name, survey.status) for survey in surveys] == [
+        ("node-0", "locked"),
+        ("node-1", "succeeded"),
+        ("node-2", "not started"),
+        ("node-3", "unreachable"),
+    ]
+    assert surveys[0].locked_by == "user@host at noon"
+    assert surveys[0].workflow_started
+
+
+def test_format_survey_table_lists_hosts_and_counts_statuses():
+    table = format_survey_table(
+        [
+            HostSurvey(name="node-0", locked_by="user@host"),
+            HostSurvey(name="node-10", workflow_started=True),
+            HostSurvey(name="node-2", workflow_started=True),
+        ]
+    )
+
+    assert table.splitlines() == [
+        "HOST     STATUS   LOCKED BY",
+        "node-0   locked   user@host",
+        "node-10  started",
+        "node-2   started",
+        "",
+        "1 locked, 2 started",
+    ]
+
+
+def test_survey_before_run_skips_locked_hosts(monkeypatch):
+    monkeypatch.setattr(
+        cli_run,
+        "survey_hosts",
+        lambda workspace, hostnames: [
+            HostSurvey(name=name, locked_by="user@host" if name == "node-1" else None) for name in hostnames
+        ],
+    )
+    hosts = [Host(name=name, ansible_facts={}) for name in ("node-0", "node-1", "node-2")]
+
+    assert cli_run.survey_before_run(cast(Any, None), hosts, skip_locked_hosts=False) == hosts
+    assert [host.name for host in cli_run.survey_before_run(cast(Any, None), hosts, skip_locked_hosts=True)] == [
+        "node-0",
+        "node-2",
+    ]
@@ -0,0 +1,115 @@
+from typing import Any, cast
+
+import pytest
+
+from boardwalk import inventory as inventory_module
+from boardwalk.app_exceptions import BoardwalkException
+from boardwalk.inventory import Inventory, get_inventory, split_host_pattern
+
+INVENTORY_DATA: Any = {
+    "_meta": {"hostvars": {"web1.example.com": {"site": "a"}, "web2.example.com": {}, "db1": {}, "db2": {}}},
+    "all": {"children": ["ungrouped", "web", "db", "prod"]},
+    "ungrouped": {"hosts": ["lonely"]},
+    "web": {"hosts": ["web1.example.com", "web2.example.com"]},
+    "db": {"hosts": ["db1", "db2"]},
+    "prod": {"children": ["web"], "hosts": ["db1"]},
+}
+
+
+@pytest.fixture
+def inventory() -> Inventory:
+    return Inventory(cast(Any, INVENTORY_DATA))
+
+
+@pytest.mark.parametrize(
+    ("pattern", "terms"),
+    [
+        ("web:&prod:!db1", ["web", "&prod", "!db1"]),
+        ("web,db", ["web", "db"]),
+        ("web[0:1]:db", ["web[0:1]", "db"]),
+    ],
+)
+def test_split_host_pattern(pattern, terms):
+    assert split_host_pattern(pattern) == terms
+
+
+@pytest.mark.parametrize(
+    ("pattern", "hosts"),
+    [
+        ("all", ["web1.example.com", "web2.example.com", "db1", "db2", "lonely"]),
+        ("prod", ["db1", "web1.example.com", "web2.example.com"]),
+        ("web:db2", ["web1.example.com", "web2.example.com", "db2"]),
+        ("prod:&db", ["db1"]),
+        ("all:!prod", ["db2", "lonely"]),
+        ("!web", ["db1", "db2", "lonely"]),
+        ("web*.example.com", ["web1.example.com", "web2.example.com"]),
+        ("~db[0-9]", ["db1", "db2"]),
+        ("d*", ["db1", "db2"]),
+        ("web[1]", ["web2.example.com"]),
+        ("db[0:1]", ["db1", "db2"]),
+        ("web2.example.com", ["web2.example.com"]),
+        ("missing", []),
+    ],
+)
+def test_inventory_resolves_host_patterns_like_ansible(inventory, pattern, hosts):
+    assert inventory.resolve(pattern) == hosts
+
+
+def test_inventory_resolves_limit_within_host_pattern_including_retry_files(inventory, tmp_path):
+    retry_file = tmp_path.joinpath("init.retry")
+    retry_file.write_text("db2\nweb1.example.com\n")
+
+    assert inventory.resolve_limit("prod", "db") == ["db1"]
+    assert inventory.resolve_limit("all", f"@{retry_file}") == ["web1.example.com", "db2"]
+    with pytest.raises(BoardwalkException, match="does not exist"):
+        inventory.resolve_limit("all", f"@{tmp_path.joinpath('missing')}")
+
+
+def test_inventory_group_index_maps_hosts_to_first_matching_group(inventory):
+    assert inventory.group_index("web:db") == {
+        "web1.example.com": "web",
+        "web2.example.com": "web",
+        "db1": "db",
+        "db2": "db",
+    }
+    assert inventory.group_index("p*")["db1"] == "prod"
+    assert inventory.group_index("") == {}
+
+
+def test_inventory_rejects_invalid_regex(inventory):
+    with pytest.raises(BoardwalkException, match="Invalid host pattern"):
+        inventory.resolve("~db(")
+
+
+def test_get_inventory_reuses_cache_until_sources_change_or_refresh(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("ANSIBLE_INVENTORY", raising=False)
+    monkeypatch.delenv("ANSIBLE_CONFIG", raising=False)
+    monkeypatch.setattr(inventory_module, "inventory_cache_dir", tmp_path.joinpath("cache"))
+    tmp_path.joinpath("ansible.cfg").write_text("[defaults]\ninventory = hosts.ini\n")
+    hosts_file = tmp_path.joinpath("hosts.ini")
+    hosts_file.write_text("db1\n")
+    calls = []
+
+    def fake_ansible_inventory():
+        calls.append(1)
+        return INVENTORY_DATA
+
+    monkeypatch.setattr(inventory_module, "ansible_inventory", fake_ansible_inventory)
+
+    def load(**kwargs):
+        monkeypatch.setattr(inventory_module, "_inventory", None)
+        return get_inventory(**kwargs)
+
+    assert load(ttl=60).resolve("db") == ["db1", "db2"]
+    load(ttl=60)
+    assert len(calls) == 1
+
+    hosts_file.write_text("db1\ndb2\n")
+    load(ttl=60)
+    assert len(calls) == 2
+    assert len(list(tmp_path.joinpath("cache").glob("*.json"))) == 1
+
+    load(ttl=60, refresh=True)
+    load(ttl=0)
+    assert len(calls) == 4
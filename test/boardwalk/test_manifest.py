@@ -1,7 +1,12 @@
+import sys
+import threading
+
 import pytest
 
-from boardwalk import Job, PlaybookJob, TaskJob, Workflow, WorkspaceConfig
+from boardwalk import Job, PlaybookJob, TaskJob, Workflow, Workspace, WorkspaceConfig, manifest, watcher
+from boardwalk.host import Host
 from boardwalk.manifest import JobTypes
+from boardwalk.state import HostMap, LocalState, ShardedLocalStateStore
 
 
 @pytest.fixture
@@ -154,3 +159,175 @@ def test_workspace_config_accepts_generic_inventory_var_grouping(empty_workflow_
 
     assert cfg.ui_group == ""
     assert cfg.ui_group_inventory_var == "site_group"
+
+
+def test_workspace_config_parallel_hosts_defaults_to_one(empty_workflow_class_fixture):
+    cfg = WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture())
+
+    assert cfg.parallel_hosts == 1
+
+
+def test_workspace_config_rejects_parallel_hosts_below_one(empty_workflow_class_fixture):
+    with pytest.raises(ValueError, match="parallel_hosts must be at least 1"):
+        WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture(), parallel_hosts=0)
+
+
+def test_workspace_config_rejects_unknown_ansible_backend(empty_workflow_class_fixture):
+    with pytest.raises(ValueError, match="Valid ansible_backend values are"):
+        WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture(), ansible_backend="ssh")
+
+
+@pytest.fixture
+def watched_workspace(monkeypatch, tmp_path, empty_workflow_class_fixture):
+    monkeypatch.setattr(manifest, "workspaces_dir", tmp_path)
+
+    class WatchedWorkspace(Workspace):
+        def config(self):
+            return WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture())
+
+    ws = WatchedWorkspace()
+    yield ws
+    ws.unwatch()
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_watched_workspace_sees_catch_and_release_from_other_processes(monkeypatch, watched_workspace, inotify):
+    if not inotify:
+        monkeypatch.setattr(watcher, "_inotify_init", lambda path: None)
+    watched_workspace._watcher.poll_interval = 0.05
+    watched_workspace.watch()
+    assert watched_workspace._watcher.backend == (
+        "inotify" if sys.platform.startswith("linux") and inotify else "polling"
+    )
+    assert not watched_workspace.caught()
+
+    catch_file = watched_workspace.path.joinpath("catch.lock")
+    catch_file.touch()
+    assert watched_workspace._watcher.wait("catch.lock", exists=True, timeout=5)
+    assert watched_workspace.caught()
+
+    threading.Timer(0.1, catch_file.unlink).start()
+    monkeypatch.setattr(manifest.time, "sleep", lambda seconds: pytest.fail("a watched workspace should not poll"))
+    watched_workspace.wait_for_release()
+    assert not watched_workspace.caught()
+
+
+def test_watched_workspace_reflects_its_own_mutex_immediately(watched_workspace):
+    watched_workspace.watch()
+
+    watched_workspace.mutex()
+    assert watched_workspace.has_mutex()
+    watched_workspace.unmutex()
+    assert not watched_workspace.has_mutex()
+
+
+def test_workspace_migrates_legacy_statefile_to_per_host_state(monkeypatch, tmp_path, empty_workflow_class_fixture):
+    monkeypatch.setattr(manifest, "workspaces_dir", tmp_path)
+    legacy = LocalState(
+        host_pattern="localhost",
+        hosts=HostMap({name: Host(name=name, ansible_facts={"ansible_hostname": name}) for name in ("b", "a/1")}),
+    )
+    tmp_path.joinpath("ShardedWorkspace").mkdir()
+    tmp_path.joinpath("ShardedWorkspace", "statefile.json").write_text(legacy.model_dump_json())
+
+    class ShardedWorkspace(Workspace):
+        def config(self):
+            return WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture())
+
+    ws = ShardedWorkspace()
+
+    assert ws.state.model_dump_json() == legacy.model_dump_json()
+    assert not ws.path.joinpath("statefile.json").exists()
+    assert ws.path.joinpath("statefile.json.migrated").exists()
+    assert ShardedLocalStateStore(ws.path).load().model_dump_json() == legacy.model_dump_json()
+
+
+def test_workspace_flush_host_rewrites_only_that_host(watched_workspace):
+    ws = watched_workspace
+    ws.state.hosts = {name: Host(name=name, ansible_facts={}) for name in ("a", "b")}
+    ws.flush()
+    untouched = ws.state_store.host_path("b").stat().st_mtime_ns
+    index = ws.state_store.index_path.stat().st_mtime_ns
+
+    ws.state.hosts["a"].ansible_facts = {"ansible_hostname": "a"}
+    ws.flush_host(ws.state.hosts["a"])
+
+    assert ws.state_store.host_path("b").stat().st_mtime_ns == untouched
+    assert ws.state_store.index_path.stat().st_mtime_ns == index
+    assert ShardedLocalStateStore(ws.path).load().hosts["a"].ansible_facts == {"ansible_hostname": "a"}
+
+    ws.state.hosts = {"c": Host(name="c", ansible_facts={})}
+    ws.flush()
+    assert list(ShardedLocalStateStore(ws.path).load().hosts) == ["c"]
+    assert not ws.state_store.host_path("a").exists()
+
+
+def test_workspace_loads_hosts_only_when_accessed(monkeypatch, watched_workspace):
+    ws = watched_workspace
+    ws.state.hosts = HostMap({name: Host(name=name, ansible_facts={"ansible_hostname": name}) for name in "abc"})
+    ws.flush()
+    expected_dump = ws.state.model_dump_json()
+
+    loaded = []
+    store = ShardedLocalStateStore(ws.path)
+    original_load_host = store.load_host
+    monkeypatch.setattr(store, "load_host", lambda name: loaded.append(name) or original_load_host(name))
+    state = store.load()
+
+    assert list(state.hosts) == ["a", "b", "c"]
+    assert "b" in state.hosts
+    assert loaded == []
+    assert state.hosts["b"].ansible_facts == {"ansible_hostname": "b"}
+    assert loaded == ["b"]
+
+    store.save(state)
+    assert state.model_dump_json() == expected_dump
+    assert loaded == ["b", "a", "c"]
+
+
+def test_workspace_config_rejects_negative_inventory_cache_ttl(empty_workflow_class_fixture):
+    with pytest.raises(ValueError, match="inventory_cache_ttl must not be negative"):
+        WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture(), inventory_cache_ttl=-1)
+
+
+def test_workspace_config_setup_args_always_include_facts_boardwalk_needs(empty_workflow_class_fixture):
+    cfg = WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture())
+    assert cfg.setup_args == {"gather_timeout": 30}
+
+    cfg.gather_subset = ["!all", "!min", "distribution"]
+    cfg.fact_filter = ["ansible_distribution*", "ansible_local"]
+    assert cfg.setup_args == {
+        "gather_timeout": 30,
+        "gather_subset": ["!all", "!min", "distribution", "local", "platform"],
+        "filter": ["ansible_distribution*", "ansible_local", "ansible_system"],
+    }
+
+
+def test_workspace_config_filter_facts_keeps_allowlisted_and_required_facts(empty_workflow_class_fixture):
+    facts = {
+        "ansible_distribution": "Debian",
+        "ansible_distribution_major_version": "12",
+        "ansible_local": {"boardwalk_state": {}},
+        "ansible_mounts": [{"mount": "/"}],
+        "ansible_system": "Linux",
+    }
+    cfg = WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture())
+    assert cfg.filter_facts(facts) == facts
+
+    cfg.kept_facts = ["ansible_distribution*"]
+    assert cfg.filter_facts(facts) == {
+        "ansible_distribution": "Debian",
+        "ansible_distribution_major_version": "12",
+        "ansible_local": {"boardwalk_state": {}},
+        "ansible_system": "Linux",
+    }
+
+
+def test_workspace_config_rejects_negative_facts_ttl(empty_workflow_class_fixture):
+    with pytest.raises(ValueError, match="facts_ttl must not be negative"):
+        WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture(), facts_ttl=-1)
+
+
+def test_workspace_config_rejects_negative_prefetch_hosts(empty_workflow_class_fixture):
+    with pytest.raises(ValueError, match="prefetch_hosts must not be negative"):
+        WorkspaceConfig(host_pattern="localhost", workflow=empty_workflow_class_fixture(), prefetch_hosts=-1)
@@ -80,6 +80,9 @@ def test_serve_passes_theme_options_to_server_run():
     assert result.exit_code == 0
     kwargs = run_mock.call_args.kwargs
     assert kwargs["demo"] is False
+    assert kwargs["state_flush_interval"] == 1.0
+    assert kwargs["state_snapshot_records"] == 1000
+    assert kwargs["state_store"] == "journal"
     assert kwargs["theme_static_path"] == "."
     assert kwargs["theme_css_url"] == "/theme-static/boardwalkd-custom.css"
     assert kwargs["theme_logo_url"] == "/theme-static/custom-logo.svg"
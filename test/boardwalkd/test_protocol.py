@@ -1,7 +1,13 @@
+import threading
+import time
+from io import BytesIO
+
 import pytest
 from pydantic_core import ValidationError
+from tornado.httpclient import HTTPClientError, HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
 
-from boardwalkd.protocol import WorkspaceDetails
+from boardwalkd.protocol import Client, WorkspaceDetails, WorkspaceEvent, WorkspaceNotFound
 
 
 @pytest.mark.parametrize(
@@ -33,3 +39,184 @@ def test_WorkspaceDetails_raises_when_invalid_url_scheme_provided(url: str):
     errors = exc_info.value.errors()
     assert len(errors) == 1
     assert errors[0]["type"] == "invalid_WorkspaceDetails_deployment_url_scheme"
+
+
+class RecordingClient(Client):
+    """Client that records posted events instead of sending them"""
+
+    def __init__(self, fail_first: int = 0):
+        super().__init__("http://boardwalkd.example.network")
+        self.fail_first = fail_first
+        self.posted: list[str] = []
+        self.posting_threads: set[str] = set()
+        self.requests = 0
+        self.attempts = 0
+
+    def workspace_post_events(self, workspace_name, batch):
+        self.posting_threads.add(threading.current_thread().name)
+        self.attempts += 1
+        if self.fail_first:
+            self.fail_first -= 1
+            raise ConnectionRefusedError
+        self.posted.extend(item.event.message for item in batch)
+        self.requests += 1
+
+
+def test_queued_events_are_sent_in_order_by_background_sender():
+    client = RecordingClient()
+
+    for i in range(50):
+        client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message=str(i)))
+
+    assert client.drain_event_queue(timeout=5)
+    client.event_sender_close()
+    assert client.posted == [str(i) for i in range(50)]
+    assert client.posting_threads == {"boardwalkd_event_sender"}
+
+
+def test_event_sender_retries_without_dropping_or_reordering_events():
+    client = RecordingClient(fail_first=1)
+
+    client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message="first"))
+    client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message="second"))
+
+    assert client.drain_event_queue(timeout=5)
+    client.event_sender_close()
+    assert client.posted == ["first", "second"]
+
+
+def test_queued_events_dont_cut_the_retry_backoff_short():
+    client = RecordingClient(fail_first=1)
+
+    client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message="first"))
+    deadline = time.monotonic() + 5
+    while client.attempts == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for i in range(10):
+        client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message=str(i)))
+    time.sleep(0.3)
+
+    # The sender is still backing off after the first failure
+    assert client.attempts == 1
+    # Flushing doesn't wait for the backoff
+    assert client.drain_event_queue(timeout=0.5)
+    client.event_sender_close()
+    assert client.posted == ["first"] + [str(i) for i in range(10)]
+
+
+def test_drain_event_queue_is_bounded_when_server_is_unreachable():
+    client = RecordingClient(fail_first=1000)
+
+    client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message="lost"))
+
+    assert not client.drain_event_queue(timeout=0.2)
+    client.event_sender_close(timeout=0)
+    assert len(client.event_queue) == 1
+
+
+def test_post_event_batch_sends_one_request_per_workspace_run():
+    client = RecordingClient()
+    for workspace_name, message in [("a", "1"), ("a", "2"), ("b", "3"), ("a", "4")]:
+        client.event_queue.append(
+            {
+                "workspace_name": workspace_name,
+                "workspace_event": WorkspaceEvent(severity="info", message=message),
+                "broadcast": False,
+            }
+        )
+
+    client.post_event_batch(list(client.event_queue))
+
+    assert client.posted == ["1", "2", "3", "4"]
+    assert client.requests == 3
+    assert len(client.event_queue) == 0
+
+
+class OlderServerClient(Client):
+    """Client for a server without the bulk events endpoint, which knows of the given workspaces"""
+
+    def __init__(self, bulk_code: int, workspaces: tuple[str, ...] = ("workspace",)):
+        super().__init__("http://boardwalkd.example.network")
+        self.bulk_code = bulk_code
+        self.workspaces = workspaces
+        self.paths: list[str] = []
+
+    def authenticated_request(self, path, method="GET", body=None, auto_login_prompt=True):
+        self.paths.append(path)
+        if path.endswith("/events"):
+            raise HTTPClientError(self.bulk_code)
+        if path.split("/")[3] not in self.workspaces:
+            raise HTTPClientError(404)
+        return HTTPResponse(HTTPRequest(path), 200, buffer=BytesIO())
+
+
+@pytest.mark.parametrize("bulk_code", [404, 405])
+def test_post_event_batch_falls_back_to_single_events_on_older_servers(bulk_code: int):
+    client = OlderServerClient(bulk_code)
+    for message in ("1", "2"):
+        client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message=message))
+
+    assert client.drain_event_queue(timeout=5)
+    client.workspace_queue_event("workspace", WorkspaceEvent(severity="info", message="3"))
+    assert client.drain_event_queue(timeout=5)
+    client.event_sender_close()
+
+    assert client.bulk_events_supported is False
+    # The bulk endpoint is only tried once
+    assert client.paths.count("/api/workspace/workspace/events") == 1
+    assert client.paths.count("/api/workspace/workspace/event") == 3
+
+
+def test_post_event_batch_fallback_still_reports_missing_workspaces():
+    client = OlderServerClient(404, workspaces=())
+    client.event_queue.append(
+        {
+            "workspace_name": "missing",
+            "workspace_event": WorkspaceEvent(severity="info", message="x"),
+            "broadcast": False,
+        }
+    )
+
+    with pytest.raises(WorkspaceNotFound):
+        client.post_event_batch(list(client.event_queue))
+    assert len(client.event_queue) == 1
+
+
+class RedirectedClient(Client):
+    """Client whose server redirects the first request to location"""
+
+    def __init__(self, location: str):
+        super().__init__("http://boardwalkd.example.network")
+        self.location = location
+        self.sent: list[HTTPRequest] = []
+
+    def _fetch_once(self, request):
+        self.sent.append(request)
+        if len(self.sent) == 1:
+            return HTTPResponse(request, 307, headers=HTTPHeaders({"Location": self.location}), buffer=BytesIO())
+        return HTTPResponse(request, 200, buffer=BytesIO())
+
+
+@pytest.mark.parametrize(
+    ("location", "followed"),
+    [
+        pytest.param("/api/moved", True, id="relative"),
+        pytest.param("http://boardwalkd.example.network:80/api/moved", True, id="default_port"),
+        pytest.param("https://boardwalkd.example.network/api/moved", False, id="other_scheme"),
+        pytest.param("http://elsewhere.example.network/api/moved", False, id="other_host"),
+        pytest.param("http://boardwalkd.example.network:8080/api/moved", False, id="other_port"),
+    ],
+)
+def test_fetch_only_follows_redirects_to_the_same_origin(location: str, followed: bool):
+    client = RedirectedClient(location)
+    request = HTTPRequest("http://boardwalkd.example.network/api/workspace", headers={"boardwalk-api-token": "secret"})
+
+    if followed:
+        assert client.fetch(request).code == 200
+        assert client.sent[-1].url.endswith("/api/moved")
+        assert client.sent[-1].headers["boardwalk-api-token"] == "secret"
+    else:
+        with pytest.raises(HTTPClientError) as exc_info:
+            client.fetch(request)
+        assert exc_info.value.code == 307
+        assert len(client.sent) == 1
@@ -1,14 +1,24 @@
+import asyncio
 import html
 import json
 import re
+import tempfile
+import time
 from datetime import UTC, datetime
+from pathlib import Path
 from urllib.parse import urlencode
 
 from tornado.testing import AsyncHTTPTestCase
 from tornado.web import create_signed_value
 
 import boardwalkd.server as boardwalkd_server
-from boardwalkd.protocol import WorkspaceDetails, WorkspaceSemaphores
+from boardwalkd.protocol import (
+    SEMAPHORES_VERSION_HEADER,
+    Client,
+    WorkspaceDetails,
+    WorkspaceEvent,
+    WorkspaceSemaphores,
+)
 from boardwalkd.state import WorkspaceState
 
 
@@ -18,6 +28,17 @@ class FakeServerState:
         self.users = {}
         self.flush_calls = 0
         self.flush_error: Exception | None = None
+        self.journal: list[tuple[str, str]] = []
+
+    def append_event(self, workspace: str, event):
+        self.workspaces[workspace].events.append(event)
+        self.journal.append(("event", workspace))
+
+    def record_workspace(self, workspace: str):
+        self.journal.append(("workspace", workspace))
+
+    def record_user(self, email: str):
+        self.journal.append(("user", email))
 
     def flush(self):
         self.flush_calls += 1
@@ -79,6 +100,7 @@ class TestBoardwalkServer(AsyncHTTPTestCase):
         self.fake_state.workspaces = workspaces
         self.fake_state.flush_calls = 0
         self.fake_state.flush_error = None
+        self.fake_state.journal = []
 
     def post_json(self, path: str, payload: dict[str, str]):
         return self.fetch(
@@ -237,3 +259,187 @@ class TestBoardwalkServer(AsyncHTTPTestCase):
         assert self.fake_state.workspaces is original_mapping
         assert tuple(self.fake_state.workspaces.items()) == original_items
         assert self.fake_state.flush_calls == 1
+
+    def test_bulk_events_are_appended_in_order_and_journaled(self):
+        self.set_workspaces({"known": workspace()})
+
+        response = self.post_json(
+            "/api/workspace/known/events",
+            [  # type: ignore[arg-type]
+                {"event": {"severity": "info", "message": "first"}},
+                {"event": {"severity": "success", "message": "second"}, "broadcast": True},
+            ],
+        )
+
+        assert response.code == 200
+        events = self.fake_state.workspaces["known"].events
+        assert [event.message for event in events] == ["first", "second"]
+        assert all(event.received_time is not None for event in events)
+        # Each event is journaled instead of rewriting the statefile
+        assert self.fake_state.journal == [("event", "known"), ("event", "known")]
+        assert self.fake_state.flush_calls == 0
+
+    def test_bulk_events_reject_whole_batch_when_any_event_is_invalid(self):
+        self.set_workspaces({"known": workspace()})
+
+        response = self.post_json(
+            "/api/workspace/known/events",
+            [  # type: ignore[arg-type]
+                {"event": {"severity": "info", "message": "valid"}},
+                {"event": {"severity": "loud", "message": "invalid"}},
+            ],
+        )
+
+        assert response.code == 422
+        assert len(self.fake_state.workspaces["known"].events) == 0
+        assert self.fake_state.journal == []
+
+    def test_bulk_events_reject_oversized_batch_before_validating_events(self):
+        self.set_workspaces({"known": workspace()})
+
+        # The items aren't valid events, but the batch is rejected for its size first
+        response = self.post_json("/api/workspace/known/events", [{}] * 1001)  # type: ignore[arg-type]
+
+        assert response.code == 413
+        assert self.fake_state.journal == []
+
+    def test_bulk_events_for_unknown_workspace_return_not_found(self):
+        self.set_workspaces({})
+
+        response = self.post_json(
+            "/api/workspace/missing/events",
+            [{"event": {"severity": "info", "message": "lost"}}],  # type: ignore[arg-type]
+        )
+
+        assert response.code == 404
+        assert self.fake_state.journal == []
+
+    def get_events_page(self, query: str):
+        response = self.fetch(f"/api/workspace/known/events?{query}", headers={"boardwalk-api-token": self.api_token})
+        assert response.code == 200
+        page = json.loads(response.body)
+        assert not page["history_truncated"]
+        return [event["id"] for event in page["events"]], page["before"]
+
+    def test_events_history_is_paginated_newest_first(self):
+        events_workspace = workspace()
+        for i, severity in enumerate(["info", "error", "info", "success", "info"]):
+            events_workspace.append_event(WorkspaceEvent(severity=severity, message=str(i)))
+        self.set_workspaces({"known": events_workspace})
+
+        assert self.get_events_page("limit=2") == ([5, 4], 4)
+        assert self.get_events_page("limit=2&before=4") == ([3, 2], 2)
+        assert self.get_events_page("limit=2&before=2") == ([1], None)
+        assert self.get_events_page("after=3") == ([5, 4], None)
+        assert self.get_events_page("severity=info") == ([5, 3, 1], None)
+        for query in ("limit=0", "limit=501", "before=x", "severity=loud"):
+            with self.subTest(query=query):
+                response = self.fetch(
+                    f"/api/workspace/known/events?{query}", headers={"boardwalk-api-token": self.api_token}
+                )
+                assert response.code == 400
+
+    def test_events_table_polls_for_newer_events_and_loads_older_pages_on_scroll(self):
+        events_workspace = workspace()
+        for i in range(60):
+            events_workspace.append_event(WorkspaceEvent(severity="info", message=str(i)))
+        self.set_workspaces({"known": events_workspace})
+
+        first_page = self.fetch("/workspace/known/events/table", headers={"Cookie": self.cookie}).body.decode()
+        last_page = self.fetch("/workspace/known/events/table?before=11", headers={"Cookie": self.cookie}).body.decode()
+
+        assert 'hx-get="/workspace/known/events/table?after=60&severity="' in first_page
+        assert 'hx-get="/workspace/known/events/table?before=11&severity="' in first_page
+        assert first_page.count("<tr") == 51
+        assert "hx-get" not in last_page
+        assert last_page.count("<tr") == 10
+        assert "--state-store=sqlite" not in last_page
+
+    def test_events_history_says_when_older_events_were_dropped(self):
+        events_workspace = workspace()
+        for i in range(70):
+            events_workspace.append_event(WorkspaceEvent(severity="info", message=str(i)))
+        self.set_workspaces({"known": events_workspace})
+
+        response = self.fetch("/api/workspace/known/events?before=10", headers={"boardwalk-api-token": self.api_token})
+        first_page = self.fetch("/workspace/known/events/table", headers={"Cookie": self.cookie}).body.decode()
+        last_page = self.fetch("/workspace/known/events/table?before=10", headers={"Cookie": self.cookie}).body.decode()
+
+        page = json.loads(response.body)
+        assert [event["id"] for event in page["events"]] == [9, 8, 7]
+        assert page["history_truncated"]
+        assert "--state-store=sqlite" not in first_page
+        assert "--state-store=sqlite" in last_page
+
+    def test_protocol_client_reuses_connection_and_caches_token(self):
+        self.set_workspaces({"known": workspace(mutexed=True)})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = Client(self.get_url("/"))
+            client.api_token_file = Path(tmp_dir).joinpath("api_token.txt")
+            client.api_token_file.write_text(self.api_token)
+
+            def get_semaphores_three_times():
+                results = [client.workspace_get_semaphores("known")]
+                # The token is cached after the first request
+                client.api_token_file.unlink()
+                results += [client.workspace_get_semaphores("known") for _ in range(2)]
+                return results
+
+            results = self.io_loop.run_sync(lambda: self.io_loop.run_in_executor(None, get_semaphores_three_times))
+
+        assert [result.has_mutex for result in results] == [True, True, True]
+        assert client.request_stats["count"] == 3
+        assert client.request_stats["errors"] == 0
+        assert len(client._all_connections) == 1
+        client.close()
+
+    def test_semaphores_wait_returns_as_soon_as_workspace_is_released(self):
+        caught = workspace(active=True)
+        caught.semaphores.caught = True
+        self.set_workspaces({"known": caught})
+        headers = {"boardwalk-api-token": self.api_token}
+        response = self.fetch("/api/workspace/known/semaphores", headers=headers)
+        version = response.headers[SEMAPHORES_VERSION_HEADER]
+
+        async def release_while_waiting():
+            waiting = self.http_client.fetch(
+                self.get_url(f"/api/workspace/known/semaphores?version={version}&wait=10"), headers=headers
+            )
+            await asyncio.sleep(0.1)
+            released = await self.http_client.fetch(
+                self.get_url("/workspace/known/semaphores/caught"),
+                method="DELETE",
+                headers={"Cookie": self.cookie},
+            )
+            assert released.code == 200
+            return await waiting
+
+        start = time.monotonic()
+        response = self.io_loop.run_sync(release_while_waiting)
+
+        assert time.monotonic() - start < 5
+        assert json.loads(response.body)["caught"] is False
+        assert response.headers[SEMAPHORES_VERSION_HEADER] != version
+
+    def test_semaphores_wait_times_out_with_unchanged_version(self):
+        self.set_workspaces({"known": workspace()})
+        headers = {"boardwalk-api-token": self.api_token}
+        version = self.fetch("/api/workspace/known/semaphores", headers=headers).headers[SEMAPHORES_VERSION_HEADER]
+
+        response = self.fetch(f"/api/workspace/known/semaphores?version={version}&wait=0.2", headers=headers)
+
+        assert response.code == 200
+        assert response.headers[SEMAPHORES_VERSION_HEADER] == version
+
+    def test_semaphores_wait_rejects_values_that_arent_finite(self):
+        self.set_workspaces({"known": workspace()})
+        headers = {"boardwalk-api-token": self.api_token}
+        version = self.fetch("/api/workspace/known/semaphores", headers=headers).headers[SEMAPHORES_VERSION_HEADER]
+
+        for wait in ("nan", "inf", "-inf"):
+            with self.subTest(wait=wait):
+                response = self.fetch(f"/api/workspace/known/semaphores?version={version}&wait={wait}", headers=headers)
+                assert response.code == 400
+        # Negative waits don't wait at all
+        response = self.fetch(f"/api/workspace/known/semaphores?version={version}&wait=-5", headers=headers)
+        assert response.code == 200
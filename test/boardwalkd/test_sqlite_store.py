@@ -0,0 +1,92 @@
+import pytest
+
+from boardwalkd import state as state_module
+from boardwalkd.protocol import WorkspaceEvent
+from boardwalkd.sqlite_store import SQLiteStateStore
+from boardwalkd.state import JournalStateStore, State, User, WorkspaceState, use_store
+
+
+@pytest.fixture
+def statefile(monkeypatch, tmp_path):
+    path = tmp_path.joinpath("statefile.json")
+    monkeypatch.setattr(state_module, "statefile_dir_path", tmp_path)
+    monkeypatch.setattr(state_module, "statefile_path", path)
+    return path
+
+
+@pytest.fixture
+def sqlite_store(monkeypatch, statefile):
+    store = SQLiteStateStore(statefile.parent.joinpath("state.sqlite3"))
+    monkeypatch.setattr(state_module, "store", store)
+    yield store
+    store.close()
+
+
+def test_sqlite_store_keeps_full_event_history_and_loads_recent_events(sqlite_store):
+    state = sqlite_store.load()
+    state.workspaces["known"] = WorkspaceState()
+    state.workspaces["known"].semaphores.has_mutex = True
+    state.record_workspace("known")
+    for i in range(100):
+        state.append_event("known", WorkspaceEvent(severity="info", message=str(i)))
+    state.users["user@example.com"] = User(email="user@example.com")
+    state.record_user("user@example.com")
+    sqlite_store.close()
+
+    loaded = sqlite_store.load()
+
+    assert sqlite_store.connection.execute("SELECT count(*) FROM events").fetchone() == (100,)
+    events = loaded.workspaces["known"].events
+    assert [event.message for event in events] == [str(i) for i in range(36, 100)]
+    assert loaded.workspaces["known"].semaphores.has_mutex
+    assert set(loaded.users) == {"user@example.com"}
+    assert sqlite_store.metrics()["writes"] == 102
+
+
+def test_sqlite_store_flush_deletes_removed_workspaces_and_their_events(sqlite_store):
+    state = sqlite_store.load()
+    for name in ("delete_me", "kept"):
+        state.workspaces[name] = WorkspaceState()
+        state.record_workspace(name)
+        state.append_event(name, WorkspaceEvent(severity="info", message=name))
+
+    del state.workspaces["delete_me"]
+    state.flush()
+
+    assert sqlite_store.connection.execute("SELECT workspace FROM events").fetchall() == [("kept",)]
+    assert set(sqlite_store.load().workspaces) == {"kept"}
+
+
+def test_sqlite_store_imports_the_journal_statefile_when_created(monkeypatch, statefile, sqlite_store):
+    journal_store = JournalStateStore(interval=60)
+    monkeypatch.setattr(state_module, "store", journal_store)
+    state = State(workspaces={"known": WorkspaceState()})
+    state.flush()
+    # Only in the journal, not the snapshot
+    state.append_event("known", WorkspaceEvent(severity="info", message="journaled"))
+
+    use_store(state, sqlite_store)
+
+    assert state_module.store is sqlite_store
+    assert [event.message for event in state.workspaces["known"].events] == ["journaled"]
+    assert sqlite_store.connection.execute("SELECT count(*) FROM events").fetchone() == (1,)
+    # Importing only happens into an empty database
+    statefile.write_text(State(workspaces={"other": WorkspaceState()}).model_dump_json())
+    assert set(sqlite_store.load().workspaces) == {"known"}
+
+
+def test_sqlite_store_pages_through_event_history(sqlite_store):
+    state = sqlite_store.load()
+    state.workspaces["known"] = WorkspaceState()
+    for i in range(100):
+        state.append_event("known", WorkspaceEvent(severity="error" if i % 10 == 0 else "info", message=str(i)))
+
+    def messages(**kwargs):
+        return [event.message for _, event in sqlite_store.events(state, "known", **kwargs)]
+
+    assert messages(limit=3) == ["99", "98", "97"]
+    # Events no longer held in memory are still in the history
+    assert messages(before=3) == ["1", "0"]
+    assert messages(after=98) == ["99", "98"]
+    assert messages(severity="error", before=32) == ["30", "20", "10", "0"]
+    assert not sqlite_store.history_truncated(state, "known")
@@ -0,0 +1,170 @@
+import asyncio
+import json
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from boardwalkd import state as state_module
+from boardwalkd.protocol import WorkspaceEvent
+from boardwalkd.state import (
+    JournalStateStore,
+    State,
+    User,
+    WorkspaceState,
+    event_time,
+    journal_segments,
+    load_state,
+)
+
+
+@pytest.fixture
+def statefile(monkeypatch, tmp_path):
+    path = tmp_path.joinpath("statefile.json")
+    monkeypatch.setattr(state_module, "statefile_dir_path", tmp_path)
+    monkeypatch.setattr(state_module, "statefile_path", path)
+    return path
+
+
+@pytest.fixture
+def persister(monkeypatch, statefile):
+    persister = JournalStateStore(interval=60)
+    monkeypatch.setattr(state_module, "store", persister)
+    yield persister
+    persister.close()
+
+
+def test_mutations_are_journaled_and_replayed_on_top_of_the_snapshot(persister, statefile):
+    state = State(workspaces={"known": WorkspaceState()})
+    state.flush()
+    state.append_event("known", WorkspaceEvent(severity="info", message="first"))
+    state.workspaces["known"].semaphores.caught = True
+    state.record_workspace("known")
+    state.users["user@example.com"] = User(email="user@example.com", roles={"admin"})
+    state.record_user("user@example.com")
+    persister.close()
+
+    # The snapshot wasn't rewritten; the changes are only in the journal
+    assert json.loads(statefile.read_text())["workspaces"]["known"]["events"] == []
+    assert len(journal_segments()) == 1
+    recovered = load_state()
+
+    assert [event.message for event in recovered.workspaces["known"].events] == ["first"]
+    assert recovered.workspaces["known"].semaphores.caught
+    assert recovered.users["user@example.com"].roles == {"admin"}
+    # Loading compacts the journal into a new snapshot
+    assert recovered.journal_seq == 3
+    assert journal_segments() == []
+    assert json.loads(statefile.read_text())["workspaces"]["known"]["semaphores"]["caught"]
+
+
+def test_replay_ignores_an_incomplete_record_and_journaled_records_in_the_snapshot(persister, statefile):
+    state = State(workspaces={"known": WorkspaceState()})
+    state.append_event("known", WorkspaceEvent(severity="info", message="snapshotted"))
+    state.flush()
+    state.append_event("known", WorkspaceEvent(severity="info", message="journaled"))
+    persister.close()
+    # Write a record that's both newer than the snapshot and torn by a crash
+    with open(journal_segments()[-1][1], "a") as fd:
+        fd.write('{"seq": 3, "op": "ev')
+    # A segment the snapshot already includes, left by a crash before it was deleted
+    statefile.parent.joinpath(f"{state_module.journal_prefix}{1:012d}").write_text(
+        json.dumps({"seq": 1, "op": "event", "workspace": "known", "event": {"severity": "info", "message": "x"}})
+    )
+
+    recovered = load_state()
+
+    assert [event.message for event in recovered.workspaces["known"].events] == ["snapshotted", "journaled"]
+
+
+def test_invalid_statefile_is_kept_aside(persister, statefile):
+    statefile.write_text("{")
+
+    assert load_state().workspaces == {}
+    assert len(list(statefile.parent.glob("statefile.json.invalid.*"))) == 1
+
+
+def test_snapshot_is_written_behind_once_enough_records_are_journaled(persister, statefile):
+    persister.interval = 0.05
+    persister.snapshot_records = 5
+    state = State(workspaces={"known": WorkspaceState()})
+
+    async def append_events():
+        for i in range(7):
+            state.append_event("known", WorkspaceEvent(severity="info", message=str(i)))
+        assert not statefile.exists()
+        while persister.writes == 0 or persister.metrics()["write_in_flight"]:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(append_events())
+
+    assert len(json.loads(statefile.read_text())["workspaces"]["known"]["events"]) == 7
+    assert journal_segments() == []
+    metrics = persister.metrics()
+    assert metrics["journal_records"] == 7
+    assert metrics["journal_records_since_snapshot"] == 0
+    assert metrics["writes"] == 1
+
+
+def test_persister_flush_supersedes_pending_write(persister, statefile):
+    persister.snapshot_records = 1
+    state = State(workspaces={"known": WorkspaceState()})
+
+    async def record_then_flush():
+        state.append_event("known", WorkspaceEvent(severity="info", message="first"))
+        assert persister._timer is not None
+        state.flush()
+        assert persister._timer is None
+
+    asyncio.run(record_then_flush())
+
+    assert len(json.loads(statefile.read_text())["workspaces"]["known"]["events"]) == 1
+    # An older snapshot never replaces a newer one
+    persister._write(persister._generation - 1, "{}", 0, 0, 0)
+    assert "known" in json.loads(statefile.read_text())["workspaces"]
+    assert persister.writes == 1
+
+
+def test_persister_keeps_records_pending_when_a_write_fails(monkeypatch, persister):
+    persister.snapshot_records = 1
+
+    def fail(data: str):
+        raise OSError("disk unavailable")
+
+    monkeypatch.setattr(state_module, "write_statefile", fail)
+
+    with pytest.raises(OSError):
+        State(workspaces={"known": WorkspaceState()}).append_event(
+            "known", WorkspaceEvent(severity="info", message="x")
+        )
+    assert persister.write_errors == 1
+    assert persister.records_since_snapshot == 1
+
+
+def assert_summary_matches_events(workspace: WorkspaceState):
+    events = list(workspace.events)
+    terminal = [event for event in events if event.severity in ("error", "success")]
+    summary = workspace.summary
+    assert summary.latest is max(events, key=event_time)
+    assert summary.latest_terminal is (max(terminal, key=event_time) if terminal else None)
+    assert summary.newest_first == sorted(events, key=event_time, reverse=True)
+
+
+def test_workspace_event_summary_is_maintained_as_events_are_appended():
+    start = datetime(2026, 1, 1, tzinfo=UTC)
+    workspace = WorkspaceState()
+    workspace.append_event(WorkspaceEvent(severity="success", message="done", create_time=start))
+    for i in range(1, 64):
+        workspace.append_event(WorkspaceEvent(severity="info", message=str(i), create_time=start + timedelta(i)))
+    # Out of order, and created at the same time as another event
+    workspace.append_event(WorkspaceEvent(severity="error", message="late", create_time=start + timedelta(10)))
+    summary = workspace.summary
+
+    # The success event was dropped from the full deque
+    assert summary.latest_terminal is not None and summary.latest_terminal.message == "late"
+    assert_summary_matches_events(workspace)
+    assert workspace.summary is summary
+
+    # Changing events directly rebuilds the summary
+    workspace.events.append(WorkspaceEvent(severity="success", message="direct", create_time=start + timedelta(99)))
+    assert workspace.summary is not summary
+    assert_summary_matches_events(workspace)